@@ -0,0 +1,357 @@
+# api_benchmark.py - Load test of the Flask API: N simulated browser UIs polling while M downloads run
+
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+from benchmark import get_commit
+from metrics_store import percentile
+from throttled_server import ThrottledOrigin, parse_size
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_RESULTS_FILE = os.path.join(REPO_DIR, 'api_results.jsonl')
+
+# What static/app.js does: every STATUS_INTERVAL it fetches each active
+# download's status in turn, and drops a download HISTORY_DELAY after seeing
+# it finish. The file list is loaded on start and when a download completes
+# while the files page is open.
+STATUS_INTERVAL = 1.0
+HISTORY_DELAY = 3.0
+SAMPLE_INTERVAL = 0.5  # seconds between server CPU / RSS samples
+
+# The app under test, on a given port, without the reloader or debugger
+SERVER_CODE = ("import sys, app; app.app.run(host='127.0.0.1', port=int(sys.argv[1]), threaded=True, "
+               "debug=False, use_reloader=False)")
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+class ProcessSampler:
+    """
+    CPU and resident memory of a process, sampled in a background thread
+    from /proc (Linux). Elsewhere the figures stay None.
+    """
+
+    def __init__(self, pid, interval=SAMPLE_INTERVAL):
+        self.pid = pid
+        self.interval = interval
+        self.ticks = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+        self.samples = []  # (time, CPU seconds, RSS bytes)
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def read(self):
+        try:
+            with open(f'/proc/{self.pid}/stat') as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+            with open(f'/proc/{self.pid}/statm') as f:
+                pages = int(f.read().split()[1])
+        except (OSError, IndexError, ValueError):
+            return None
+        cpu = (int(fields[11]) + int(fields[12])) / self.ticks  # utime + stime
+        return time.time(), cpu, pages * os.sysconf('SC_PAGE_SIZE')
+
+    def run(self):
+        while True:
+            sample = self.read()
+            if sample:
+                self.samples.append(sample)
+            if self.stop_event.wait(self.interval):
+                return
+
+    def start(self):
+        self.samples = []
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Stop sampling. Returns average CPU %, peak RSS in MB and CPU seconds used (None without /proc)."""
+        self.stop_event.set()
+        self.thread.join()
+        sample = self.read()
+        if sample:
+            self.samples.append(sample)
+        if len(self.samples) < 2:
+            return {'cpu_percent': None, 'peak_rss_mb': None, 'cpu_seconds': None}
+        (t0, cpu0, _), (t1, cpu1, _) = self.samples[0], self.samples[-1]
+        return {
+            'cpu_percent': 100 * (cpu1 - cpu0) / (t1 - t0) if t1 > t0 else None,
+            'peak_rss_mb': max(rss for _, _, rss in self.samples) / (1024 * 1024),
+            'cpu_seconds': cpu1 - cpu0
+        }
+
+
+class SimulatedUI:
+    """
+    One browser tab of the web UI. It polls the status of every download the
+    round started, once a second and one after the other, and stops polling a
+    download HISTORY_DELAY after it finished. A tab on the files page also
+    reloads the file list when a download completes, and every
+    `files_interval` seconds (the Refresh button). `stats_interval` adds a
+    dashboard poll of /api/stats. Each tab keeps its own connection.
+    """
+
+    def __init__(self, base_url, download_ids, latencies, files_page=False, files_interval=0, stats_interval=0):
+        self.base_url = base_url
+        self.download_ids = download_ids
+        self.latencies = latencies
+        self.files_page = files_page
+        self.files_interval = files_interval
+        self.stats_interval = stats_interval
+        self.http = requests.Session()
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def get(self, endpoint, path):
+        """GET the path, recording (endpoint, ms, ok). Returns the JSON body or None."""
+        start = time.perf_counter()
+        try:
+            response = self.http.get(self.base_url + path, timeout=30)
+            ok = response.status_code == 200
+            body = response.json() if ok else None
+        except (requests.exceptions.RequestException, ValueError):
+            ok, body = False, None
+        self.latencies.append((endpoint, (time.perf_counter() - start) * 1000, ok))
+        return body
+
+    def run(self):
+        self.get('files', '/api/files')
+        active = {download_id: None for download_id in self.download_ids}  # id -> when seen finished
+        next_files = time.time() + self.files_interval if self.files_interval else None
+        next_stats = time.time() if self.stats_interval else None
+        while not self.stop_event.is_set():
+            tick = time.time()
+            for download_id, finished_at in list(active.items()):
+                if finished_at is not None:
+                    if tick - finished_at >= HISTORY_DELAY:
+                        del active[download_id]
+                    continue
+                status = self.get('status', f'/api/downloads/{download_id}')
+                if status and status.get('status') in ('completed', 'failed', 'cancelled'):
+                    active[download_id] = time.time()
+                    if self.files_page and status['status'] == 'completed':
+                        self.get('files', '/api/files')
+            if self.files_page and next_files is not None and tick >= next_files:
+                self.get('files', '/api/files')
+                next_files = tick + self.files_interval
+            if next_stats is not None and tick >= next_stats:
+                self.get('stats', '/api/stats')
+                next_stats = tick + self.stats_interval
+            self.stop_event.wait(max(0.0, STATUS_INTERVAL - (time.time() - tick)))
+
+    def stop(self):
+        self.stop_event.set()
+        self.thread.join()
+        self.http.close()
+
+
+def run_round(uis, args, base_url, origin, sampler, round_number):
+    """Start the round's downloads, run `uis` simulated tabs until they finish, and measure both."""
+    http = requests.Session()
+    latencies = []
+    if sampler:
+        sampler.start()
+    started = time.time()
+    download_ids = []
+    for i in range(args.downloads):
+        url = origin.url_for(args.size, f'load_{round_number}_{i}.bin')
+        start = time.perf_counter()
+        response = http.post(base_url + '/api/downloads', json={
+            'url': url, 'mode': 'multi', 'num_streams': args.streams, 'coalesce': False
+        }, timeout=30)
+        latencies.append(('start', (time.perf_counter() - start) * 1000, response.status_code == 200))
+        response.raise_for_status()
+        download_ids.append(response.json()['download_id'])
+
+    tabs = [SimulatedUI(base_url, download_ids, latencies, files_page=i < round(uis * args.files_page),
+                        files_interval=args.files_interval, stats_interval=args.stats_interval)
+            for i in range(uis)]
+    for tab in tabs:
+        tab.thread.start()
+
+    # The harness's own check for the end of the round, at a low rate
+    statuses = {}
+    deadline = started + args.timeout
+    while time.time() < deadline:
+        for download_id in download_ids:
+            if download_id not in statuses:
+                status = http.get(f'{base_url}/api/downloads/{download_id}', timeout=30).json()
+                if status.get('status') in ('completed', 'failed', 'cancelled'):
+                    statuses[download_id] = status
+        if len(statuses) == len(download_ids):
+            break
+        time.sleep(STATUS_INTERVAL)
+    timed_out = len(statuses) < len(download_ids)
+    for download_id in download_ids:
+        if download_id not in statuses:
+            http.post(f'{base_url}/api/downloads/{download_id}/cancel', timeout=30)
+    time.sleep(HISTORY_DELAY if uis else 0)  # Let the tabs finish polling as the UI would
+    for tab in tabs:
+        tab.stop()
+    server = sampler.stop() if sampler else {'cpu_percent': None, 'peak_rss_mb': None, 'cpu_seconds': None}
+    http.close()
+
+    # Download throughput from the server's own timings (no polling skew)
+    completed = [s for s in statuses.values() if s['status'] == 'completed' and s.get('metrics')]
+    per_download = [s['metrics']['throughput_MBps'] for s in completed]
+    aggregate = None
+    if completed:
+        first = min(s['start_time'] for s in completed)
+        last = max(s['start_time'] + s['metrics']['total_time_seconds'] for s in completed)
+        aggregate = len(completed) * args.size / (last - first) / (1024 * 1024) if last > first else None
+
+    record = {
+        'commit': get_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'uis': uis,
+        'downloads': args.downloads,
+        'completed': len(completed),
+        'timed_out': timed_out,
+        'size': args.size,
+        'streams': args.streams,
+        'files_in_folder': args.files,
+        'requests': len(latencies),
+        'errors': sum(1 for _, _, ok in latencies if not ok),
+        'requests_per_second': len(latencies) / (time.time() - started),
+        'latency_ms': {},
+        'download_MBps_median': statistics.median(per_download) if per_download else None,
+        'aggregate_MBps': aggregate,
+        'server': server,
+        'origin': origin.settings()
+    }
+    for endpoint in ('status', 'files', 'stats', 'start', 'all'):
+        values = [ms for name, ms, ok in latencies if ok and endpoint in (name, 'all')]
+        if values:
+            record['latency_ms'][endpoint] = {
+                'count': len(values),
+                'p50': percentile(values, 50),
+                'p99': percentile(values, 99),
+                'max': max(values)
+            }
+    return record
+
+
+def start_server(workdir, port):
+    """The app in a subprocess, its download folder under `workdir`. Returns the process once it answers."""
+    env = dict(os.environ, HOME=workdir, USERPROFILE=workdir)
+    log_path = os.path.join(workdir, 'server.log')
+    with open(log_path, 'w') as log:  # The app writes to its own copy of the handle
+        process = subprocess.Popen([sys.executable, '-c', SERVER_CODE, str(port)], cwd=REPO_DIR, env=env,
+                                   stdout=log, stderr=subprocess.STDOUT)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"App exited with {process.returncode}, see {log_path}")
+        try:
+            requests.get(f'http://127.0.0.1:{port}/api/stats', timeout=1)
+            return process
+        except requests.exceptions.RequestException:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError("App didn't start within 30s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="API latency and download throughput under many UI pollers")
+    parser.add_argument('--uis', default='0,16,64', help="Comma-separated simulated UI counts, one round each "
+                                                         "(the first, usually 0, is the baseline)")
+    parser.add_argument('--downloads', type=int, default=4, help="Concurrent downloads per round")
+    parser.add_argument('--size', default='32M', help="Size of each download")
+    parser.add_argument('--streams', type=int, default=4, help="Streams per download")
+    parser.add_argument('--bandwidth', default='2M', help="Origin per-connection cap in bytes/s")
+    parser.add_argument('--latency', type=float, default=0.01, help="Origin seconds added per response")
+    parser.add_argument('--files', type=int, default=200, help="Files put in the download folder first "
+                                                               "(what /api/files and /api/stats list)")
+    parser.add_argument('--files-page', type=float, default=0.25,
+                        help="Fraction of UIs on the files page (reload the list as downloads complete)")
+    parser.add_argument('--files-interval', type=float, default=0,
+                        help="Seconds between file-list refreshes on the files page (0 = only on completion)")
+    parser.add_argument('--stats-interval', type=float, default=0, help="Seconds between /api/stats polls (0 = none)")
+    parser.add_argument('--timeout', type=float, default=300, help="Seconds a round may take")
+    parser.add_argument('--server', help="Base URL of a running app instead of starting one "
+                                         "(CPU and RSS are then not measured)")
+    parser.add_argument('--pid', type=int, help="With --server: sample this process's CPU and RSS")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=DEFAULT_RESULTS_FILE, help="JSON-lines results file")
+    args = parser.parse_args()
+    args.size = parse_size(args.size)
+    ui_counts = [int(n) for n in args.uis.split(',') if n.strip()]
+
+    origin = ThrottledOrigin(bandwidth=parse_size(args.bandwidth), latency=args.latency, seed=args.seed).start()
+    process = None
+    results = []
+    try:
+        with tempfile.TemporaryDirectory(prefix='msd_api_') as workdir:
+            if args.server:
+                base_url = args.server.rstrip('/')
+                pid = args.pid
+            else:
+                folder = os.path.join(workdir, 'Downloads', 'MultiStreamDownloader')
+                os.makedirs(folder)
+                for i in range(args.files):
+                    with open(os.path.join(folder, f'existing_{i}.bin'), 'wb') as f:
+                        f.write(b'\0' * 1024)
+                port = free_port()
+                process = start_server(workdir, port)
+                base_url = f'http://127.0.0.1:{port}'
+                pid = process.pid
+            sampler = ProcessSampler(pid) if pid and os.path.exists(f'/proc/{pid}') else None
+
+            print(f"API load test: {args.downloads} downloads of {args.size / (1024 * 1024):.0f} MB per round, "
+                  f"UIs {', '.join(map(str, ui_counts))}")
+            print(f"  {'UIs':<6} {'Req/s':<8} {'Status p50/p99 (ms)':<21} {'Files p50/p99 (ms)':<20} "
+                  f"{'Errors':<7} {'CPU %':<7} {'RSS MB':<8} {'MB/s each':<10} {'vs base':<8}")
+            print(f"  {'-'*100}")
+            baseline = None
+            for round_number, uis in enumerate(ui_counts):
+                record = run_round(uis, args, base_url, origin, sampler, round_number)
+                speed = record['download_MBps_median']
+                if baseline is None:
+                    baseline = speed
+                record['throughput_change'] = speed / baseline - 1 if speed and baseline else None
+                results.append(record)
+
+                def pair(endpoint):
+                    latency = record['latency_ms'].get(endpoint)
+                    return f"{latency['p50']:.1f} / {latency['p99']:.1f}" if latency else '-'
+
+                def number(value, spec):
+                    return format(value, spec) if value is not None else '-'
+                server = record['server']
+                print(f"  {uis:<6} {record['requests_per_second']:<8.1f} {pair('status'):<21} {pair('files'):<20} "
+                      f"{record['errors']:<7} {number(server['cpu_percent'], '.0f'):<7} "
+                      f"{number(server['peak_rss_mb'], '.0f'):<8} {number(speed, '.2f'):<10} "
+                      f"{number(record['throughput_change'], '+.1%'):<8}"
+                      + (" (timed out)" if record['timed_out'] else ''))
+            if process is not None:
+                process.terminate()  # Before its download folder goes
+                process.wait(timeout=10)
+                process = None
+    finally:
+        if process is not None:
+            process.kill()
+        origin.stop()
+
+    with open(args.output, 'a') as f:
+        for record in results:
+            f.write(json.dumps(record) + '\n')
+    print(f"\nResults appended to: {args.output}")
+    return 0 if all(r['completed'] == r['downloads'] and not r['errors'] for r in results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
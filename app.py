@@ -1,5 +1,5 @@
 # app.py - Flask application with File Manager
-from flask import Flask, render_template, request, jsonify, send_file
+from flask import Flask, Response, render_template, request, jsonify, send_file
 import os
 import threading
 import time
@@ -9,7 +9,13 @@ import glob
 from datetime import datetime
 from downloader import MultiStreamDownloader
 from simple_downloader import SimpleDownloader
-from config import DOWNLOAD_FOLDER, FLASK_HOST, FLASK_PORT, FLASK_DEBUG
+from bulk_downloader import BulkDownloader
+from remote_zip import RemoteZip, RemoteZipError
+from coalescing import link_or_copy, normalize_url, still_current
+from config import COALESCE_DOWNLOADS, DEFAULT_PRIORITY, DOWNLOAD_FOLDER, FLASK_HOST, FLASK_PORT, FLASK_DEBUG, PRIORITY_CLASSES
+from metrics import COALESCED_DOWNLOADS, REGISTRY
+from metrics_store import metrics_store
+from scheduler import stream_scheduler
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'your-secret-key-here'
@@ -17,21 +23,50 @@ app.config['SECRET_KEY'] = 'your-secret-key-here'
 class DownloadManager:
     def __init__(self):
         self.active_downloads = {}
+        self.active_batches = {}
+        self.active_extractions = {}  # Remote zip members being extracted (see remote_zip.py)
+        # In-flight downloads by normalized URL: {'downloader', 'leader', 'jobs',
+        # 'segment_hashes', 'priority'}; every job in 'jobs' gets the file
+        self.flights = {}
+        self.lock = threading.Lock()
+        self.last_id = 0
     
-    def start_download(self, url, mode, num_streams):
-        download_id = str(int(time.time() * 1000))
+    def new_id(self):
+        """Millisecond timestamp, bumped if needed so jobs submitted together get distinct ids."""
+        with self.lock:
+            self.last_id = max(int(time.time() * 1000), self.last_id + 1)
+            return str(self.last_id)
+    
+    def start_download(self, url, mode, num_streams, trace=None, transport=None, priority=DEFAULT_PRIORITY,
+                       segment_hashes=None, filename=None, coalesce=COALESCE_DOWNLOADS, sink=None):
+        download_id = self.new_id()
+        flight_key = normalize_url(url)
+        if segment_hashes is not None and mode == "single":
+            raise ValueError("Segment hashes need a multi-stream download")  # SimpleDownloader can't check them
+        if sink is not None:
+            if mode == "single":
+                raise ValueError("A sink needs a multi-stream download")
+            coalesce = False  # Its file goes somewhere else
+        
+        # The same resource already downloading: share its bytes instead of
+        # opening another set of connections for them
+        if coalesce and self.attach(download_id, flight_key, url, mode, priority, segment_hashes, filename):
+            return download_id
         
         try:
             # Create appropriate downloader
             if mode == "single":
-                downloader = SimpleDownloader(url, progress_callback=None)
+                downloader = SimpleDownloader(url, progress_callback=None, trace=trace)
             else:
-                downloader = MultiStreamDownloader(url, num_streams=num_streams, progress_callback=None)
+                downloader = MultiStreamDownloader(url, num_streams=num_streams, progress_callback=None,
+                                                   trace=trace, transport=transport,
+                                                   segment_hashes=segment_hashes, sink=sink)
             
             self.active_downloads[download_id] = {
                 'downloader': downloader,
                 'url': url,
                 'mode': mode,
+                'priority': priority,
                 'status': 'downloading',
                 'progress': 0,
                 'speed': 0,
@@ -40,8 +75,30 @@ class DownloadManager:
                 'filename': None,
                 'error': None,
                 'total_size': 0,  # Track total file size
-                'downloaded_size': 0  # Track downloaded bytes
+                'downloaded_size': 0,  # Track downloaded bytes
+                'flight_key': flight_key,
+                'requested_filename': filename,
+                'coalesced_with': None,
+                'sink': sink
             }
+            if filename:
+                self.active_downloads[download_id]['filename'] = filename
+            # Later submissions can attach (unless one already runs for the URL,
+            # e.g. this one asked not to coalesce, or it uploads to a sink)
+            if sink is None:
+                with self.lock:
+                    self.flights.setdefault(flight_key, {
+                        'downloader': downloader,
+                        'leader': download_id,
+                        'jobs': [download_id],
+                        'segment_hashes': segment_hashes,
+                        'priority': priority
+                    })
+            
+            # Multi-stream downloads share the stream budget by priority
+            # (a single stream has nothing to hand back)
+            if mode != "single":
+                stream_scheduler.add(downloader, priority)
             
             # Start download in thread
             thread = threading.Thread(target=self._download_thread, args=(download_id,))
@@ -54,46 +111,149 @@ class DownloadManager:
             print(f"Error starting download: {str(e)}")
             raise e
     
+    def attach(self, download_id, flight_key, url, mode, priority, segment_hashes, filename):
+        """
+        Add the job to the in-flight download of the same resource, if there
+        is one it can share: not paused, verifying against the same segment
+        hashes (if the job has any), and with unchanged validators (a HEAD,
+        once the running download has seen them). Returns True if attached.
+        Downloads with a sink never register a flight (their file isn't local).
+        """
+        with self.lock:
+            flight = self.flights.get(flight_key)
+        if flight is None or flight['downloader'].paused or flight['downloader'].cancelled:
+            return False
+        if segment_hashes is not None and segment_hashes != flight['segment_hashes']:
+            return False
+        if not still_current(url, flight['downloader'].validators):
+            print(f"Coalescing: {url} changed since download {flight['leader']} started, downloading it again")
+            return False
+        
+        downloader = flight['downloader']
+        with self.lock:
+            if self.flights.get(flight_key) is not flight or downloader.paused or downloader.cancelled:
+                return False  # Finished, paused or cancelled meanwhile
+            flight['jobs'].append(download_id)
+            self.active_downloads[download_id] = {
+                'downloader': downloader,
+                'url': url,
+                'mode': mode,
+                'priority': priority,
+                'status': 'downloading',
+                'progress': 0,
+                'speed': 0,
+                'start_time': time.time(),
+                'thread': None,
+                'filename': filename,
+                'error': None,
+                'total_size': 0,
+                'downloaded_size': 0,
+                'flight_key': flight_key,
+                'requested_filename': filename,
+                'coalesced_with': flight['leader']
+            }
+            # The shared download runs at the most urgent priority of its jobs
+            raise_priority = (PRIORITY_CLASSES.index(priority) < PRIORITY_CLASSES.index(flight['priority'])
+                              and self.active_downloads[flight['leader']]['mode'] != 'single')
+            if raise_priority:
+                flight['priority'] = priority
+        if raise_priority:
+            stream_scheduler.add(downloader, priority)
+        COALESCED_DOWNLOADS.labels(host=downloader.host).inc()
+        print(f"Coalescing: {url} is already downloading as {flight['leader']}, "
+              f"attached {download_id} ({len(flight['jobs'])} jobs)")
+        return True
+    
+    def shared_jobs(self, download_id):
+        """Jobs, not cancelled, that get the file of the download `download_id` runs on."""
+        with self.lock:
+            return self._shared_jobs(download_id)
+    
+    def _shared_jobs(self, download_id):
+        """shared_jobs(), with self.lock held."""
+        flight = self.flights.get(self.active_downloads[download_id].get('flight_key'))
+        if flight is None or download_id not in flight['jobs']:
+            return [download_id]
+        return [job_id for job_id in flight['jobs']
+                if self.active_downloads[job_id]['status'] != 'cancelled']
+    
     def _download_thread(self, download_id):
         download_info = self.active_downloads.get(download_id)
         if not download_info:
             return
             
         downloader = download_info['downloader']
+        outcome = {}
         
         try:
-            # Get file info before starting download
-            if hasattr(downloader, 'get_file_info'):
-                file_size, filename = downloader.get_file_info()
-                download_info['total_size'] = file_size
-                download_info['filename'] = filename
-            elif hasattr(downloader, 'check_download_support'):
-                supports_ranges, file_size, filename = downloader.check_download_support()
-                download_info['total_size'] = file_size
-                download_info['filename'] = filename
-            
-            result = downloader.download()
+            # download() probes the URL itself; size and filename are picked up
+            # from the downloader by get_download_status once known
+            output_path = None
+            if download_info['requested_filename']:
+                output_path = os.path.join(DOWNLOAD_FOLDER, download_info['requested_filename'])
+            result = downloader.download(output_path)
             if result:
-                download_info['status'] = 'completed'
-                download_info['result_path'] = result
-                download_info['filename'] = os.path.basename(result)
-                # Set downloaded size to total size when completed
-                download_info['downloaded_size'] = download_info['total_size']
+                outcome = {'status': 'completed', 'result_path': result}
                 # Safely get metrics
                 try:
-                    download_info['metrics'] = downloader.get_detailed_metrics()
+                    outcome['metrics'] = downloader.get_detailed_metrics()
                 except Exception as e:
                     print(f"Error getting metrics: {str(e)}")
-                    download_info['metrics'] = None
+                    outcome['metrics'] = None
+            elif downloader.cancelled:
+                outcome = {'status': 'cancelled'}
             else:
-                download_info['status'] = 'failed'
-                download_info['error'] = 'Download failed'
+                outcome = {'status': 'failed', 'error': getattr(downloader, 'failure', None) or 'Download failed'}
         except Exception as e:
-            download_info['status'] = 'failed'
-            download_info['error'] = str(e)
+            outcome = {'status': 'failed', 'error': str(e)}
             print(f"Download error for {download_id}: {str(e)}")
             import traceback
             traceback.print_exc()
+        finally:
+            if download_info['mode'] != 'single':
+                stream_scheduler.remove(downloader)  # Lower-priority downloads get their streams back
+            # Later submissions of the URL start a download of their own
+            with self.lock:
+                flight = self.flights.get(download_info['flight_key'])
+                if flight is not None and flight['downloader'] is downloader:
+                    del self.flights[download_info['flight_key']]
+                    jobs = flight['jobs']
+                else:
+                    jobs = [download_id]
+        
+        for job_id in jobs:
+            self.finish_job(self.active_downloads[job_id], outcome)
+    
+    def finish_job(self, download_info, outcome):
+        """Record the download's outcome for one of its jobs, giving it the file under its own name."""
+        if download_info['status'] == 'cancelled':
+            return  # Detached while the download went on for other jobs
+        if outcome['status'] != 'completed':
+            download_info.update(outcome)
+            return
+        
+        result = outcome['result_path']
+        if download_info.get('sink'):
+            # Uploaded (see sinks.py): nothing in the download folder
+            download_info.update(outcome)
+            download_info['filename'] = result.rsplit('/', 1)[-1]
+            download_info['downloaded_size'] = download_info['total_size']
+            return
+        path = result
+        if download_info['requested_filename']:
+            path = os.path.join(DOWNLOAD_FOLDER, download_info['requested_filename'])
+        try:
+            if path != result:
+                link_or_copy(result, path)
+        except OSError as e:
+            download_info['status'] = 'failed'
+            download_info['error'] = f"Could not create {path}: {str(e)}"
+            return
+        download_info.update(outcome)
+        download_info['result_path'] = path
+        download_info['filename'] = os.path.basename(path)
+        # Set downloaded size to total size when completed
+        download_info['downloaded_size'] = download_info['total_size']
     
     def get_download_status(self, download_id):
         try:
@@ -111,11 +271,19 @@ class DownloadManager:
                             download_info['progress'] = (downloader.downloaded_bytes / downloader.file_size) * 100
                             download_info['downloaded_size'] = downloader.downloaded_bytes  # Track downloaded bytes
                             download_info['total_size'] = downloader.file_size  # Track total size
+                        if not download_info.get('filename') and getattr(downloader, 'filename', None):
+                            download_info['filename'] = downloader.filename
                         # Safely get speed
                         try:
                             download_info['speed'] = downloader.get_speed() if hasattr(downloader, 'get_speed') else 0
                         except:
                             download_info['speed'] = 0
+                        # Instantaneous/EWMA speed, ETA and per-stream throughput
+                        try:
+                            if hasattr(downloader, 'get_rate_metrics') and downloader.start_time:
+                                download_info['throughput'] = downloader.get_rate_metrics(running_only=True)
+                        except Exception as e:
+                            print(f"Error getting throughput: {str(e)}")
                 except Exception as e:
                     print(f"Error updating progress: {str(e)}")
                     # Don't fail the entire request if progress update fails
@@ -124,6 +292,8 @@ class DownloadManager:
             serializable_status = {
                 'url': download_info['url'],
                 'mode': download_info['mode'],
+                'priority': download_info['priority'],
+                'stream_limit': getattr(download_info['downloader'], 'stream_limit', None),
                 'status': download_info['status'],
                 'progress': download_info['progress'],
                 'speed': download_info['speed'],
@@ -132,7 +302,14 @@ class DownloadManager:
                 'error': download_info.get('error'),
                 'metrics': download_info.get('metrics'),
                 'total_size': download_info.get('total_size', 0),  # Include total size
-                'downloaded_size': download_info.get('downloaded_size', 0)  # Include downloaded size
+                'downloaded_size': download_info.get('downloaded_size', 0),  # Include downloaded size
+                'throughput': download_info.get('throughput'),
+                # Set when the job attached to another job's download of the same URL
+                'coalesced_with': download_info.get('coalesced_with'),
+                # Where the file went, e.g. s3://bucket/key (None = the download folder)
+                'sink': download_info.get('sink'),
+                'result_path': download_info.get('result_path') if download_info.get('sink') else None,
+                'shared_jobs': len(self.shared_jobs(download_id))
             }
             
             return serializable_status
@@ -142,14 +319,174 @@ class DownloadManager:
             traceback.print_exc()
             return None
     
+    def get_trace(self, download_id):
+        """Waterfall of the download's tracing spans, or None if it wasn't traced."""
+        download_info = self.active_downloads.get(download_id)
+        if not download_info or not download_info.get('downloader'):
+            return None
+        return download_info['downloader'].trace.to_dict()
+    
+    def get_segments(self, download_id):
+        """The multi-stream download's segment table, column-wise, or None."""
+        download_info = self.active_downloads.get(download_id)
+        segments = getattr(download_info and download_info.get('downloader'), 'segments', None)
+        return segments.to_dict() if segments is not None else None
+    
     def cancel_download(self, download_id):
         if download_id in self.active_downloads:
             download_info = self.active_downloads[download_id]
-            if 'downloader' in download_info and download_info['downloader']:
-                download_info['downloader'].cancel()
-            download_info['status'] = 'cancelled'
+            # Under the lock: no job can attach between the check and the cancel
+            with self.lock:
+                others = [job_id for job_id in self._shared_jobs(download_id) if job_id != download_id]
+                download_info['status'] = 'cancelled'
+                if not others and download_info.get('downloader'):
+                    download_info['downloader'].cancel()
+            if others:
+                # Other jobs still want the file: only this one lets go of it
+                print(f"Coalescing: {download_id} cancelled, download continues for {len(others)} other job(s)")
             return True
         return False
+    
+    def pause_download(self, download_id):
+        """
+        Pause a running download. None if it doesn't exist, False if it can't
+        be paused now (including while other jobs share it).
+        """
+        download_info = self.active_downloads.get(download_id)
+        if not download_info:
+            return None
+        # Under the lock: no job can attach between the check and the pause
+        with self.lock:
+            if download_info['status'] != 'downloading' or len(self._shared_jobs(download_id)) > 1:
+                return False
+            if not download_info['downloader'].pause():
+                return False
+            download_info['status'] = 'paused'
+        stream_scheduler.rebalance()  # Its streams go to the other downloads
+        return True
+    
+    def resume_download(self, download_id):
+        """Resume a paused download. None if it doesn't exist, False if it isn't paused."""
+        download_info = self.active_downloads.get(download_id)
+        if not download_info:
+            return None
+        if download_info['status'] != 'paused' or not download_info['downloader'].resume():
+            return False
+        download_info['status'] = 'downloading'
+        stream_scheduler.rebalance()
+        return True
+    
+    def start_batch(self, manifest, workers=None, connections_per_host=None):
+        """Start a bulk download of a manifest in the background; returns its id."""
+        options = {}
+        if workers:
+            options['workers'] = workers
+        if connections_per_host:
+            options['connections_per_host'] = connections_per_host
+        downloader = BulkDownloader(manifest, **options)  # Raises ValueError for a bad manifest
+        
+        batch_id = self.new_id()
+        self.active_batches[batch_id] = {
+            'downloader': downloader,
+            'status': 'downloading',
+            'start_time': time.time(),
+            'error': None
+        }
+        thread = threading.Thread(target=self._batch_thread, args=(batch_id,), daemon=True)
+        thread.start()
+        return batch_id
+    
+    def _batch_thread(self, batch_id):
+        batch_info = self.active_batches[batch_id]
+        try:
+            status = batch_info['downloader'].download()
+            if batch_info['status'] != 'cancelled':
+                batch_info['status'] = 'completed' if not status['failed'] else 'failed'
+        except Exception as e:
+            batch_info['status'] = 'failed'
+            batch_info['error'] = str(e)
+            print(f"Batch error for {batch_id}: {str(e)}")
+    
+    def get_batch_status(self, batch_id, include_files=False):
+        batch_info = self.active_batches.get(batch_id)
+        if not batch_info:
+            return None
+        status = batch_info['downloader'].get_status(include_files)
+        status.update({
+            'id': batch_id,
+            'status': batch_info['status'],
+            'start_time': batch_info['start_time'],
+            'error': batch_info['error']
+        })
+        return status
+    
+    def cancel_batch(self, batch_id):
+        batch_info = self.active_batches.get(batch_id)
+        if not batch_info:
+            return False
+        batch_info['downloader'].cancel()
+        batch_info['status'] = 'cancelled'
+        return True
+    
+    def start_extraction(self, url, members, num_streams=None):
+        """Extract members of a remote zip into the download folder in the background; returns its id."""
+        extraction_id = self.new_id()
+        self.active_extractions[extraction_id] = {
+            'url': url,
+            'members': members,
+            'archive': None,
+            'status': 'downloading',
+            'start_time': time.time(),
+            'files': [],
+            'error': None
+        }
+        thread = threading.Thread(target=self._extraction_thread, args=(extraction_id, num_streams), daemon=True)
+        thread.start()
+        return extraction_id
+    
+    def _extraction_thread(self, extraction_id, num_streams):
+        extraction_info = self.active_extractions[extraction_id]
+        try:
+            archive = RemoteZip(extraction_info['url'], num_streams=num_streams)
+            extraction_info['archive'] = archive
+            if extraction_info['status'] == 'cancelled':
+                return  # Cancelled while the directory was read
+            paths = archive.extract(extraction_info['members'], DOWNLOAD_FOLDER, flatten=True)
+            if extraction_info['status'] != 'cancelled':
+                extraction_info['files'] = [os.path.basename(path) for path in paths]
+                extraction_info['status'] = 'completed'
+        except Exception as e:
+            if extraction_info['status'] != 'cancelled':
+                extraction_info['status'] = 'failed'
+                extraction_info['error'] = str(e)
+                print(f"Extraction error for {extraction_id}: {str(e)}")
+    
+    def get_extraction_status(self, extraction_id):
+        extraction_info = self.active_extractions.get(extraction_id)
+        if not extraction_info:
+            return None
+        archive = extraction_info['archive']
+        return {
+            'id': extraction_id,
+            'url': extraction_info['url'],
+            'members': extraction_info['members'],
+            'status': extraction_info['status'],
+            'start_time': extraction_info['start_time'],
+            'archive': archive.filename if archive else None,
+            'size': archive.downloader.file_size if archive else None,
+            'downloaded_bytes': archive.downloader.downloaded_bytes if archive else 0,
+            'files': extraction_info['files'],
+            'error': extraction_info['error']
+        }
+    
+    def cancel_extraction(self, extraction_id):
+        extraction_info = self.active_extractions.get(extraction_id)
+        if not extraction_info:
+            return False
+        extraction_info['status'] = 'cancelled'
+        if extraction_info['archive'] is not None:
+            extraction_info['archive'].downloader.cancel()
+        return True
 
 # Initialize download manager
 download_manager = DownloadManager()
@@ -163,7 +500,31 @@ def start_download():
     data = request.json
     url = data.get('url', '').strip()
     mode = data.get('mode', 'multi')
-    num_streams = int(data.get('num_streams', 8))
+    # Missing/empty/"auto" lets the downloader use the host's learned profile
+    num_streams = data.get('num_streams')
+    num_streams = None if num_streams in (None, '', 'auto') else int(num_streams)
+    # Record phase-level spans for this download (None = server default)
+    trace = data.get('trace')
+    if trace is not None and not isinstance(trace, bool):
+        return jsonify({'error': 'trace must be true, false or null'}), 400
+    transport = data.get('transport') or None
+    if transport not in (None, 'http1', 'http2'):
+        return jsonify({'error': "transport must be 'http1' or 'http2'"}), 400
+    # Higher classes take streams from lower ones while they run (see scheduler.py)
+    priority = data.get('priority') or DEFAULT_PRIORITY
+    if priority not in PRIORITY_CLASSES:
+        return jsonify({'error': f"priority must be one of: {', '.join(PRIORITY_CLASSES)}"}), 400
+    # Optional {"block_size": n, "sha256": [...]}: parts are checked block by
+    # block and only corrupt blocks are fetched again
+    segment_hashes = data.get('segment_hashes')
+    # Name to save under in the download folder (default: from the server)
+    filename = data.get('filename') or None
+    if filename is not None and (os.path.basename(filename) != filename or filename.startswith('.')):
+        return jsonify({'error': 'filename must be a plain file name'}), 400
+    # Attach to a download of the same URL that is already running (default on)
+    coalesce = data.get('coalesce', COALESCE_DOWNLOADS) is not False
+    # Stream straight into object storage instead: "s3://bucket/key" (see sinks.py)
+    sink = data.get('sink') or None
     
     if not url:
         return jsonify({'error': 'URL is required'}), 400
@@ -172,11 +533,14 @@ def start_download():
         return jsonify({'error': 'URL must start with http:// or https://'}), 400
     
     try:
-        download_id = download_manager.start_download(url, mode, num_streams)
+        download_id = download_manager.start_download(url, mode, num_streams, trace, transport, priority,
+                                                      segment_hashes, filename, coalesce, sink)
         return jsonify({
             'download_id': download_id,
             'message': 'Download started successfully'
         })
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -201,6 +565,29 @@ def cancel_download(download_id):
     else:
         return jsonify({'error': 'Download not found'}), 404
 
+@app.route('/api/downloads/<download_id>/pause', methods=['POST'])
+def pause_download(download_id):
+    paused = download_manager.pause_download(download_id)
+    if paused is None:
+        return jsonify({'error': 'Download not found'}), 404
+    if not paused:
+        return jsonify({'error': 'Download is not running, is still starting up, or is shared with other jobs'}), 409
+    return jsonify({'message': 'Download paused'})
+
+@app.route('/api/downloads/<download_id>/resume', methods=['POST'])
+def resume_download(download_id):
+    resumed = download_manager.resume_download(download_id)
+    if resumed is None:
+        return jsonify({'error': 'Download not found'}), 404
+    if not resumed:
+        return jsonify({'error': 'Download is not paused'}), 409
+    return jsonify({'message': 'Download resumed'})
+
+@app.route('/api/scheduler')
+def get_scheduler_status():
+    """Stream limits the scheduler has given the running multi-stream downloads."""
+    return jsonify(stream_scheduler.get_status())
+
 @app.route('/api/downloads/<download_id>/metrics')
 def get_download_metrics(download_id):
     status = download_manager.get_download_status(download_id)
@@ -209,6 +596,154 @@ def get_download_metrics(download_id):
     else:
         return jsonify({'error': 'Metrics not available'}), 404
 
+@app.route('/api/downloads/<download_id>/trace')
+def get_download_trace(download_id):
+    """Per-download waterfall: probe, connect, TLS, first byte, transfer and assembly spans."""
+    trace = download_manager.get_trace(download_id)
+    if trace:
+        return jsonify(trace)
+    return jsonify({'error': 'Trace not available'}), 404
+
+@app.route('/api/downloads/<download_id>/segments')
+def get_download_segments(download_id):
+    """Per-segment offsets, progress, timings, retries and addresses (one list per field)."""
+    segments = download_manager.get_segments(download_id)
+    if segments is not None:
+        return jsonify(segments)
+    return jsonify({'error': 'Segments not available'}), 404
+
+@app.route('/api/remote-zip', methods=['POST'])
+def remote_zip():
+    """
+    Members of a remote .zip, read with range requests: {"url": ...} lists them.
+    Adding "members": [names] starts a background extraction of those into the
+    download folder (by file name, numbered if taken; no hidden names) without
+    downloading the rest of the archive; poll /api/remote-zip/<id> for it.
+    """
+    data = request.json or {}
+    url = data.get('url', '').strip()
+    if not url.startswith(('http://', 'https://')):
+        return jsonify({'error': 'URL must start with http:// or https://'}), 400
+    members = data.get('members')
+    if members is not None and (not isinstance(members, list) or not members):
+        return jsonify({'error': 'members must be a non-empty list of names'}), 400
+    num_streams = data.get('num_streams')
+    
+    try:
+        num_streams = int(num_streams) if num_streams else None
+        if members is not None:
+            # Members are held in memory until written: not in the request thread
+            extraction_id = download_manager.start_extraction(url, members, num_streams)
+            return jsonify({
+                'extraction_id': extraction_id,
+                'message': 'Extraction started successfully'
+            })
+        archive = RemoteZip(url, num_streams=num_streams)
+        return jsonify({
+            'archive': archive.filename,
+            'size': archive.downloader.file_size,
+            'members': archive.members()
+        })
+    except (ValueError, TypeError) as e:
+        return jsonify({'error': str(e)}), 400
+    except RemoteZipError as e:
+        return jsonify({'error': str(e)}), 502
+    except Exception as e:
+        print(f"Error reading remote zip {url}: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/remote-zip/<extraction_id>')
+def get_extraction_status(extraction_id):
+    """Progress of a remote zip extraction; 'files' lists what was written once completed."""
+    status = download_manager.get_extraction_status(extraction_id)
+    if status:
+        return jsonify(status)
+    return jsonify({'error': 'Extraction not found'}), 404
+
+@app.route('/api/remote-zip/<extraction_id>/cancel', methods=['POST'])
+def cancel_extraction(extraction_id):
+    if download_manager.cancel_extraction(extraction_id):
+        return jsonify({'message': 'Extraction cancelled successfully'})
+    return jsonify({'error': 'Extraction not found'}), 404
+
+@app.route('/api/batches', methods=['POST'])
+def start_batch():
+    """
+    Bulk download of a manifest: {"manifest": [url or {url, size, sha256, path}, ...],
+    "workers": n, "connections_per_host": n}. Files with known sizes are not probed.
+    """
+    data = request.json or {}
+    manifest = data.get('manifest') or data.get('urls')
+    if not isinstance(manifest, list) or not manifest:
+        return jsonify({'error': 'manifest must be a non-empty list'}), 400
+    
+    try:
+        workers = data.get('workers')
+        connections_per_host = data.get('connections_per_host')
+        batch_id = download_manager.start_batch(
+            manifest,
+            workers=int(workers) if workers else None,
+            connections_per_host=int(connections_per_host) if connections_per_host else None
+        )
+    except (ValueError, TypeError) as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    return jsonify({
+        'batch_id': batch_id,
+        'total_files': len(manifest),
+        'message': 'Batch started successfully'
+    })
+
+@app.route('/api/batches/<batch_id>')
+def get_batch_status(batch_id):
+    """Aggregate progress of a batch; ?files=1 adds per-file state."""
+    status = download_manager.get_batch_status(batch_id, include_files=request.args.get('files') == '1')
+    if status:
+        return jsonify(status)
+    return jsonify({'error': 'Batch not found'}), 404
+
+@app.route('/api/batches/<batch_id>/cancel', methods=['POST'])
+def cancel_batch(batch_id):
+    if download_manager.cancel_batch(batch_id):
+        return jsonify({'message': 'Batch cancelled successfully'})
+    return jsonify({'error': 'Batch not found'}), 404
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Expose download counters, gauges and histograms for Prometheus scraping."""
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+@app.route('/api/metrics/history')
+def get_metrics_history():
+    """
+    Run history with aggregations.
+    Query params: host, mode, streams, transport, result (default completed,
+    'all' for any), since (unix time), limit (recent runs returned, default 50).
+    """
+    try:
+        host = request.args.get('host') or None
+        mode = request.args.get('mode') or None
+        streams = request.args.get('streams', type=int)
+        transport = request.args.get('transport') or None
+        result = request.args.get('result', 'completed')
+        since = request.args.get('since', type=float)
+        limit = request.args.get('limit', 50, type=int)
+        
+        return jsonify({
+            'runs': metrics_store.query_runs(
+                host=host, mode=mode, num_streams=streams,
+                result=None if result == 'all' else result,
+                since=since, limit=limit, transport=transport
+            ),
+            'throughput_by_host_and_streams': metrics_store.throughput_by_host_and_streams(host, since),
+            'single_vs_multi': metrics_store.single_vs_multi(host, since),
+            'http1_vs_http2': metrics_store.http1_vs_http2(host, since)
+        })
+    except Exception as e:
+        print(f"Error reading metrics history: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/downloads/<filename>')
 def download_file(filename):
     file_path = os.path.join(DOWNLOAD_FOLDER, filename)
@@ -252,6 +787,7 @@ def list_downloads():
             'status': info['status'],
             'progress': info.get('progress', 0),
             'mode': info['mode'],
+            'priority': info['priority'],
             'filename': info.get('filename'),
             'speed': info.get('speed', 0),
             'total_size': info.get('total_size', 0),  # Include total size
@@ -0,0 +1,295 @@
+# benchmark.py - Reproducible single vs multi-stream benchmarks against a throttled local origin
+
+import argparse
+import contextlib
+import hashlib
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from throttled_server import ThrottledOrigin, parse_size
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_RESULTS_FILE = os.path.join(REPO_DIR, 'bench_results.jsonl')
+REGRESSION_THRESHOLD = 0.10  # Flag throughput drops larger than 10%
+
+
+def get_commit():
+    """Current git commit, so results from different commits can be compared."""
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=REPO_DIR, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except Exception:
+        return 'unknown'
+
+
+@contextlib.contextmanager
+def private_history():
+    """
+    Point the run-history and host-profile stores at a temporary database
+    while in-process benchmark downloads run, so they don't end up in the
+    user's history or train host profiles for the local origin.
+    """
+    from host_profiles import host_profiles
+    from metrics_store import metrics_store
+    stores = (metrics_store, host_profiles)
+    saved = [store.path for store in stores]
+    with tempfile.TemporaryDirectory(prefix='msd_history_') as directory:
+        for store in stores:
+            store.path = os.path.join(directory, '.download_history.db')
+            store.initialized = False
+        try:
+            yield
+        finally:
+            for store, path in zip(stores, saved):
+                store.path = path
+                store.initialized = False
+
+
+def get_peak_rss_mb():
+    """Peak resident set size of this process in MB, or None if unavailable."""
+    try:
+        import resource
+    except ImportError:
+        return None  # Windows
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is bytes on macOS and kilobytes elsewhere
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def sha256_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def run_worker(args):
+    """
+    Run one download in this (fresh) process and print a JSON result line.
+    A process per trial keeps CPU time and peak RSS from leaking between trials.
+    """
+    from downloader import MultiStreamDownloader
+    from simple_downloader import SimpleDownloader
+
+    if args.mode == 'single':
+        downloader = SimpleDownloader(args.url)
+    elif args.mode == 'multi-h2':
+        downloader = MultiStreamDownloader(args.url, num_streams=args.streams, transport='http2')
+    else:
+        downloader = MultiStreamDownloader(args.url, num_streams=args.streams)
+
+    cpu_start = os.times()
+    wall_start = time.time()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        result = downloader.download(args.output)
+    wall_seconds = time.time() - wall_start
+    cpu_end = os.times()
+
+    size = os.path.getsize(result) if result else 0
+    first_byte = getattr(downloader, 'first_byte_time', None)
+
+    print(json.dumps({
+        'ok': bool(result),
+        'sha256': sha256_file(result) if result else None,
+        'bytes': size,
+        'wall_seconds': wall_seconds,
+        'throughput_MBps': size / (wall_seconds * 1024 * 1024) if wall_seconds > 0 else 0,
+        'ttfb_seconds': first_byte - wall_start if first_byte else None,
+        'cpu_seconds': (cpu_end.user - cpu_start.user) + (cpu_end.system - cpu_start.system),
+        'peak_rss_mb': get_peak_rss_mb(),
+        'streams_used': getattr(downloader, 'num_streams', 1)
+    }))
+
+
+def run_trial(url, mode, streams, workdir):
+    """Launch a worker process for one download and return its parsed result."""
+    output = os.path.join(workdir, f"{mode}_{streams}_{time.time_ns()}.bin")
+    cmd = [sys.executable, os.path.abspath(__file__), '--worker',
+           '--url', url, '--mode', mode, '--streams', str(streams), '--output', output]
+    # A home of its own: trials stay out of the user's run history and host profiles
+    env = dict(os.environ, HOME=workdir, USERPROFILE=workdir)
+    proc = subprocess.run(cmd, cwd=REPO_DIR, capture_output=True, text=True, env=env)
+    try:
+        os.remove(output)
+    except OSError:
+        pass
+    try:
+        return json.loads(proc.stdout.strip().splitlines()[-1])
+    except (IndexError, ValueError):
+        print(proc.stderr, file=sys.stderr)
+        return {'ok': False, 'error': f"worker exited with {proc.returncode}"}
+
+
+def summarize(trials):
+    """Median of each numeric measurement across repeated trials."""
+    summary = {}
+    for key in ('wall_seconds', 'throughput_MBps', 'ttfb_seconds', 'cpu_seconds', 'peak_rss_mb'):
+        values = [t[key] for t in trials if t.get(key) is not None]
+        summary[key] = statistics.median(values) if values else None
+    return summary
+
+
+def result_key(record):
+    """Identity of a benchmark cell, used to match results across commits."""
+    origin = record['origin']
+    return (record['mode'], record['size'], record['streams'],
+            origin['bandwidth'], origin['latency'], origin['jitter'],
+            origin['supports_ranges'], origin['send_length'])
+
+
+def load_results(path):
+    records = []
+    if os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    records.append(json.loads(line))
+    return records
+
+
+def compare(current, baseline_path, threshold=REGRESSION_THRESHOLD):
+    """
+    Compare this run against the latest matching result in a baseline file.
+    Returns the number of cells whose throughput regressed beyond the threshold.
+    """
+    baseline = {}
+    for record in load_results(baseline_path):
+        baseline[result_key(record)] = record  # later lines win
+
+    regressions = 0
+    print(f"\nComparison against {baseline_path}:")
+    print(f"  {'Mode':<8} {'Size (MB)':<10} {'Streams':<8} {'Base MB/s':<11} {'Now MB/s':<11} {'Change':<8}")
+    print(f"  {'-'*60}")
+    for record in current:
+        old = baseline.get(result_key(record))
+        if not old or not old['throughput_MBps'] or record['throughput_MBps'] is None:
+            continue
+        change = (record['throughput_MBps'] - old['throughput_MBps']) / old['throughput_MBps']
+        flag = ''
+        if change < -threshold:
+            flag = '  REGRESSION'
+            regressions += 1
+        print(f"  {record['mode']:<8} {record['size'] / (1024*1024):<10.1f} {record['streams']:<8} "
+              f"{old['throughput_MBps']:<11.2f} {record['throughput_MBps']:<11.2f} {change*100:+.1f}%{flag}")
+    return regressions
+
+
+def run_matrix(args):
+    sizes = [parse_size(s) for s in args.sizes.split(',')]
+    stream_counts = [int(s) for s in args.streams.split(',')]
+    commit = get_commit()
+
+    origin_settings = dict(
+        bandwidth=parse_size(args.bandwidth),
+        latency=args.latency,
+        jitter=args.jitter,
+        supports_ranges=not args.no_ranges,
+        send_length=not args.chunked,
+        seed=args.seed
+    )
+    origin = ThrottledOrigin(**origin_settings).start()
+    # Same content and throttling over h2c, for the multiplexed transport
+    origins = {'single': origin, 'multi': origin}
+    if args.http2:
+        origins['multi-h2'] = ThrottledOrigin(http2=True, **origin_settings).start()
+
+    cells = []
+    for size in sizes:
+        if not args.skip_single:
+            cells.append(('single', size, 1))
+        for streams in stream_counts:
+            cells.append(('multi', size, streams))
+            if args.http2:
+                cells.append(('multi-h2', size, streams))
+
+    results = []
+    print(f"Benchmarking commit {commit} against {origin.base_url} ({origin.settings()})")
+    print(f"  {'Mode':<8} {'Size (MB)':<10} {'Streams':<8} {'MB/s':<9} {'TTFB (s)':<9} {'CPU (s)':<8} {'RSS (MB)':<9} {'OK':<4}")
+    print(f"  {'-'*70}")
+
+    try:
+        with tempfile.TemporaryDirectory(prefix='msd_bench_') as workdir:
+            for mode, size, streams in cells:
+                url = origins[mode].url_for(size)
+                expected = origins[mode].content.sha256(size)
+                trials = [run_trial(url, mode, streams, workdir) for _ in range(args.repeat)]
+                ok = all(t.get('ok') and t.get('sha256') == expected for t in trials)
+
+                record = {
+                    'commit': commit,
+                    'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                    'python': platform.python_version(),
+                    'platform': sys.platform,
+                    'mode': mode,
+                    'size': size,
+                    'streams': streams,
+                    'streams_used': trials[-1].get('streams_used'),
+                    'repeat': args.repeat,
+                    'ok': ok,
+                    'origin': origins[mode].settings()
+                }
+                record.update(summarize(trials))
+                results.append(record)
+
+                def fmt(value, spec):
+                    return format(value, spec) if value is not None else 'n/a'
+
+                print(f"  {mode:<8} {size / (1024*1024):<10.1f} {streams:<8} "
+                      f"{fmt(record['throughput_MBps'], '<9.2f')} {fmt(record['ttfb_seconds'], '<9.3f')} "
+                      f"{fmt(record['cpu_seconds'], '<8.2f')} {fmt(record['peak_rss_mb'], '<9.1f')} "
+                      f"{'yes' if ok else 'NO':<4}")
+    finally:
+        for server in set(origins.values()):
+            server.stop()
+
+    with open(args.output, 'a') as f:
+        for record in results:
+            f.write(json.dumps(record) + '\n')
+    print(f"\nResults appended to: {args.output}")
+
+    failures = sum(1 for r in results if not r['ok'])
+    regressions = compare(results, args.compare) if args.compare else 0
+    return 1 if failures or regressions else 0
+
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description="Single vs multi-stream download benchmark")
+    parser.add_argument('--sizes', default='8M,64M', help="Comma-separated file sizes")
+    parser.add_argument('--streams', default='1,4,8,16', help="Comma-separated stream counts")
+    parser.add_argument('--repeat', type=int, default=3, help="Trials per cell (median reported)")
+    parser.add_argument('--bandwidth', default='4M', help="Per-connection cap in bytes/s (0 = none)")
+    parser.add_argument('--latency', type=float, default=0.05, help="Seconds added per response")
+    parser.add_argument('--jitter', type=float, default=0.0, help="Fractional jitter, e.g. 0.2")
+    parser.add_argument('--no-ranges', action='store_true', help="Origin ignores Range headers")
+    parser.add_argument('--chunked', action='store_true', help="Origin omits Content-Length")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--skip-single', action='store_true', help="Don't run SimpleDownloader")
+    parser.add_argument('--http2', action='store_true',
+                        help="Also run each multi-stream cell over HTTP/2 (needs httpx[http2] and h2)")
+    parser.add_argument('--output', default=DEFAULT_RESULTS_FILE, help="JSON-lines results file")
+    parser.add_argument('--compare', help="Results file from another commit to compare against")
+
+    # Internal: run a single trial in a worker process
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--url', help=argparse.SUPPRESS)
+    parser.add_argument('--mode', help=argparse.SUPPRESS)
+    return parser
+
+
+if __name__ == '__main__':
+    args = build_arg_parser().parse_args()
+    if args.worker:
+        args.streams = int(args.streams)
+        run_worker(args)
+    else:
+        sys.exit(run_matrix(args))
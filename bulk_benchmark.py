@@ -0,0 +1,151 @@
+# bulk_benchmark.py - Files-per-second benchmark for manifests of many small files
+
+import argparse
+import contextlib
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+from benchmark import get_commit, private_history, sha256_file
+from throttled_server import ThrottledOrigin, parse_size
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_RESULTS_FILE = os.path.join(REPO_DIR, 'bulk_results.jsonl')
+
+
+def build_manifest(origin, count, size, with_sizes):
+    """`count` distinct URLs of `size` bytes each (same content, different names)."""
+    digest = origin.content.sha256(size)
+    manifest = []
+    for i in range(count):
+        entry = {'url': origin.url_for(size, f"file_{i:06d}.bin")}
+        if with_sizes:
+            entry['size'] = size
+            entry['sha256'] = digest
+        manifest.append(entry)
+    return manifest
+
+
+def run_bulk(manifest, args, workdir):
+    from bulk_downloader import BulkDownloader
+
+    downloader = BulkDownloader(manifest, output_dir=workdir, workers=args.workers,
+                                connections_per_host=args.connections)
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        status = downloader.download()
+    return status['completed'], status['failed']
+
+
+def run_per_file(manifest, args, workdir):
+    """
+    The old way: one MultiStreamDownloader per file (its own probe, session
+    and connections), `workers` at a time, as separate /api/downloads calls did.
+    """
+    from downloader import MultiStreamDownloader
+
+    results = {'completed': 0, 'failed': 0}
+    lock = threading.Lock()
+    pending = list(enumerate(manifest))
+
+    def work():
+        while True:
+            with lock:
+                if not pending:
+                    return
+                i, entry = pending.pop()
+            output = os.path.join(workdir, f"file_{i:06d}.bin")
+            ok = MultiStreamDownloader(entry['url'], num_streams=1).download(output)
+            with lock:
+                results['completed' if ok else 'failed'] += 1
+
+    threads = [threading.Thread(target=work, daemon=True) for _ in range(args.workers)]
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    return results['completed'], results['failed']
+
+
+def run_case(name, args):
+    origin = ThrottledOrigin(
+        bandwidth=parse_size(args.bandwidth),
+        latency=args.latency,
+        seed=args.seed
+    ).start()
+    try:
+        manifest = build_manifest(origin, args.files, args.size, with_sizes=name != 'bulk-unsized')
+        with tempfile.TemporaryDirectory(prefix='msd_bulk_') as workdir:
+            runner = run_per_file if name == 'per-file' else run_bulk
+            wall_start = time.time()
+            completed, failed = runner(manifest, args, workdir)
+            wall_seconds = time.time() - wall_start
+
+            expected = origin.content.sha256(args.size)
+            files = [os.path.join(workdir, f) for f in os.listdir(workdir)]
+            correct = completed == args.files and all(sha256_file(f) == expected for f in files)
+        return {
+            'commit': get_commit(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'case': name,
+            'files': args.files,
+            'size': args.size,
+            'workers': args.workers,
+            'connections_per_host': args.connections if name != 'per-file' else None,
+            'completed': completed,
+            'failed': failed,
+            'correct': correct,
+            'wall_seconds': wall_seconds,
+            'files_per_second': completed / wall_seconds if wall_seconds > 0 else 0,
+            'throughput_MBps': completed * args.size / (wall_seconds * 1024 * 1024) if wall_seconds > 0 else 0,
+            # Server-side view of per-file overhead
+            'origin_connections': origin.connection_count,
+            'origin_requests': origin.request_count,
+            'origin': origin.settings()
+        }
+    finally:
+        origin.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Files/sec for a manifest of many small files")
+    parser.add_argument('--files', type=int, default=500)
+    parser.add_argument('--size', default='16K', help="Size of each file")
+    parser.add_argument('--workers', type=int, default=16, help="Files fetched concurrently")
+    parser.add_argument('--connections', type=int, default=4, help="Keep-alive connections per host (bulk)")
+    parser.add_argument('--bandwidth', default='0', help="Per-connection cap in bytes/s (0 = none)")
+    parser.add_argument('--latency', type=float, default=0.01, help="Seconds added per response")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--skip-per-file', action='store_true', help="Don't run the per-file baseline")
+    parser.add_argument('--output', default=DEFAULT_RESULTS_FILE, help="JSON-lines results file")
+    args = parser.parse_args()
+    args.size = parse_size(args.size)
+
+    cases = ['bulk', 'bulk-unsized'] + ([] if args.skip_per_file else ['per-file'])
+    print(f"Bulk benchmark: {args.files} files of {args.size / 1024:.0f} KB, {args.workers} workers")
+    print(f"  {'Case':<14} {'Files/s':<10} {'Time (s)':<10} {'MB/s':<8} "
+          f"{'Conns':<7} {'Requests':<9} {'Correct':<8}")
+    print(f"  {'-'*68}")
+
+    results = []
+    with private_history():
+        for name in cases:
+            record = run_case(name, args)
+            results.append(record)
+            print(f"  {name:<14} {record['files_per_second']:<10.1f} {record['wall_seconds']:<10.2f} "
+                  f"{record['throughput_MBps']:<8.2f} {record['origin_connections']:<7} "
+                  f"{record['origin_requests']:<9} {'yes' if record['correct'] else 'NO':<8}")
+
+    with open(args.output, 'a') as f:
+        for record in results:
+            f.write(json.dumps(record) + '\n')
+    print(f"\nResults appended to: {args.output}")
+
+    return 0 if all(r['correct'] for r in results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,409 @@
+# bulk_downloader.py - Manifest downloads of many small files over a shared keep-alive pool
+
+import hashlib
+import json
+import os
+import queue
+import threading
+import time
+from urllib.parse import urlparse, unquote
+
+from config import (
+    BULK_CONNECTIONS_PER_HOST, BULK_LARGE_FILE_SIZE, BULK_WORKERS, CONNECTION_TIMEOUT,
+    DOWNLOAD_FOLDER, METRICS_FLUSH_BYTES, READ_TIMEOUT, STREAM_BUFFER_SIZE
+)
+from metrics import (
+    ACTIVE_DOWNLOADS, DOWNLOADED_BYTES, DOWNLOADS, FAILURES, QUEUE_DEPTH, failure_cause
+)
+from metrics_store import metrics_store
+from resolver import http_session
+from retry_policy import RequestFailed, check_response, circuit_breaker, is_fatal, retry_policy
+
+
+def normalize_entry(item):
+    """
+    One manifest entry as a dict with url, size, sha256 and path.
+    Accepts a bare URL string or a dict; size, sha256 and path are optional.
+    """
+    if isinstance(item, str):
+        item = {'url': item}
+    if not isinstance(item, dict):
+        raise ValueError(f"Manifest entries must be URLs or objects, got {type(item).__name__}")
+    url = str(item.get('url', '')).strip()
+    if not url.startswith(('http://', 'https://')):
+        raise ValueError(f"Manifest URL must start with http:// or https://: {url!r}")
+    size = item.get('size')
+    return {
+        'url': url,
+        'size': int(size) if size not in (None, '') else None,
+        'sha256': (item.get('sha256') or '').lower() or None,
+        'path': item.get('path') or None
+    }
+
+
+def load_manifest(path):
+    """
+    Read a manifest file: a JSON list (or {"files": [...]}) of entries, or
+    plain text with one `url [size] [sha256]` per line (# starts a comment).
+    """
+    with open(path) as f:
+        text = f.read()
+    if text.lstrip().startswith(('[', '{')):
+        data = json.loads(text)
+        return data['files'] if isinstance(data, dict) else data
+
+    entries = []
+    for line in text.splitlines():
+        fields = line.split('#', 1)[0].split()
+        if not fields:
+            continue
+        entry = {'url': fields[0]}
+        if len(fields) > 1:
+            entry['size'] = fields[1]
+        if len(fields) > 2:
+            entry['sha256'] = fields[2]
+        entries.append(entry)
+    return entries
+
+
+class BulkDownloader:
+    """
+    Downloads a manifest of many (mostly small) files.
+
+    Per-file overhead is what dominates here, so nothing is done per file
+    that isn't needed: no probe (a plain GET returns the size with the body),
+    no part files or assembly, and no new connections. All workers share one
+    session whose pool keeps at most `connections_per_host` keep-alive
+    connections per host; a worker waits for a free connection rather than
+    opening another. Files whose manifest size is BULK_LARGE_FILE_SIZE or
+    more get a regular multi-stream download instead.
+
+    Progress is reported for the batch as a whole (files and bytes), see
+    get_status().
+    """
+
+    def __init__(self, manifest, output_dir=None, workers=BULK_WORKERS,
+                 connections_per_host=BULK_CONNECTIONS_PER_HOST, progress_callback=None):
+        """
+        Initialize the bulk downloader.
+            manifest: List of URLs or {url, size, sha256, path} dicts
+            output_dir: Where files are saved (defaults to DOWNLOAD_FOLDER);
+                        an entry's `path` is relative to it
+            workers: Files fetched concurrently
+            connections_per_host: Keep-alive connections shared per host
+            progress_callback: Called with (files_done, total_files, bytes_downloaded)
+        """
+        entries = [normalize_entry(item) for item in manifest]
+        if not entries:
+            raise ValueError("Manifest is empty")
+        self.output_dir = os.path.abspath(output_dir or DOWNLOAD_FOLDER)
+        self.workers = max(1, min(workers, len(entries)))
+        self.connections_per_host = max(1, connections_per_host)
+        self.progress_callback = progress_callback
+
+        # Per-file state, in manifest order
+        self.files = []
+        used_paths = set()
+        for entry in entries:
+            path = self.output_path(entry, used_paths)
+            used_paths.add(path)
+            self.files.append(dict(entry, path=path, status='pending', bytes=0,
+                                   seconds=None, retries=0, error=None))
+
+        # Aggregate progress
+        self.lock = threading.Lock()
+        self.is_downloading = False
+        self.stop_event = threading.Event()  # Set on cancel, wakes retry back-offs
+        self.large_downloads = set()  # MultiStreamDownloaders running for big files
+        self.start_time = None
+        self.end_time = None
+        self.completed = 0
+        self.failed = 0
+        self.active = 0
+        self.downloaded_bytes = 0
+        self.retry_count = 0
+
+    def output_path(self, entry, used_paths):
+        """Absolute path for an entry, kept inside output_dir and unique within the batch."""
+        relative = entry['path']
+        if not relative:
+            relative = unquote(os.path.basename(urlparse(entry['url']).path)) or 'downloaded_file'
+        path = os.path.abspath(os.path.join(self.output_dir, relative))
+        if not path.startswith(self.output_dir + os.sep):
+            raise ValueError(f"Manifest path escapes the output folder: {relative!r}")
+
+        # Same file name from different URLs: number the later ones
+        base, ext = os.path.splitext(path)
+        counter = 1
+        while path in used_paths:
+            path = f"{base}_{counter}{ext}"
+            counter += 1
+        return path
+
+    def download(self):
+        """
+        Download every file in the manifest.
+        Returns the batch summary (see get_status()); check 'failed' for errors.
+        """
+        self.is_downloading = True
+        self.start_time = time.time()
+        ACTIVE_DOWNLOADS.labels(mode='bulk').inc()
+
+        pending = queue.Queue()
+        for index in range(len(self.files)):
+            pending.put(index)
+        QUEUE_DEPTH.labels(queue='bulk_files').inc(len(self.files))
+
+        # One pool for all workers; pool_block makes workers queue for one of
+        # the host's connections instead of opening extra ones
+        session = http_session(
+            pool_connections=self.workers,
+            pool_maxsize=self.connections_per_host,
+            pool_block=True
+        )
+        print(f"Bulk download: {len(self.files)} files, {self.workers} workers, "
+              f"{self.connections_per_host} connections per host")
+
+        threads = []
+        for _ in range(self.workers):
+            thread = threading.Thread(target=self.worker, args=(session, pending), daemon=True)
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+        session.close()
+
+        self.end_time = time.time()
+        cancelled = not self.is_downloading
+        self.is_downloading = False
+        ACTIVE_DOWNLOADS.labels(mode='bulk').dec()
+
+        status = self.get_status()
+        print(f"Bulk download {'cancelled' if cancelled else 'finished'}: "
+              f"{status['completed']}/{status['total_files']} files, {status['failed']} failed, "
+              f"{status['files_per_second']:.1f} files/s, {status['throughput_MBps']:.2f} MB/s")
+        outcome = 'cancelled' if cancelled else ('completed' if not self.failed else 'failed')
+        self.record_run(outcome, status)
+        return status
+
+    def worker(self, session, pending):
+        while self.is_downloading:
+            try:
+                index = pending.get_nowait()
+            except queue.Empty:
+                return
+            item = self.files[index]
+            with self.lock:
+                self.active += 1
+            item['status'] = 'downloading'
+            started = time.time()
+            try:
+                if item['size'] is not None and item['size'] >= BULK_LARGE_FILE_SIZE:
+                    self.fetch_large_file(item)
+                else:
+                    self.fetch_file(session, item)
+                item['status'] = 'completed'
+            except Exception as e:
+                item['status'] = 'failed'
+                item['error'] = str(e)
+                print(f"Bulk: {item['url']} failed: {str(e)}")
+            item['seconds'] = time.time() - started
+            host = urlparse(item['url']).hostname or ''
+            DOWNLOADS.labels(host=host, mode='bulk', result=item['status']).inc()
+            QUEUE_DEPTH.labels(queue='bulk_files').dec()
+
+            with self.lock:
+                self.active -= 1
+                if item['status'] == 'completed':
+                    self.completed += 1
+                else:
+                    self.failed += 1
+                if self.progress_callback:
+                    self.progress_callback(self.completed + self.failed, len(self.files), self.downloaded_bytes)
+
+        # Cancelled: whatever is left in the queue is not going to be fetched
+        while True:
+            try:
+                pending.get_nowait()
+            except queue.Empty:
+                return
+            QUEUE_DEPTH.labels(queue='bulk_files').dec()
+
+    def fetch_file(self, session, item):
+        """GET one file on a pooled connection, verify it and move it into place."""
+        host = urlparse(item['url']).hostname or ''
+        bytes_metric = DOWNLOADED_BYTES.labels(host=host, mode='bulk')
+        temp_path = item['path'] + '.part'
+        os.makedirs(os.path.dirname(item['path']), exist_ok=True)
+
+        failures = 0
+        while True:
+            if self.stop_event.wait(circuit_breaker.wait_time(host)):
+                raise Exception("Download cancelled")
+            attempt_bytes = 0
+            pending_metric_bytes = 0
+            digest = hashlib.sha256() if item['sha256'] else None
+            try:
+                # identity: the size and SHA-256 in the manifest are of the file
+                # as stored, not of a gzip-encoded response body
+                response = session.get(
+                    item['url'],
+                    headers={'Accept-Encoding': 'identity'},
+                    stream=True,
+                    timeout=(CONNECTION_TIMEOUT, READ_TIMEOUT),
+                    allow_redirects=True
+                )
+                try:
+                    check_response(response)
+                    content_length = response.headers.get('Content-Length')
+                    expected = item['size']
+                    if expected is None and content_length is not None:
+                        expected = int(content_length)
+
+                    with open(temp_path, 'wb') as f:
+                        # Reading to the end hands the connection back to the pool
+                        for data in response.iter_content(chunk_size=STREAM_BUFFER_SIZE):
+                            if not self.is_downloading:
+                                raise Exception("Download cancelled")
+                            if data:
+                                f.write(data)
+                                if digest:
+                                    digest.update(data)
+                                attempt_bytes += len(data)
+                                pending_metric_bytes += len(data)
+                                with self.lock:
+                                    self.downloaded_bytes += len(data)
+                                if pending_metric_bytes >= METRICS_FLUSH_BYTES:
+                                    bytes_metric.inc(pending_metric_bytes)
+                                    pending_metric_bytes = 0
+                finally:
+                    response.close()
+                    bytes_metric.inc(pending_metric_bytes)
+
+                if expected is not None and attempt_bytes != expected:
+                    # The whole body arrived, just not the manifest's size: a retry won't change it
+                    complete = content_length is None or attempt_bytes == int(content_length)
+                    raise RequestFailed(f"Size mismatch: expected {expected} bytes, got {attempt_bytes}",
+                                        fatal=complete)
+                if digest and digest.hexdigest() != item['sha256']:
+                    raise Exception("SHA-256 mismatch")
+                os.replace(temp_path, item['path'])
+                item['bytes'] = attempt_bytes
+                item['size'] = attempt_bytes
+                return
+
+            except Exception as e:
+                with self.lock:
+                    self.downloaded_bytes -= attempt_bytes
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                if not self.is_downloading:
+                    raise
+                FAILURES.labels(host=host, cause=failure_cause(e, getattr(e, 'status_code', None))).inc()
+                failures += 1
+                if not is_fatal(e):
+                    circuit_breaker.report_failure(host, self.connections_per_host)
+                delay, reason = retry_policy.next_delay(e, failures)
+                if delay is None:
+                    print(f"Bulk: {item['url']}: {str(e)} - giving up ({reason})")
+                    raise
+                item['retries'] += 1
+                with self.lock:
+                    self.retry_count += 1
+                print(f"Bulk: {item['url']}: {str(e)} (attempt {failures}/{retry_policy.max_attempts}), "
+                      f"retrying in {delay:.1f}s")
+                if self.stop_event.wait(delay):
+                    raise Exception("Download cancelled")
+
+    def fetch_large_file(self, item):
+        """A big file in the manifest gets the full multi-stream treatment."""
+        from downloader import MultiStreamDownloader
+
+        downloader = MultiStreamDownloader(item['url'], num_streams=None)
+        with self.lock:
+            if not self.is_downloading:
+                raise Exception("Download cancelled")
+            self.large_downloads.add(downloader)  # So cancel() reaches it
+        try:
+            result = downloader.download(item['path'])
+        finally:
+            with self.lock:
+                self.large_downloads.discard(downloader)
+        if not result:
+            raise Exception("Download cancelled" if downloader.cancelled else "Multi-stream download failed")
+        if item['sha256']:
+            digest = hashlib.sha256()
+            with open(result, 'rb') as f:
+                for block in iter(lambda: f.read(1024 * 1024), b''):
+                    digest.update(block)
+            if digest.hexdigest() != item['sha256']:
+                os.remove(result)
+                raise Exception("SHA-256 mismatch")
+        item['bytes'] = os.path.getsize(result)
+        with self.lock:
+            self.downloaded_bytes += item['bytes']
+
+    def get_status(self, include_files=False):
+        """Aggregate progress of the batch (optionally with per-file state)."""
+        with self.lock:
+            completed, failed, active = self.completed, self.failed, self.active
+            downloaded = self.downloaded_bytes
+        total = len(self.files)
+        known_sizes = [item['size'] for item in self.files if item['size'] is not None]
+        elapsed = ((self.end_time or time.time()) - self.start_time) if self.start_time else 0
+
+        status = {
+            'total_files': total,
+            'completed': completed,
+            'failed': failed,
+            'active': active,
+            'pending': total - completed - failed - active,
+            'progress': (completed + failed) / total * 100,
+            'downloaded_bytes': downloaded,
+            'total_bytes': sum(known_sizes) if len(known_sizes) == total else None,
+            'elapsed_seconds': elapsed,
+            'files_per_second': completed / elapsed if elapsed > 0 else 0,
+            'throughput_MBps': downloaded / (elapsed * 1024 * 1024) if elapsed > 0 else 0,
+            'retries': self.retry_count,
+            'workers': self.workers,
+            'connections_per_host': self.connections_per_host,
+            'errors': [
+                {'url': item['url'], 'error': item['error']}
+                for item in self.files if item['status'] == 'failed'
+            ][:50]
+        }
+        if include_files:
+            status['files'] = [
+                {key: item[key] for key in ('url', 'path', 'status', 'size', 'bytes', 'seconds', 'retries', 'error')}
+                for item in self.files
+            ]
+        return status
+
+    def record_run(self, outcome, status):
+        """Append the batch as one run to the run-history store."""
+        hosts = {urlparse(item['url']).hostname or '' for item in self.files}
+        try:
+            metrics_store.record_run({
+                'url': f"manifest ({len(self.files)} files)",
+                'host': hosts.pop() if len(hosts) == 1 else '(multiple)',
+                'mode': 'bulk',
+                'result': outcome,
+                'num_streams': self.connections_per_host,
+                'file_size': status['downloaded_bytes'],
+                'total_seconds': status['elapsed_seconds'],
+                'throughput_MBps': status['throughput_MBps'] if outcome == 'completed' else None,
+                'retries': self.retry_count,
+                'segments': []
+            })
+        except Exception as e:
+            print(f"Failed to record run metrics: {str(e)}")
+
+    def cancel(self):
+        """Stop the batch; files already finished are kept."""
+        print("Cancelling bulk download...")
+        with self.lock:
+            self.is_downloading = False
+            self.stop_event.set()
+            large_downloads = list(self.large_downloads)
+        for downloader in large_downloads:
+            downloader.cancel()
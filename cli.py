@@ -0,0 +1,283 @@
+# cli.py - Headless command-line entry point: python -m cli get URL [-n streams] [-o path] [--json]
+
+# Only the standard library and config are imported up front; the engine
+# (requests and friends) once the arguments are valid, and Flask/tkinter never.
+import argparse
+import contextlib
+import json
+import os
+import sys
+import time
+
+from config import BULK_CONNECTIONS_PER_HOST, BULK_WORKERS
+
+EXIT_OK = 0
+EXIT_FAILED = 1  # Download failed (2 is argparse's usage error)
+EXIT_INTERRUPTED = 130
+
+PROGRESS_INTERVAL = 0.2  # seconds between progress redraws on a terminal
+PROGRESS_LOG_INTERVAL = 5.0  # seconds between progress lines when stderr is a file
+
+
+class Progress:
+    """Compact progress on stderr: one redrawn line on a terminal, occasional lines otherwise."""
+
+    def __init__(self, stream=None, enabled=True):
+        self.stream = stream or sys.stderr
+        self.enabled = enabled
+        self.tty = self.stream.isatty()
+        self.interval = PROGRESS_INTERVAL if self.tty else PROGRESS_LOG_INTERVAL
+        self.start = time.time()
+        self.last = 0
+        self.drawn = False
+
+    def due(self, final):
+        now = time.time()
+        if not self.enabled or (not final and now - self.last < self.interval):
+            return False
+        self.last = now
+        return True
+
+    def write(self, text):
+        if self.tty:
+            self.stream.write('\r' + text.ljust(60))
+            self.drawn = True
+        else:
+            self.stream.write(text + '\n')
+        self.stream.flush()
+
+    def bytes(self, downloaded, total):
+        """progress_callback for MultiStreamDownloader / SimpleDownloader."""
+        if not self.due(total and downloaded >= total):
+            return
+        speed = downloaded / max(time.time() - self.start, 1e-6) / (1024 * 1024)
+        if total:
+            self.write(f"{downloaded / total * 100:5.1f}%  {downloaded / (1024 * 1024):.1f}/"
+                       f"{total / (1024 * 1024):.1f} MB  {speed:.1f} MB/s")
+        else:
+            self.write(f"{downloaded / (1024 * 1024):.1f} MB  {speed:.1f} MB/s")
+
+    def files(self, done, total, downloaded):
+        """progress_callback for BulkDownloader."""
+        if not self.due(done >= total):
+            return
+        elapsed = max(time.time() - self.start, 1e-6)
+        self.write(f"{done}/{total} files  {done / elapsed:.1f} files/s  "
+                   f"{downloaded / (1024 * 1024):.1f} MB")
+
+    def finish(self):
+        if self.drawn:
+            self.stream.write('\n')
+            self.stream.flush()
+
+
+@contextlib.contextmanager
+def engine_output(verbose):
+    """
+    The engine logs with print() and its tracebacks go to stderr: keep
+    stdout clean for the result, and (unless -v) stderr for the progress
+    and the one-line outcome.
+    """
+    if verbose:
+        with contextlib.redirect_stdout(sys.stderr):
+            yield
+        return
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull), \
+            contextlib.redirect_stderr(devnull):
+        yield
+
+
+def compact_metrics(metrics):
+    """Detailed metrics without the per-sample series."""
+    metrics = dict(metrics or {})
+    metrics.pop('throughput_series', None)
+    for stream in metrics.get('stream_throughput') or []:
+        stream.pop('series', None)
+    return metrics
+
+
+def cmd_get(args, out):
+    if args.single:
+        from simple_downloader import SimpleDownloader
+    elif args.delta:
+        from delta import DeltaDownloader, load_index
+    else:
+        from downloader import MultiStreamDownloader
+
+    progress = Progress(enabled=not args.quiet)
+    if args.delta:
+        try:
+            downloader = DeltaDownloader(args.url, load_index(args.delta), old_path=args.old,
+                                         num_streams=args.streams)
+        except ValueError as e:
+            print(str(e), file=sys.stderr)
+            return EXIT_FAILED
+    elif args.single:
+        downloader = SimpleDownloader(args.url, progress_callback=progress.bytes)
+    else:
+        try:
+            segment_hashes = None
+            if args.hashes:
+                with open(args.hashes) as f:
+                    segment_hashes = json.load(f)
+            downloader = MultiStreamDownloader(args.url, num_streams=args.streams, progress_callback=progress.bytes,
+                                               transport='http2' if args.http2 else None,
+                                               segment_hashes=segment_hashes, sink=args.sink)
+        except (OSError, ValueError) as e:
+            print(f"Bad segment hashes: {str(e)}" if args.hashes else str(e), file=sys.stderr)
+            return EXIT_FAILED
+
+    try:
+        with engine_output(args.verbose):
+            result = downloader.download(args.output)
+    except KeyboardInterrupt:
+        with engine_output(args.verbose):
+            downloader.cancel()
+        progress.finish()
+        print("Interrupted", file=sys.stderr)
+        return EXIT_INTERRUPTED
+    progress.finish()
+
+    if args.json:
+        record = {'ok': bool(result), 'url': args.url, 'path': result}
+        if result:
+            record['metrics'] = (downloader.get_metrics() if args.delta
+                                 else compact_metrics(downloader.get_detailed_metrics()))
+        json.dump(record, out, default=str)
+        out.write('\n')
+    elif result:
+        out.write(result + '\n')
+
+    if not result:
+        reason = getattr(downloader, 'failure', None)
+        print(f"Download failed: {args.url}" + (f" ({reason})" if reason else ''), file=sys.stderr)
+        return EXIT_FAILED
+    return EXIT_OK
+
+
+def cmd_bulk(args, out):
+    from bulk_downloader import BulkDownloader, load_manifest
+
+    try:
+        manifest = load_manifest(args.manifest)
+        progress = Progress(enabled=not args.quiet)
+        downloader = BulkDownloader(manifest, output_dir=args.output, workers=args.workers,
+                                    connections_per_host=args.connections, progress_callback=progress.files)
+    except (OSError, ValueError, KeyError) as e:
+        print(f"Bad manifest: {str(e)}", file=sys.stderr)
+        return EXIT_FAILED
+
+    try:
+        with engine_output(args.verbose):
+            status = downloader.download()
+    except KeyboardInterrupt:
+        downloader.cancel()
+        progress.finish()
+        print("Interrupted", file=sys.stderr)
+        return EXIT_INTERRUPTED
+    progress.finish()
+
+    if args.json:
+        json.dump(status, out)
+        out.write('\n')
+    else:
+        out.write(f"{status['completed']}/{status['total_files']} files, {status['failed']} failed, "
+                  f"{status['files_per_second']:.1f} files/s\n")
+        for error in status['errors']:
+            print(f"  {error['url']}: {error['error']}", file=sys.stderr)
+    return EXIT_OK if not status['failed'] else EXIT_FAILED
+
+
+def cmd_zip(args, out):
+    from remote_zip import RemoteZip, RemoteZipError
+
+    archive = None
+    try:
+        with engine_output(args.verbose):
+            archive = RemoteZip(args.url, num_streams=args.streams)
+            if args.members:
+                paths = archive.extract(args.members, args.output or os.getcwd())
+    except (RemoteZipError, ValueError, OSError) as e:
+        print(f"Remote zip failed: {str(e)}", file=sys.stderr)
+        return EXIT_FAILED
+    except KeyboardInterrupt:
+        if archive is not None:
+            with engine_output(args.verbose):
+                archive.downloader.cancel()
+        print("Interrupted", file=sys.stderr)
+        return EXIT_INTERRUPTED
+
+    if not args.members:
+        if args.json:
+            json.dump(archive.members(), out)
+            out.write('\n')
+        else:
+            for member in archive.members():
+                out.write(f"{member['size']:>12}  {member['name']}\n")
+        return EXIT_OK
+    if args.json:
+        json.dump({'paths': paths, 'downloaded_bytes': archive.downloader.downloaded_bytes,
+                   'archive_size': archive.downloader.file_size}, out)
+        out.write('\n')
+    else:
+        for path in paths:
+            out.write(path + '\n')
+    return EXIT_OK
+
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(prog='python -m cli', description="Multi-stream downloader (headless)")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    get = commands.add_parser('get', help="Download one URL")
+    get.add_argument('url')
+    get.add_argument('-n', '--streams', type=int, help="Parallel streams (default: learned per host)")
+    get.add_argument('-o', '--output', help="Output file (default: the download folder)")
+    get.add_argument('--single', action='store_true', help="Single-stream, browser-style download")
+    get.add_argument('--http2', action='store_true', help="Multiplex the streams over HTTP/2")
+    get.add_argument('--hashes', help='JSON file {"block_size": n, "sha256": [...]} to verify blocks against')
+    get.add_argument('--delta', metavar='INDEX', help="Delta update: index of the new file (path or URL, see delta.py)")
+    get.add_argument('--old', help="Old copy to take unchanged blocks from (default: the output file)")
+    get.add_argument('--sink', metavar='S3_URL',
+                     help="Upload to s3://bucket/key as it downloads, nothing on local disk (see sinks.py)")
+
+    bulk = commands.add_parser('bulk', help="Download every file in a manifest")
+    bulk.add_argument('manifest', help="JSON list or text file of 'url [size] [sha256]' lines")
+    bulk.add_argument('-o', '--output', help="Output folder (default: the download folder)")
+    bulk.add_argument('--workers', type=int, default=BULK_WORKERS, help="Files fetched concurrently")
+    bulk.add_argument('--connections', type=int, default=BULK_CONNECTIONS_PER_HOST, help="Keep-alive connections per host")
+
+    unzip = commands.add_parser('zip', help="List a remote .zip, or extract members of it, with range requests")
+    unzip.add_argument('url')
+    unzip.add_argument('members', nargs='*', help="Members to extract (none: list the archive)")
+    unzip.add_argument('-n', '--streams', type=int, help="Parallel streams (default: learned per host)")
+    unzip.add_argument('-o', '--output', help="Output folder (default: the current folder)")
+
+    for command in (get, bulk, unzip):
+        command.add_argument('--json', action='store_true', help="Print the result as JSON on stdout")
+        command.add_argument('-q', '--quiet', action='store_true', help="No progress on stderr")
+        command.add_argument('-v', '--verbose', action='store_true', help="Engine log on stderr")
+    return parser
+
+
+def main(argv=None):
+    args = build_arg_parser().parse_args(argv)
+    if args.command in ('get', 'zip') and not args.url.startswith(('http://', 'https://')):
+        print("URL must start with http:// or https://", file=sys.stderr)
+        return 2
+    if args.command == 'get' and args.delta and (args.single or args.hashes):
+        print("--delta can't be combined with --single or --hashes (the index has the hashes)", file=sys.stderr)
+        return 2
+    if args.command == 'get' and args.sink and (args.single or args.delta or args.hashes or args.output):
+        print("--sink can't be combined with --single, --delta, --hashes or -o", file=sys.stderr)
+        return 2
+    out = sys.stdout
+    if args.command == 'get':
+        return cmd_get(args, out)
+    if args.command == 'zip':
+        return cmd_zip(args, out)
+    return cmd_bulk(args, out)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,74 @@
+# coalescing.py - Which submissions of a URL can share one in-flight download
+
+import os
+import shutil
+from urllib.parse import urlsplit, urlunsplit
+
+from config import CONNECTION_TIMEOUT
+from resolver import http_session
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+
+def normalize_url(url):
+    """
+    Key for "the same resource": scheme and host lower-cased, default port and
+    fragment dropped, empty path as '/'. Path and query are kept as given
+    (servers may treat case and parameter order as significant).
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or '').lower()
+    if ':' in host:
+        host = f'[{host}]'  # IPv6 literal
+    try:
+        port = parts.port
+    except ValueError:
+        port = None
+    netloc = host if port in (None, DEFAULT_PORTS.get(scheme)) else f'{host}:{port}'
+    if parts.username:
+        netloc = f"{parts.username}{':' + parts.password if parts.password else ''}@{netloc}"
+    return urlunsplit((scheme, netloc, parts.path or '/', parts.query, ''))
+
+
+def response_validators(response):
+    """ETag and Last-Modified of a response (only those the server sent)."""
+    validators = {}
+    if response.headers.get('ETag'):
+        validators['etag'] = response.headers['ETag']
+    if response.headers.get('Last-Modified'):
+        validators['last_modified'] = response.headers['Last-Modified']
+    return validators
+
+
+def still_current(url, validators):
+    """
+    True if the resource at `url` still has `validators` (checked with a HEAD),
+    i.e. a download that started earlier is fetching what a new request would.
+    Nothing to compare (no validators) counts as current; a failed check doesn't.
+    """
+    if not validators:
+        return True
+    session = http_session()
+    try:
+        response = session.head(url, timeout=CONNECTION_TIMEOUT, allow_redirects=True)
+        response.close()
+    except Exception as e:
+        print(f"Coalescing: validator check for {url} failed ({str(e)})")
+        return False
+    finally:
+        session.close()
+    if response.status_code != 200:
+        return False
+    current = response_validators(response)
+    return all(current.get(name) == value for name, value in validators.items())
+
+
+def link_or_copy(source, target):
+    """Give `target` the finished file at `source`: a hard link if possible, else a copy."""
+    if os.path.exists(target):
+        os.remove(target)
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copyfile(source, target)  # Other filesystem, or links not supported
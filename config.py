@@ -6,25 +6,131 @@ DEFAULT_NUM_STREAMS = 8  # Number of parallel connections
 MIN_STREAMS = 1
 MAX_STREAMS = 16  # Cap to avoid overwhelming the network
 
+# Learned per-host stream-count profiles (used when num_streams isn't given)
+PROFILE_EXPLORE_RATE = 0.1  # Chance of trying a neighbouring stream count
+PROFILE_MIN_RUNS = 3  # Explore more until the best setting has this many runs
+PROFILE_EWMA_ALPHA = 0.3  # Weight of the newest run in a profile cell
+
 # Chunk size settings
 MIN_CHUNK_SIZE = 1024 * 1024  # 1 MB minimum per chunk
 BUFFER_SIZE = 8192  # 8 KB buffer for reading/writing
+STREAM_BUFFER_SIZE = 64 * 1024  # 64 KB buffer for unknown-length single streams
+
+# Write-back stage (socket reads and disk writes decoupled, see writer.py)
+WRITE_BLOCK_SIZE = 1024 * 1024  # streams coalesce buffers into writes of this size
+WRITE_QUEUE_BYTES = 64 * 1024 * 1024  # memory cap per download; streams wait only when it's full
+WRITE_FSYNC = 'final'  # 'none', 'final' (fsync the finished file) or 'interval' (also during writes)
+WRITE_FSYNC_INTERVAL = 64 * 1024 * 1024  # bytes per file between fsyncs with 'interval'
+
+# Size probing settings (for servers that omit Content-Length)
+PROBE_INITIAL_OFFSET = 1024 * 1024  # First offset tried by exponential probing
+PROBE_MAX_SIZE = 1024 ** 4  # Give up probing beyond 1 TB
 
 # Download folder
 DOWNLOAD_FOLDER = os.path.join(os.path.expanduser("~"), "Downloads", "MultiStreamDownloader")
 
+# Run-history metrics store (hidden file, so the file manager skips it)
+METRICS_DB_PATH = os.path.join(DOWNLOAD_FOLDER, ".download_history.db")
+
+# Startup (overlap connection set-up with the capability probe)
+PROBE_WITH_FIRST_SEGMENT = True  # probe with a ranged GET whose body becomes stream 0
+CONNECTION_WARMUP = True  # open the other streams' connections while the probe is in flight
+
+# Bulk mode (manifests of many small files)
+BULK_WORKERS = 16  # files fetched concurrently
+BULK_CONNECTIONS_PER_HOST = 4  # keep-alive connections shared by all files of a host
+BULK_LARGE_FILE_SIZE = 64 * 1024 * 1024  # files known to be this big get a multi-stream download
+
 # Timeout settings
 CONNECTION_TIMEOUT = 5 # seconds
 READ_TIMEOUT = 15  # seconds
 
-# Retry settings
-MAX_RETRIES = 3
-RETRY_DELAY = 2  # seconds
+# Metrics settings
+METRICS_FLUSH_BYTES = 1024 * 1024  # Batch byte counter updates per 1 MB received
+
+# Throughput sampling (per-stream ring buffers)
+THROUGHPUT_SAMPLE_INTERVAL = 0.5  # seconds per sample
+THROUGHPUT_SAMPLES = 120  # samples kept per stream (60 s of history)
+INSTANT_WINDOW = 2.0  # seconds averaged for "instantaneous" speed
+EWMA_ALPHA = 0.3  # weight of the newest sample in the smoothed speed
+LIVE_METRICS_INTERVAL_MS = 1000  # GUI refresh of live per-stream speeds
+
+# Transport for multi-stream downloads
+DEFAULT_TRANSPORT = 'http1'  # 'http1' (a connection per stream) or 'http2' (needs httpx[http2])
+H2_MAX_CONNECTIONS = 1  # HTTP/2 connections shared by all streams of a download
+
+# DNS (shared cache; streams spread across all resolved addresses of a host)
+DNS_CACHE_TTL = 300  # seconds a lookup is reused across downloads
+DNS_SPREAD_STREAMS = True
+DNS_MAX_FAILURES = 2  # consecutive failed attempts before an address is avoided
+DNS_SLOW_FRACTION = 0.5  # avoid addresses slower than this fraction of the host's best
+DNS_PENALTY_SECONDS = 120  # how long a bad address is avoided
+
+# Hedged tails (re-request the end of a straggling stream on a new connection)
+HEDGING_ENABLED = True
+HEDGE_CHECK_INTERVAL = 0.5  # seconds between straggler checks
+HEDGE_SLOWDOWN = 3.0  # hedge when a stream's ETA is this many times the typical stream's
+HEDGE_MIN_SECONDS = 1.0  # ...and at least this far from finishing
+HEDGE_MIN_BYTES = 256 * 1024  # don't hedge tails smaller than this
+HEDGE_BUDGET_FRACTION = 0.25  # max duplicate bytes, as a fraction of the file size
+
+# Priority scheduling of running multi-stream downloads (DownloadManager / REST jobs)
+PRIORITY_CLASSES = ('high', 'normal', 'low')  # highest first
+DEFAULT_PRIORITY = 'normal'
+SCHEDULER_TOTAL_STREAMS = 32  # streams shared by all running downloads
+SCHEDULER_MIN_STREAMS = 1  # floor per download: lower classes shrink to this (0 = hold them)
+SCHEDULER_INTERVAL = 1.0  # seconds between rebalances (also on start, finish, pause)
+
+# Coalescing: a URL submitted while it is already downloading attaches to that
+# download (same resource = same normalized URL and validators, see coalescing.py)
+COALESCE_DOWNLOADS = True
+
+# Tracing settings (phase-level spans; off by default, or set MSD_TRACING=1)
+TRACING_ENABLED = False
+TRACING_EXPORTERS = ('jsonl',)  # 'jsonl' and/or 'otlp'
+TRACE_FILE = os.path.join(DOWNLOAD_FOLDER, ".traces.jsonl")
+OTLP_ENDPOINT = 'http://127.0.0.1:4318/v1/traces'
+
+# Retry settings (see retry_policy.py)
+MAX_RETRIES = 5  # attempts per segment in a row without progress before the download fails
+RETRY_DELAY = 1  # seconds; base of the exponential back-off
+RETRY_MAX_DELAY = 30  # seconds; back-off ceiling
+RETRY_AFTER_MAX = 120  # seconds; a longer Retry-After fails the download instead of waiting
+RETRY_STATUS_CODES = (408, 425, 429, 500, 502, 503, 504)  # other error statuses are fatal
+
+# Verification and repair of the parts before assembly
+REPAIR_MAX_PASSES = 3  # verify / re-fetch rounds before the download fails
+REPAIR_MAX_FRACTION = 1.0  # re-fetched bytes allowed, as a fraction of the file size (1.0 = a full download)
+
+# Partial fetches (MultiStreamDownloader.fetch_ranges, remote zip members)
+RANGE_MERGE_GAP = 64 * 1024  # ranges less than this apart share a request (the gap is fetched and dropped)
+RANGE_PIECE_SIZE = 4 * 1024 * 1024  # longer ranges are split into requests of this size, one per stream
+RANGE_FETCH_MAX_BYTES = 512 * 1024 * 1024  # fetched ranges are held in memory; bigger selections should be downloaded whole
+REMOTE_ZIP_TAIL = 256 * 1024  # bytes read from the end of an archive: its end record and, usually, central directory
+
+# Delta downloads (see delta.py): blocks found in an old local copy aren't fetched
+DELTA_BLOCK_SIZE = 32 * 1024  # block size of new indexes: smaller finds more reuse, larger makes smaller indexes
+DELTA_CRAWL_LIMIT = 32 * 1024 * 1024  # old-copy bytes searched byte by byte (slow, ~1.5 MB/s); past it only whole blocks match
+
+# Object-storage sink (see sinks.py): get URL --sink s3://bucket/key streams into a multipart upload
+S3_ENDPOINT = None  # e.g. 'http://127.0.0.1:9000' for MinIO, path-style (or set MSD_S3_ENDPOINT); None = AWS
+S3_REGION = 'us-east-1'  # unless AWS_REGION is set; credentials from AWS_ACCESS_KEY_ID / AWS_SECRET_ACCESS_KEY
+S3_PART_SIZE = 8 * 1024 * 1024  # upload part size (S3 minimum 5 MB); segments are aligned to it
+S3_UPLOAD_THREADS = 4  # parts uploaded at once
+S3_UPLOAD_QUEUE_BYTES = 64 * 1024 * 1024  # full parts waiting for upload; streams wait only when it's full
+S3_UPLOAD_RETRIES = 3  # extra attempts per part on connection errors and 5xx
+
+# Per-host circuit breaker, shared by all downloads
+CIRCUIT_FAILURES = 5  # transient failures within CIRCUIT_WINDOW that open the circuit
+CIRCUIT_WINDOW = 10  # seconds
+CIRCUIT_COOLDOWN = 5  # seconds requests to the host wait once open (doubles on each re-trip)
+CIRCUIT_MAX_COOLDOWN = 60  # seconds
+CIRCUIT_RECOVERY_INTERVAL = 5  # seconds without failures before the host's stream cap grows by one
 
 # Flask settings
 FLASK_HOST = '0.0.0.0'
 FLASK_PORT = 5000
 FLASK_DEBUG = True
 
-# Create download folder if it doesn't exist
-os.makedirs(DOWNLOAD_FOLDER, exist_ok=True)
\ No newline at end of file
+# DOWNLOAD_FOLDER is created by whatever first writes to it (downloads, the
+# history database, traces), so importing config has no side effects
\ No newline at end of file
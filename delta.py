@@ -0,0 +1,303 @@
+# delta.py - zsync-style delta downloads: reuse the blocks of a local older copy, fetch only the rest
+#
+# Index a file (on the server side, next to the file):
+#     python delta.py build.iso                  -> build.iso.zsync.json
+# Update a local copy with it:
+#     python -m cli get URL --delta build.iso.zsync.json [--old old-build.iso]
+
+import argparse
+import hashlib
+import json
+import mmap
+import os
+import sys
+import time
+import zlib
+
+from config import DELTA_BLOCK_SIZE, DELTA_CRAWL_LIMIT, DOWNLOAD_FOLDER
+
+INDEX_VERSION = 1
+ADLER_MOD = 65521
+
+
+def build_index(path, block_size=DELTA_BLOCK_SIZE):
+    """
+    Block-checksum index of the file at `path`: for every `block_size` block
+    its Adler-32 (the rolling checksum that finds it at any offset of an
+    old copy) and SHA-256 (which confirms the match). The 'block_size' and
+    'sha256' keys are also valid segment hashes for a normal download.
+    """
+    rsum, sha256 = [], []
+    whole = hashlib.sha256()
+    size = 0
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            rsum.append(zlib.adler32(block))
+            sha256.append(hashlib.sha256(block).hexdigest())
+            whole.update(block)
+            size += len(block)
+    return {
+        'version': INDEX_VERSION,
+        'filename': os.path.basename(path),
+        'size': size,
+        'block_size': block_size,
+        'rsum': rsum,
+        'sha256': sha256,
+        'file_sha256': whole.hexdigest()
+    }
+
+
+def load_index(source, session=None):
+    """Read an index from a path or an http(s) URL and check it's usable. Raises ValueError otherwise."""
+    try:
+        if source.startswith(('http://', 'https://')):
+            from resolver import http_session
+            http = session or http_session()
+            response = http.get(source, timeout=30)
+            response.raise_for_status()
+            index = response.json()
+        else:
+            with open(source) as f:
+                index = json.load(f)
+    except (OSError, ValueError) as e:
+        raise ValueError(f"Could not read delta index {source}: {str(e)}")
+    except Exception as e:
+        raise ValueError(f"Could not fetch delta index {source}: {str(e)}")
+    block_size = index.get('block_size') if isinstance(index, dict) else None
+    if (not isinstance(block_size, int) or block_size <= 0 or not isinstance(index.get('size'), int)
+            or not isinstance(index.get('rsum'), list) or not isinstance(index.get('sha256'), list)
+            or len(index['rsum']) != len(index['sha256'])
+            or len(index['sha256']) != -(-index['size'] // block_size)):
+        raise ValueError(f"Not a delta index: {source}")
+    return index
+
+
+def find_local_blocks(old_path, index):
+    """
+    Look for the blocks of the new file in the old copy at `old_path`, at any
+    offset (so inserted or removed bytes don't spoil what follows).
+    Returns {block number: offset in the old file}.
+
+    After a match the next block is expected right behind it and checked by
+    SHA-256 alone, so unchanged stretches are read at hashing speed. Elsewhere
+    the Adler-32 of the window is rolled one byte at a time, and only windows
+    whose checksum is in the index are hashed; that byte-by-byte crawl (in
+    Python) is the slow part, and it only covers the changed regions. Past
+    DELTA_CRAWL_LIMIT crawled bytes (an old copy that has little in common
+    with the new file), the rest is only checked block by block.
+    """
+    block_size = index['block_size']
+    size = index['size']
+    full_blocks = size // block_size  # A short last block is only looked for at the end
+    digests = index['sha256']
+    weak = {}
+    for i in range(full_blocks):
+        weak.setdefault(index['rsum'][i], []).append(i)
+    found = {}
+    strong = None  # SHA-256 -> blocks, once crawling stops
+    crawl_left = DELTA_CRAWL_LIMIT
+
+    old_size = os.path.getsize(old_path)
+    if old_size == 0:
+        return found
+    with open(old_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as old:
+        pos = 0
+        expected = None  # Block that would follow the last match
+        while pos + block_size <= old_size and len(found) < full_blocks:
+            if expected is not None and expected < full_blocks and \
+                    hashlib.sha256(old[pos:pos + block_size]).hexdigest() == digests[expected]:
+                found.setdefault(expected, pos)
+                expected += 1
+                pos += block_size
+                continue
+            if crawl_left <= 0:
+                if strong is None:
+                    print(f"Delta: over {DELTA_CRAWL_LIMIT / (1024*1024):.0f} MB of the old copy differ, "
+                          "checking the rest block by block only")
+                    strong = {}
+                    for i in range(full_blocks):
+                        strong.setdefault(digests[i], []).append(i)
+                    pos = -(-pos // block_size) * block_size  # Same offsets as the new file's blocks
+                    continue
+                for i in strong.get(hashlib.sha256(old[pos:pos + block_size]).hexdigest(), ()):
+                    found.setdefault(i, pos)
+                pos += block_size
+                continue
+
+            # Roll the window forward until its checksum and hash match a block
+            expected = None
+            checksum = zlib.adler32(old[pos:pos + block_size])
+            a, b = checksum & 0xFFFF, checksum >> 16
+            last = old_size - block_size
+            while True:
+                matches = weak.get((b << 16) | a)
+                if matches:
+                    digest = hashlib.sha256(old[pos:pos + block_size]).hexdigest()
+                    matched = [i for i in matches if digests[i] == digest]
+                    if matched:
+                        for i in matched:
+                            found.setdefault(i, pos)  # Blocks with the same content share it
+                        expected = matched[-1] + 1
+                        pos += block_size
+                        break
+                if pos >= last:
+                    pos = old_size
+                    break
+                crawl_left -= 1
+                if crawl_left <= 0:
+                    break
+                out, new = old[pos], old[pos + block_size]
+                a = (a - out + new) % ADLER_MOD
+                b = (b - block_size * out - 1 + a) % ADLER_MOD
+                pos += 1
+
+        tail = size % block_size
+        if tail and old_size >= tail and hashlib.sha256(old[old_size - tail:]).hexdigest() == digests[full_blocks]:
+            found[full_blocks] = old_size - tail
+    return found
+
+
+class DeltaDownloader:
+    """
+    Brings a local older copy up to date with the file at `url`, given the
+    new file's index. Blocks found in the old copy are copied locally; only
+    the others are fetched, with MultiStreamDownloader.fetch_ranges. The
+    result is checked block by block against the index (mismatches are
+    fetched again) and replaces the output file only once it verifies.
+    """
+
+    def __init__(self, url, index, old_path=None, num_streams=None):
+        from downloader import MultiStreamDownloader
+        self.url = url
+        self.index = index
+        self.old_path = old_path
+        self.downloader = MultiStreamDownloader(url, num_streams=num_streams)
+        self.failure = None
+        self.reused_bytes = 0
+        self.fetched_bytes = 0
+        self.total_time = 0.0
+
+    @property
+    def cancelled(self):
+        return self.downloader.cancelled
+
+    def cancel(self):
+        self.downloader.cancel()
+
+    def block_range(self, i):
+        block_size = self.index['block_size']
+        return i * block_size, min((i + 1) * block_size, self.index['size']) - 1
+
+    def download(self, output_path=None):
+        """Build the new file at output_path. Returns its path, or None (self.failure says why)."""
+        start = time.time()
+        try:
+            return self._download(output_path)
+        except Exception as e:
+            self.failure = self.failure or str(e)
+            print(f"Delta download failed: {self.failure}")
+            return None
+        finally:
+            self.total_time = time.time() - start
+
+    def _download(self, output_path):
+        downloader = self.downloader
+        if not downloader.probe_ranges():
+            self.failure = downloader.failure
+            return None
+        size = self.index['size']
+        if downloader.file_size != size:
+            self.failure = (f"Index is for a {size:,} byte file, the server has {downloader.file_size:,} bytes "
+                            f"(index out of date?)")
+            return None
+        if output_path is None:
+            output_path = os.path.join(DOWNLOAD_FOLDER, self.index.get('filename') or downloader.filename)
+        old_path = self.old_path or output_path
+        os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+
+        found = {}
+        if os.path.exists(old_path):
+            scan_start = time.time()
+            found = find_local_blocks(old_path, self.index)
+            print(f"Delta: {len(found)} of {len(self.index['sha256'])} blocks found in {old_path} "
+                  f"({time.time() - scan_start:.1f}s)")
+        else:
+            print(f"Delta: no old copy at {old_path}, fetching everything")
+
+        temp_path = output_path + '.delta'
+        with open(temp_path, 'wb') as out:
+            out.truncate(size)
+            if found:
+                with open(old_path, 'rb') as old:
+                    for i, offset in sorted(found.items()):
+                        start, end = self.block_range(i)
+                        old.seek(offset)
+                        out.seek(start)
+                        out.write(old.read(end - start + 1))
+                        self.reused_bytes += end - start + 1
+        try:
+            missing = [i for i in range(len(self.index['sha256'])) if i not in found]
+            for attempt in range(2):  # A second round for blocks that arrived different from the index
+                if missing:
+                    ranges = [self.block_range(i) for i in missing]
+                    if not downloader.fetch_ranges(ranges, into=temp_path):
+                        self.failure = 'Cancelled' if downloader.cancelled else downloader.failure
+                        return None
+                    self.fetched_bytes += sum(end - start + 1 for start, end in ranges)
+                missing = self.corrupt_blocks(temp_path)
+                if not missing:
+                    break
+                print(f"Delta: {len(missing)} blocks don't match the index" + (", fetching them again" if not attempt else ''))
+            if missing:
+                self.failure = f"{len(missing)} blocks still don't match the index (file changed on the server?)"
+                return None
+            os.replace(temp_path, output_path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+        print(f"Delta: {self.reused_bytes / (1024*1024):.2f} MB reused, {self.fetched_bytes / (1024*1024):.2f} MB "
+              f"fetched ({self.fetched_bytes / max(size, 1):.1%} of {size / (1024*1024):.2f} MB)")
+        return output_path
+
+    def corrupt_blocks(self, path):
+        """Blocks of the file at `path` whose SHA-256 differs from the index."""
+        corrupt = []
+        with open(path, 'rb') as f:
+            for i, digest in enumerate(self.index['sha256']):
+                start, end = self.block_range(i)
+                if hashlib.sha256(f.read(end - start + 1)).hexdigest() != digest:
+                    corrupt.append(i)
+        return corrupt
+
+    def get_metrics(self):
+        size = self.index['size']
+        return {
+            'file_size_mb': size / (1024 * 1024),
+            'reused_mb': self.reused_bytes / (1024 * 1024),
+            'fetched_mb': self.fetched_bytes / (1024 * 1024),
+            'fetched_fraction': self.fetched_bytes / size if size else 0,
+            'total_time': self.total_time
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write the block-checksum index used for delta downloads")
+    parser.add_argument('file', help="File to index (the new version, as published)")
+    parser.add_argument('-b', '--block-size', type=int, default=DELTA_BLOCK_SIZE, help="Block size in bytes")
+    parser.add_argument('-o', '--output', help="Index file (default: FILE.zsync.json)")
+    args = parser.parse_args()
+
+    index = build_index(args.file, args.block_size)
+    output = args.output or args.file + '.zsync.json'
+    with open(output, 'w') as f:
+        json.dump(index, f)
+    print(f"{len(index['sha256'])} blocks of {args.block_size:,} bytes indexed: {output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
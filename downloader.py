@@ -1,39 +1,145 @@
 # downloader.py - Core download functionality with detailed metrics and debugging
 
+import bisect
+import hashlib
 import os
+import queue
 import requests
+import shutil
 import threading
 from urllib.parse import urlparse, unquote
 import time
 from config import *
+from metrics import (
+    ACTIVE_DOWNLOADS, ACTIVE_STREAMS, DOWNLOADED_BYTES, DOWNLOADS, DUPLICATE_BYTES,
+    FAILURES, HEDGES, PROBE_DURATION, QUEUE_DEPTH, RETRIES, SEGMENT_DURATION,
+    TIME_TO_FIRST_BYTE, failure_cause
+)
+from host_profiles import host_profiles
+from metrics_store import metrics_store
+from throughput import ThroughputRing
+from tracing import NULL_TRACE, start_trace
+from resolver import abort_response, dns_cache, http_session, pinned
+from segments import SegmentTable
+from coalescing import response_validators
+from retry_policy import check_response, circuit_breaker, is_fatal, retry_policy
+from http2_transport import HTTP2Client
+from writer import WriteBackQueue, sync_file
+from sinks import open_sink
+
 
 class MultiStreamDownloader:
-    def __init__(self, url, num_streams=DEFAULT_NUM_STREAMS, progress_callback=None):
+    def __init__(self, url, num_streams=DEFAULT_NUM_STREAMS, progress_callback=None, trace=None,
+                 transport=None, segment_hashes=None, sink=None):
         """
         Initialize the downloader.
             url: The URL to download from
             num_streams: Number of parallel streams to use
+                         (None = best-known setting for the host, see host_profiles)
             progress_callback: Function to call with progress updates (for GUI)
+            trace: Record phase-level tracing spans (None = config default)
+            transport: 'http1' (a connection per stream) or 'http2' (streams
+                       multiplexed over H2_MAX_CONNECTIONS connections)
+            segment_hashes: {'block_size': n, 'sha256': [hex digest of each
+                            n-byte block of the file]} to verify the parts
+                            against before assembly (None = sizes only)
+            sink: Where the file goes (see sinks.py): None = part files
+                  assembled at the output path, 's3://bucket/key' = streamed
+                  into an S3-compatible multipart upload, no local copy
         """
         self.url = url
-        self.num_streams = min(max(num_streams, MIN_STREAMS), MAX_STREAMS)
+        self.host = urlparse(url).hostname or ''
+        self.auto_streams = num_streams is None
+        self.stream_choice = 'auto' if self.auto_streams else 'manual'
+        self.num_streams = min(max(num_streams or DEFAULT_NUM_STREAMS, MIN_STREAMS), MAX_STREAMS)
+        self.supports_ranges = False
         self.progress_callback = progress_callback
+        self.trace_enabled = trace
+        self.trace = NULL_TRACE
+        self.transport = transport or DEFAULT_TRANSPORT
+        if self.transport not in ('http1', 'http2'):
+            raise ValueError(f"Unknown transport: {self.transport}")
+        self.h2_client = None
+        if segment_hashes is not None:
+            block_size = segment_hashes.get('block_size') if isinstance(segment_hashes, dict) else None
+            if (not isinstance(block_size, int) or block_size <= 0
+                    or not isinstance(segment_hashes.get('sha256'), list)):
+                raise ValueError("segment_hashes needs a positive 'block_size' and a 'sha256' list")
+        self.segment_hashes = segment_hashes
+        self.sink = open_sink(sink, self)
+        if segment_hashes is not None and not self.sink.local:
+            raise ValueError("segment_hashes need the parts on local disk (no sink)")
         
         # Download state
         self.file_size = 0
         self.downloaded_bytes = 0
-        self.chunks = []
+        # Byte range, progress, timings, retries and address of every segment
+        # (a stream's chunk), see segments.py
+        self.segments = SegmentTable()
         self.temp_files = []
         self.is_downloading = False
-        self.threads = []
+        self.stream_threads = {}  # chunk_id -> thread of each running stream
         self.lock = threading.Lock()
         self.start_time = None
+        self.first_byte_time = None
+        
+        # Throughput sampling: one ring per stream plus one for the whole download
+        self.stream_rates = {}
+        self.total_rate = ThroughputRing()
+        
+        # Recovery tracking (bytes and time spent on failed attempts). A chunk's
+        # failures in a row without progress decide when to give up; the first
+        # chunk to give up fails the whole download (self.failure says why)
+        self.retry_count = 0
+        self.failure = None
+        
+        # Verification and repair: ranges found damaged after the streams ended
+        # and re-fetched (see verify_and_repair)
+        self.repair_passes = 0
+        self.repaired_ranges = 0
+        self.repaired_bytes = 0
+        self.piece_workers = 1  # Connections run_pieces is using (for the circuit breaker)
+        self.refetched_bytes = 0
+        self.recovery_seconds = 0.0
+        
+        # Hedged tails: response of each primary stream, hedge state per
+        # chunk, and bytes fetched twice
+        self.chunk_responses = {}
+        self.hedges = {}
+        self.hedge_threads = []
+        self.hedge_reserved = 0
+        self.duplicate_bytes = 0
+        self.duplicate_budget = 0
         
-        # Metrics tracking
-        self.chunk_start_times = {}
-        self.chunk_end_times = {}
-        self.chunk_speeds = {}
-        self.chunk_bytes = {}
+        # Writer stage: streams queue blocks, one thread writes them to disk
+        self.write_queue = None
+        
+        # Startup: the probe's still-open response (stream 0 keeps reading it)
+        # and connections warmed up for the other streams during the probe
+        self.filename = None
+        self.validators = {}  # ETag / Last-Modified from the probe (see coalescing.py)
+        self.probe_start = None
+        self.probe_response = None
+        self.probe_http = None
+        self.probe_address = None  # Address the probe connected to (stream 0's, once planned)
+        self.warm_sessions = {}
+        
+        # Control: pause() stops the streams but keeps the parts, resume()
+        # restarts only the missing ranges, cancel() stops and cleans up
+        self.streaming = False  # Streams running (pause is only possible then)
+        self.paused = False
+        self.cancelled = False
+        self.resume_event = threading.Event()
+        self.stop_event = threading.Event()  # Set on pause/cancel, wakes retry back-offs
+        self.schedule_event = threading.Event()  # Wakes run_streams (a stream ended, limit changed...)
+        
+        # Stream limit (see set_stream_limit): chunks over it wait, parked
+        # chunks are being cut off to make room
+        self.stream_limit = None
+        self.parking = set()
+        self.limited = False
+        self.paused_at = None
+        self.paused_seconds = 0.0
         
     def get_filename_from_url(self):
         """Extract filename from URL or generate one."""
@@ -45,32 +151,66 @@ class MultiStreamDownloader:
         
         return filename
     
+    def get_filename_from_response(self, response):
+        """Get filename from Content-Disposition or fall back to the URL."""
+        content_disposition = response.headers.get('Content-Disposition', '')
+        if 'filename=' in content_disposition:
+            return content_disposition.split('filename=')[1].strip('"')
+        return self.get_filename_from_url()
+    
+    def get_total_from_content_range(self, response):
+        """
+        Read the total size from a Content-Range header.
+        Format: "bytes 0-0/12345" where 12345 is total size ("*" if unknown).
+        Returns 0 if the total is not available.
+        """
+        content_range = response.headers.get('Content-Range', '')
+        if '/' not in content_range:
+            return 0
+        total = content_range.split('/')[1].strip()
+        return int(total) if total.isdigit() else 0
+    
+    def http_client(self):
+        """
+        The download's shared HTTP/2 client, else a new HTTP/1.1 session using
+        the shared DNS cache (connection phases are traced when tracing is on).
+        """
+        if self.h2_client is not None:
+            return self.h2_client
+        return http_session()
+    
     def check_download_support(self):
         """
         Check if the server supports range requests (parallel downloads).
         Returns: (supports_ranges, file_size, filename)
+        
+        file_size is 0 when the server does not reveal the size; use
+        probe_file_size() to discover it for range-capable servers.
         """
+        probe_start = time.time()
+        probe_span = self.trace.span('probe', parent=self.trace.root)
+        http = self.http_client()
         try:
             # First try HEAD request
             try:
-                response = requests.head(
-                    self.url, 
-                    timeout=CONNECTION_TIMEOUT, 
-                    allow_redirects=True
-                )
+                with probe_span.child('head'):
+                    response = http.head(
+                        self.url, 
+                        timeout=CONNECTION_TIMEOUT, 
+                        allow_redirects=True
+                    )
                 
                 if response.status_code == 200:
                     supports_ranges = response.headers.get('Accept-Ranges') == 'bytes'
                     file_size = int(response.headers.get('Content-Length', 0))
+                    self.validators = response_validators(response)
                     
-                    # Get filename
-                    content_disposition = response.headers.get('Content-Disposition', '')
-                    if 'filename=' in content_disposition:
-                        filename = content_disposition.split('filename=')[1].strip('"')
-                    else:
-                        filename = self.get_filename_from_url()
+                    if supports_ranges and file_size > 0:
+                        return supports_ranges, file_size, self.get_filename_from_response(response)
                     
-                    return supports_ranges, file_size, filename
+                    # Chunked responses often omit Content-Length and Accept-Ranges
+                    # but still honor Range, so confirm with a range probe
+                    print("HEAD did not confirm size and range support, probing with GET...")
             except:
                 # HEAD failed, try GET with small range
                 print("HEAD request failed, trying GET with range...")
@@ -78,13 +218,14 @@ class MultiStreamDownloader:
             
             # Fallback: Use GET request with a small range to test support
             headers = {'Range': 'bytes=0-0'}
-            response = requests.get(
-                self.url,
-                headers=headers,
-                timeout=CONNECTION_TIMEOUT,
-                allow_redirects=True,
-                stream=True
-            )
+            with probe_span.child('range_probe'):
+                response = http.get(
+                    self.url,
+                    headers=headers,
+                    timeout=CONNECTION_TIMEOUT,
+                    allow_redirects=True,
+                    stream=True
+                )
             
             # Check if server supports ranges
             # Status 206 means partial content (ranges supported)
@@ -92,26 +233,217 @@ class MultiStreamDownloader:
             supports_ranges = response.status_code == 206
             
             # Get file size from Content-Range header or Content-Length
-            if 'Content-Range' in response.headers:
-                # Format: "bytes 0-0/12345" where 12345 is total size
-                content_range = response.headers['Content-Range']
-                file_size = int(content_range.split('/')[1])
+            if supports_ranges:
+                file_size = self.get_total_from_content_range(response)
             else:
                 file_size = int(response.headers.get('Content-Length', 0))
             
-            # Get filename
-            content_disposition = response.headers.get('Content-Disposition', '')
-            if 'filename=' in content_disposition:
-                filename = content_disposition.split('filename=')[1].strip('"')
-            else:
-                filename = self.get_filename_from_url()
+            filename = self.get_filename_from_response(response)
+            self.validators = response_validators(response)
             
             response.close()  # Close the connection
             
             return supports_ranges, file_size, filename
             
         except Exception as e:
+            probe_span.fail(e)
             raise Exception(f"Failed to check URL: {str(e)}")
+        finally:
+            probe_span.finish()
+            PROBE_DURATION.labels(host=self.host).observe(time.time() - probe_start)
+    
+    def probe_first_segment(self):
+        """
+        Capability probe that doubles as the first segment's request.
+        Returns: (supports_ranges, file_size, filename)
+        
+        Sends `Range: bytes=0-` on the connection stream 0 would use. A 206
+        confirms range support and its Content-Range gives the size; a 200
+        means ranges aren't supported and the body is the whole file. Either
+        way the body is the start of the file, so the response is kept open
+        in self.probe_response for stream 0 (or the single stream) to read.
+        The range is open-ended because stream 0's end isn't known until the
+        size is. Falls back to check_download_support() if the GET fails.
+        """
+        probe_start = time.time()
+        probe_span = self.trace.span('probe', parent=self.trace.root)
+        http = self.http_client()
+        response = None
+        self.probe_address = self.pick_address(0)
+        try:
+            with probe_span, probe_span.child('request', first_segment=True), \
+                    pinned(self.host, self.probe_address):
+                response = http.get(
+                    self.url,
+                    headers={'Range': 'bytes=0-'},
+                    timeout=(CONNECTION_TIMEOUT, READ_TIMEOUT),
+                    allow_redirects=True,
+                    stream=True
+                )
+        except Exception as e:
+            print(f"Ranged GET probe failed ({str(e)}), checking with HEAD...")
+        finally:
+            PROBE_DURATION.labels(host=self.host).observe(time.time() - probe_start)
+        
+        if response is None or response.status_code not in (200, 206):
+            if response is not None:
+                print(f"Ranged GET probe returned {response.status_code}, checking with HEAD...")
+                response.close()
+            if http is not self.h2_client:
+                http.close()
+            return self.check_download_support()
+        
+        supports_ranges = response.status_code == 206
+        if supports_ranges:
+            file_size = self.get_total_from_content_range(response)
+        else:
+            file_size = int(response.headers.get('Content-Length', 0))
+        probe_span.set(status_code=response.status_code, file_size=file_size)
+        self.validators = response_validators(response)
+        
+        self.probe_response = response
+        self.probe_http = http
+        return supports_ranges, file_size, self.get_filename_from_response(response)
+    
+    def take_probe_response(self):
+        """Hand over the probe's open response and its client (None, None if there is none)."""
+        response, http = self.probe_response, self.probe_http
+        self.probe_response = self.probe_http = None
+        return response, http
+    
+    def release_probe_response(self):
+        """Close the probe's response if no stream took it over."""
+        response, http = self.take_probe_response()
+        if response is not None:
+            response.close()
+        if http is not None and http is not self.h2_client:
+            http.close()
+    
+    def start_warmup(self):
+        """
+        Open (and TLS-handshake) a connection for each of streams 1..n-1 in
+        the background while the probe is in flight. Each stream later takes
+        its session with the connection already waiting in the pool.
+        HTTP/2 streams share the probe's connection, so there is nothing to warm.
+        With auto streams only as many as the host's profile favours are
+        warmed: hosts that penalize parallelism get few connections.
+        """
+        self.warm_sessions = {}
+        if not CONNECTION_WARMUP or self.h2_client is not None:
+            return
+        streams = host_profiles.warmup_streams(self.host) if self.auto_streams else self.num_streams
+        for chunk_id in range(1, streams):
+            session = http_session()
+            thread = threading.Thread(target=self.warm_connection, args=(chunk_id, session), daemon=True)
+            self.warm_sessions[chunk_id] = (thread, session)
+            thread.start()
+    
+    def warm_connection(self, chunk_id, session):
+        """Connect one pooled connection of `session` to this stream's address."""
+        try:
+            with self.trace.span('warmup', parent=self.trace.root, chunk_id=chunk_id), \
+                    pinned(self.host, self.pick_address(chunk_id)):
+                settings = session.merge_environment_settings(self.url, {}, None, None, None)
+                adapter = session.get_adapter(self.url)
+                if hasattr(adapter, 'get_connection_with_tls_context'):
+                    request = requests.Request('GET', self.url).prepare()
+                    pool = adapter.get_connection_with_tls_context(
+                        request, settings['verify'], settings['proxies'], settings['cert']
+                    )
+                else:
+                    # requests < 2.32.2
+                    pool = adapter.get_connection(self.url, settings['proxies'])
+                conn = pool._get_conn()
+                try:
+                    conn.timeout = CONNECTION_TIMEOUT
+                    conn.connect()
+                except Exception:
+                    conn.close()
+                    raise
+                finally:
+                    pool._put_conn(conn)  # Idle in the pool until the stream's first request
+        except Exception as e:
+            print(f"Chunk {chunk_id}: Connection warm-up failed: {str(e)}")
+    
+    def take_session(self, chunk_id):
+        """The stream's warmed-up session if there is one, else a new client."""
+        warm = self.warm_sessions.pop(chunk_id, None)
+        if warm is None:
+            return self.http_client()
+        thread, session = warm
+        thread.join()  # Finish the handshake rather than race it with a second connection
+        return session
+    
+    def close_warm_sessions(self):
+        """Close warmed-up sessions no stream used (e.g. the file got fewer streams)."""
+        warm, self.warm_sessions = self.warm_sessions, {}
+        for thread, session in warm.values():
+            session.close()
+    
+    def probe_file_size(self):
+        """
+        Find the size of a range-capable resource that doesn't advertise it.
+        
+        Requests single bytes at exponentially growing offsets until the server
+        answers 416 (Range Not Satisfiable), then binary searches for the last
+        byte. Any probe that reveals the total via Content-Range ends the search.
+        Returns the size in bytes, or 0 if it could not be determined.
+        """
+        session = http_session()
+        probe_span = self.trace.span('size_probe', parent=self.trace.root)
+        
+        def byte_exists(offset):
+            with probe_span.child('range_probe', offset=offset):
+                response = session.get(
+                    self.url,
+                    headers={'Range': f'bytes={offset}-{offset}'},
+                    timeout=(CONNECTION_TIMEOUT, READ_TIMEOUT),
+                    allow_redirects=True,
+                    stream=True
+                )
+            try:
+                if response.status_code == 206:
+                    return True, self.get_total_from_content_range(response)
+                if response.status_code == 416:
+                    return False, self.get_total_from_content_range(response)
+                raise Exception(f"Unexpected status {response.status_code} while probing")
+            finally:
+                response.close()
+        
+        probe_start = time.time()
+        try:
+            print("Probing file size with range requests...")
+            known, hi = 0, PROBE_INITIAL_OFFSET  # byte 0 is known to exist
+            while True:
+                exists, total = byte_exists(hi)
+                if total:
+                    return total
+                if not exists:
+                    break
+                known, hi = hi, hi * 2
+                if hi > PROBE_MAX_SIZE:
+                    print("Size probe exceeded PROBE_MAX_SIZE, giving up")
+                    return 0
+            
+            # Binary search: byte `known` exists, byte `hi` doesn't
+            while hi - known > 1:
+                mid = (known + hi) // 2
+                exists, total = byte_exists(mid)
+                if total:
+                    return total
+                if exists:
+                    known = mid
+                else:
+                    hi = mid
+            
+            return known + 1
+        except Exception as e:
+            print(f"Size probe failed: {str(e)}")
+            return 0
+        finally:
+            session.close()
+            probe_span.finish()
+            PROBE_DURATION.labels(host=self.host).observe(time.time() - probe_start)
     
     def calculate_chunks(self, file_size):
         """
@@ -135,7 +467,7 @@ class MultiStreamDownloader:
         
         return chunks
     
-    def download_chunk(self, chunk_id, start, end, temp_file):
+    def download_chunk(self, chunk_id, start, end, first_response=None, http=None, offset=0):
         """
         Download a specific chunk of the file with metrics tracking and retry logic.
         
@@ -143,82 +475,456 @@ class MultiStreamDownloader:
             chunk_id: ID of this chunk (for tracking)
             start: Starting byte position
             end: Ending byte position
-            temp_file: Path to temporary file for this chunk
+            first_response: Already-open response covering this chunk from
+                            `start` (the probe's); used for the first attempt
+            http: Client that opened first_response
+            offset: Bytes of the chunk already in its part (resuming after a pause)
         """
-        headers = {'Range': f'bytes={start}-{end}'}
+        expected_bytes = end - start + 1
+        
+        # Track start time for this chunk (a resumed chunk keeps its first start)
+        segments = self.segments
+        if not offset or not segments.started[chunk_id]:
+            segments.started[chunk_id] = time.time()
+        chunk_bytes_downloaded = offset
+        ACTIVE_STREAMS.inc()
         
-        # Track start time for this chunk
-        self.chunk_start_times[chunk_id] = time.time()
-        chunk_bytes_downloaded = 0
+        # Resolve metric children once; byte counts are flushed in batches
+        bytes_metric = DOWNLOADED_BYTES.labels(host=self.host, mode='multi')
+        ttfb_metric = TIME_TO_FIRST_BYTE.labels(host=self.host)
+        pending_metric_bytes = 0
+        rate = self.stream_rates[chunk_id] = ThroughputRing()
         
-        max_retries = MAX_RETRIES
-        retry_count = 0
+        trace = self.trace
+        if http is None:
+            http = self.take_session(chunk_id)
+        segment_span = trace.span('segment', parent=trace.root, chunk_id=chunk_id,
+                                  range=f'{start + offset}-{end}', resumed=bool(offset))
+        first_byte_time = None
         
-        while retry_count < max_retries:
+        while not self.stopping(chunk_id):
+            # Hold off while the host's circuit is open (see retry_policy.py)
+            wait = circuit_breaker.wait_time(self.host) if first_response is None else 0
+            if wait and self.stop_event.wait(wait):
+                continue  # Cut short by pause/cancel; the loop condition ends it
+            attempt_start = time.time()
+            # The sink may keep what a failed attempt received (see sinks.py)
+            offset = self.sink.restart_offset(chunk_id, offset)
+            headers = {'Range': f'bytes={start + offset}-{end}'}
+            chunk_bytes_downloaded = offset
+            segments.positions[chunk_id] = offset
+            response = None
+            attempt_span = trace.span('attempt', parent=segment_span, attempt=segments.retries[chunk_id] + 1)
             try:
-                response = requests.get(
-                    self.url, 
-                    headers=headers, 
-                    stream=True,
-                    timeout=(CONNECTION_TIMEOUT, READ_TIMEOUT),
-                    allow_redirects=True
-                )
-                
-                # Check if request was successful (206 for partial content, 200 for full)
-                if response.status_code not in [200, 206]:
-                    print(f"Chunk {chunk_id}: Bad status code {response.status_code}")
-                    retry_count += 1
-                    if retry_count < max_retries:
-                        time.sleep(RETRY_DELAY)
-                    continue
+                if first_response is not None:
+                    # The probe's response is already streaming this range
+                    response, first_response = first_response, None
+                    attempt_span.set(address=segments.addresses[chunk_id], probe=True)
+                else:
+                    # Spread streams over the host's addresses; re-picked on every
+                    # attempt so a retry moves away from an address that went bad
+                    address = self.pick_address(chunk_id)
+                    attempt_span.set(address=address)
+                    with attempt_span.child('request'), pinned(self.host, address):
+                        response = http.get(
+                            self.url, 
+                            headers=headers, 
+                            stream=True,
+                            timeout=(CONNECTION_TIMEOUT, READ_TIMEOUT),
+                            allow_redirects=True
+                        )
+                headers_time = time.time()
+                attempt_span.set(status_code=response.status_code)
+                self.chunk_responses[chunk_id] = response
+                if self.stopping(chunk_id):
+                    # Paused, parked or cancelled while the request was in flight
+                    self.stop_chunk(chunk_id, chunk_bytes_downloaded, attempt_span)
+                    break
                 
-                # Reset counter for this attempt
-                chunk_bytes_downloaded = 0
+                # 206, or 200 from the first byte of the file; anything else raises
+                check_response(response, start + offset)
                 
-                with open(temp_file, 'wb') as f:
+                with self.sink.open(chunk_id, offset) as f:
                     for data in response.iter_content(chunk_size=BUFFER_SIZE):
-                        if not self.is_downloading:
-                            print(f"Chunk {chunk_id}: Download cancelled")
+                        if self.stopping(chunk_id):
                             break
                         
                         if data:  # Filter out keep-alive chunks
+                            if chunk_bytes_downloaded + len(data) > expected_bytes:
+                                # Open-ended probe response: stop at this part's end
+                                data = data[:expected_bytes - chunk_bytes_downloaded]
                             f.write(data)
+                            if chunk_bytes_downloaded == offset:
+                                first_byte_time = time.time()
+                                ttfb_metric.observe(first_byte_time - attempt_start)
+                                trace.record('first_byte', headers_time, first_byte_time, parent=attempt_span)
                             chunk_bytes_downloaded += len(data)
+                            rate.add(len(data))
+                            pending_metric_bytes += len(data)
+                            if pending_metric_bytes >= METRICS_FLUSH_BYTES:
+                                bytes_metric.inc(pending_metric_bytes)
+                                pending_metric_bytes = 0
                             
                             # Update progress
                             with self.lock:
+                                if self.first_byte_time is None:
+                                    self.first_byte_time = time.time()
                                 self.downloaded_bytes += len(data)
+                                segments.positions[chunk_id] = chunk_bytes_downloaded
+                                self.total_rate.add(len(data))
                                 if self.progress_callback:
                                     self.progress_callback(self.downloaded_bytes, self.file_size)
+                            
+                            # Stop once a finished hedge already holds the rest of this part
+                            if self.hedge_covers(chunk_id, chunk_bytes_downloaded):
+                                break
+                            if chunk_bytes_downloaded >= expected_bytes:
+                                break
                 
-                # Track end time and calculate speed for this chunk
-                self.chunk_end_times[chunk_id] = time.time()
-                elapsed = self.chunk_end_times[chunk_id] - self.chunk_start_times[chunk_id]
-                self.chunk_bytes[chunk_id] = chunk_bytes_downloaded
-                self.chunk_speeds[chunk_id] = (chunk_bytes_downloaded / (1024 * 1024)) / elapsed if elapsed > 0 else 0
-                
-                print(f"Chunk {chunk_id}: Downloaded {chunk_bytes_downloaded / (1024*1024):.2f} MB in {elapsed:.2f}s")
+                if self.stopping(chunk_id):
+                    self.stop_chunk(chunk_id, chunk_bytes_downloaded, attempt_span)
+                    break
+                if chunk_bytes_downloaded < expected_bytes and not self.hedge_covers(chunk_id, chunk_bytes_downloaded):
+                    raise requests.exceptions.ChunkedEncodingError(
+                        f"Response ended after {chunk_bytes_downloaded:,} of {expected_bytes:,} bytes")
+                self.finish_chunk(chunk_id, chunk_bytes_downloaded, first_byte_time, attempt_span)
                 break  # Success, exit retry loop
                 
-            except requests.exceptions.Timeout:
-                retry_count += 1
-                print(f"Chunk {chunk_id}: Timeout (attempt {retry_count}/{max_retries})")
-                if retry_count < max_retries:
-                    time.sleep(RETRY_DELAY)
-                else:
-                    print(f"Chunk {chunk_id}: Failed after {max_retries} attempts")
-                    self.chunk_end_times[chunk_id] = time.time()
-                    self.chunk_bytes[chunk_id] = chunk_bytes_downloaded
-                    
             except Exception as e:
-                retry_count += 1
-                print(f"Chunk {chunk_id}: Error (attempt {retry_count}/{max_retries}): {str(e)}")
-                if retry_count < max_retries:
-                    time.sleep(RETRY_DELAY)
-                else:
-                    print(f"Chunk {chunk_id}: Failed after {max_retries} attempts")
-                    self.chunk_end_times[chunk_id] = time.time()
-                    self.chunk_bytes[chunk_id] = chunk_bytes_downloaded
+                if self.hedge_covers(chunk_id, chunk_bytes_downloaded):
+                    # The hedge won and cut this stream off
+                    self.finish_chunk(chunk_id, chunk_bytes_downloaded, first_byte_time, attempt_span)
+                    break
+                if self.stopping(chunk_id):
+                    # Cut off by pause(), parking or cancel(), not a failure
+                    self.stop_chunk(chunk_id, chunk_bytes_downloaded, attempt_span)
+                    break
+                attempt_span.fail(e)
+                attempt_bytes = max(0, chunk_bytes_downloaded - self.sink.restart_offset(chunk_id, offset))
+                self.record_failed_attempt(chunk_id, attempt_bytes,
+                                           failure_cause(e, getattr(e, 'status_code', None)))
+                delay = self.retry_delay(chunk_id, e, attempt_bytes)
+                if delay is not None and not self.shed_stream(chunk_id):
+                    self.stop_event.wait(delay)  # Cut short by pause/cancel
+                self.recovery_seconds += time.time() - attempt_start
+            
+            finally:
+                attempt_span.finish()
+                if response is not None:
+                    response.close()
+                if pending_metric_bytes:
+                    bytes_metric.inc(pending_metric_bytes)
+                    pending_metric_bytes = 0
+        
+        if first_response is not None:
+            first_response.close()  # Stopped before the first attempt
+        segment_span.set(bytes=segments.bytes[chunk_id] or chunk_bytes_downloaded,
+                         retries=segments.retries[chunk_id])
+        segment_span.finish()
+        self.chunk_responses.pop(chunk_id, None)
+        if http is not self.h2_client:
+            http.close()
+        ACTIVE_STREAMS.dec()
+        QUEUE_DEPTH.labels(queue='segments').dec()
+    
+    def pick_address(self, chunk_id, exclude=None):
+        """Address for a stream's next connection (None = let the connection resolve)."""
+        if not DNS_SPREAD_STREAMS or self.h2_client is not None:
+            return None
+        try:
+            address = dns_cache.pick(self.host, chunk_id, exclude=exclude)
+        except OSError:
+            return None  # Resolution failed; the request will report it
+        if exclude is None and chunk_id < len(self.segments):
+            self.segments.addresses[chunk_id] = address
+        return address
+    
+    def finish_chunk(self, chunk_id, chunk_bytes_downloaded, first_byte_time, attempt_span):
+        """Record a finished chunk (settling any hedge raced against it)."""
+        chunk_bytes_downloaded = self.settle_hedge(chunk_id, chunk_bytes_downloaded)
+        
+        # Track end time and calculate speed for this chunk
+        segments = self.segments
+        now = time.time()
+        if chunk_bytes_downloaded and first_byte_time:
+            self.trace.record('transfer', first_byte_time, now, parent=attempt_span, bytes=chunk_bytes_downloaded)
+        speed = segments.finish(chunk_id, chunk_bytes_downloaded, now)
+        elapsed = now - segments.started[chunk_id]
+        SEGMENT_DURATION.labels(host=self.host).observe(elapsed)
+        if speed > 0:
+            dns_cache.report_success(self.host, segments.addresses[chunk_id], speed)
+        
+        print(f"Chunk {chunk_id}: Downloaded {chunk_bytes_downloaded / (1024*1024):.2f} MB in {elapsed:.2f}s")
+    
+    def stopping(self, chunk_id):
+        """True once this chunk's stream should stop: paused, cancelled or parked."""
+        return not self.is_downloading or chunk_id in self.parking
+    
+    def stop_chunk(self, chunk_id, chunk_bytes_downloaded, attempt_span):
+        """Record a stream cut off by pause(), cancel() or parking; its bytes so far stay in the part."""
+        attempt_span.set(stopped=True, bytes=chunk_bytes_downloaded)
+        if self.cancelled or self.failure:
+            state = 'cancelled' if self.cancelled else 'stopped'
+        else:
+            state = 'paused' if not self.is_downloading else 'parked'
+        print(f"Chunk {chunk_id}: Download {state} at {chunk_bytes_downloaded / (1024*1024):.2f} MB")
+    
+    # ---- Hedged tails ----------------------------------------------------------
+    # When one stream is projected to finish far behind the others, the tail of
+    # its range is requested again on a fresh connection. Both requests write the
+    # same bytes at the same offsets of the part file, so whichever finishes the
+    # tail first wins and the other is cut off. Bytes fetched twice are charged
+    # to a per-download duplicate budget.
+    
+    def hedge_covers(self, chunk_id, chunk_bytes_downloaded):
+        """True if a hedge has won and the primary stream has reached its split point."""
+        hedge = self.hedges.get(chunk_id)
+        return hedge is not None and hedge['state'] == 'won' and chunk_bytes_downloaded >= hedge['split']
+    
+    def settle_hedge(self, chunk_id, chunk_bytes_downloaded):
+        """
+        Resolve the race between a chunk's primary stream and its hedge.
+        Returns the number of bytes the part now holds.
+        """
+        hedge = self.hedges.get(chunk_id)
+        if hedge is None:
+            return chunk_bytes_downloaded
+        
+        with self.lock:
+            if hedge['state'] == 'running':
+                hedge['state'] = 'lost'  # The primary stream finished first
+            if hedge['state'] != 'won':
+                loser = hedge.get('response')
+                won = False
+            else:
+                loser = None
+                won = True
+                # Bytes past the split arrived twice; the hedge supplied the tail
+                duplicate = max(0, chunk_bytes_downloaded - hedge['split'])
+                chunk_size = hedge['size']
+                self.downloaded_bytes += chunk_size - chunk_bytes_downloaded
+                self.duplicate_bytes += duplicate
+                if self.progress_callback:
+                    self.progress_callback(self.downloaded_bytes, self.file_size)
+        
+        if won:
+            DUPLICATE_BYTES.labels(host=self.host).inc(duplicate)
+            print(f"Chunk {chunk_id}: Tail delivered by hedge ({duplicate / (1024*1024):.2f} MB duplicated)")
+            return chunk_size
+        if loser is not None:
+            abort_response(loser)
+        return chunk_bytes_downloaded
+    
+    def maybe_hedge(self):
+        """Launch a hedge for any stream projected to finish far later than the rest."""
+        now = time.time()
+        segments = self.segments
+        projected = {}
+        for chunk_id in range(len(segments)):
+            if segments.ended(chunk_id):
+                projected[chunk_id] = 0.0
+                continue
+            if chunk_id not in self.stream_threads or chunk_id in self.parking:
+                continue  # Waiting for a stream slot, not straggling
+            ring = self.stream_rates.get(chunk_id)
+            if ring is None:
+                continue
+            remaining = segments.remaining(chunk_id)
+            speed = ring.ewma_speed()
+            projected[chunk_id] = remaining / speed if speed > 0 else float('inf')
+        
+        if len(projected) < 2:
+            return
+        
+        for chunk_id, eta in projected.items():
+            if eta == 0 or chunk_id in self.hedges:
+                continue
+            if now - (segments.started[chunk_id] or now) < HEDGE_MIN_SECONDS:
+                continue
+            others = sorted(v for k, v in projected.items() if k != chunk_id)
+            typical = others[len(others) // 2]
+            if eta < HEDGE_MIN_SECONDS or eta < HEDGE_SLOWDOWN * typical:
+                continue
+            
+            # Split a little ahead of the primary stream: roughly what it will
+            # receive while the hedge is still waiting for its first byte
+            start, end = segments[chunk_id]
+            chunk_size = end - start + 1
+            ttfb = self.first_byte_time - self.start_time if self.first_byte_time else 0
+            lead = int(self.stream_rates[chunk_id].ewma_speed() * ttfb)
+            split = min(chunk_size, segments.positions[chunk_id] + lead)
+            length = chunk_size - split
+            if length < HEDGE_MIN_BYTES:
+                continue
+            
+            with self.lock:
+                if self.duplicate_bytes + self.hedge_reserved + length > self.duplicate_budget:
+                    continue
+                self.hedge_reserved += length
+                self.hedges[chunk_id] = {
+                    'state': 'running',
+                    'split': split,
+                    'length': length,
+                    'size': chunk_size,
+                    'bytes': 0,
+                    'response': None
+                }
+            
+            eta_text = 'stalled' if eta == float('inf') else f"{eta:.1f}s left"
+            print(f"Chunk {chunk_id}: straggling ({eta_text}), hedging last "
+                  f"{length / (1024*1024):.2f} MB on a new connection")
+            thread = threading.Thread(
+                target=self.download_hedge,
+                args=(chunk_id, start + split, end, self.temp_files[chunk_id]),
+                daemon=True
+            )
+            thread.start()
+            self.hedge_threads.append(thread)
+    
+    def download_hedge(self, chunk_id, start, end, temp_file):
+        """Fetch the tail [start, end] of a straggling chunk into the same part file."""
+        hedge = self.hedges[chunk_id]
+        chunk_start = self.segments.starts[chunk_id]
+        # A different address than the straggler when the host has several
+        address = self.pick_address(chunk_id, exclude=self.segments.addresses[chunk_id])
+        span = self.trace.span('hedge', parent=self.trace.root, chunk_id=chunk_id,
+                               range=f'{start}-{end}', address=address)
+        session = http_session()
+        won = False
+        try:
+            with span, pinned(self.host, address), self.write_queue.open(temp_file, 'r+b') as f:
+                if self.fetch_hedge_range(session, hedge, start, end, f, chunk_start):
+                    with self.lock:
+                        if hedge['state'] == 'running':
+                            hedge['state'] = 'won'
+                            won = True
+                
+                # A stalled primary may never reach the split; fetch the gap
+                # between it and the split as well so the part is complete
+                position = self.segments.positions[chunk_id]
+                if won and position < hedge['split']:
+                    gap_start = chunk_start + position
+                    if self.fetch_hedge_range(session, hedge, gap_start, start - 1, f, chunk_start):
+                        with self.lock:
+                            hedge['split'] = min(hedge['split'], position)
+                span.set(bytes=hedge['bytes'], result=hedge['state'])
+        except Exception as e:
+            if hedge['state'] == 'lost' or not self.is_downloading:
+                pass  # Cut off because the primary stream finished first, or by pause/cancel
+            else:
+                print(f"Chunk {chunk_id}: Hedge failed: {str(e)}")
+                with self.lock:
+                    if hedge['state'] == 'running':
+                        hedge['state'] = 'failed'
+        finally:
+            session.close()
+            with self.lock:
+                if hedge['state'] == 'running' and not self.is_downloading:
+                    hedge['state'] = 'stopped'  # Relaunched if needed after a resume
+                self.hedge_reserved -= hedge['length']
+                if not won:
+                    self.duplicate_bytes += hedge['bytes']
+            if not won:
+                DUPLICATE_BYTES.labels(host=self.host).inc(hedge['bytes'])
+            HEDGES.labels(host=self.host, result=hedge['state']).inc()
+        
+        if won:
+            print(f"Chunk {chunk_id}: Hedge finished the tail first")
+            # The primary stream's remaining bytes are now redundant; cut it off
+            # if it is already past the split (otherwise it stops on reaching it)
+            primary = self.chunk_responses.get(chunk_id)
+            if primary is not None and self.segments.positions[chunk_id] >= hedge['split']:
+                abort_response(primary)
+    
+    def fetch_hedge_range(self, session, hedge, start, end, f, chunk_start):
+        """Write bytes [start, end] into the open part file. True if all of them arrived."""
+        response = session.get(
+            self.url,
+            headers={'Range': f'bytes={start}-{end}'},
+            stream=True,
+            timeout=(CONNECTION_TIMEOUT, READ_TIMEOUT),
+            allow_redirects=True
+        )
+        hedge['response'] = response
+        if response.status_code != 206:
+            raise Exception(f"Hedge got status {response.status_code}")
+        
+        f.seek(start - chunk_start)
+        received = 0
+        for data in response.iter_content(chunk_size=BUFFER_SIZE):
+            if hedge['state'] not in ('running', 'won') or not self.is_downloading:
+                break
+            if data:
+                f.write(data)
+                received += len(data)
+                hedge['bytes'] += len(data)
+        return received >= end - start + 1
+    
+    def record_failed_attempt(self, chunk_id, attempt_bytes, cause='other'):
+        """
+        Account for a failed chunk attempt.
+        The next attempt restarts from the sink's restart_offset (where the
+        download_chunk call began, or right after what an upload sink already
+        holds), so bytes received in the failed attempt will be fetched again
+        and are taken back out of the progress.
+        """
+        RETRIES.labels(host=self.host).inc()
+        FAILURES.labels(host=self.host, cause=cause).inc()
+        dns_cache.report_failure(self.host, self.segments.addresses[chunk_id])
+        with self.lock:
+            self.retry_count += 1
+            self.segments.retries[chunk_id] += 1
+            self.refetched_bytes += attempt_bytes
+            self.downloaded_bytes -= attempt_bytes
+    
+    def retry_delay(self, chunk_id, error, attempt_bytes):
+        """
+        Seconds to wait before a chunk's next attempt after `error` (see
+        retry_policy.py), or None once it isn't worth retrying: then the whole
+        download fails rather than assembling a file with a hole in it.
+        """
+        with self.lock:
+            # An attempt that got somewhere starts the count again
+            failures = 1 if attempt_bytes > 0 else self.segments.failures[chunk_id] + 1
+            self.segments.failures[chunk_id] = failures
+            running = sum(1 for i in self.stream_threads if i not in self.parking)
+        if not is_fatal(error):
+            circuit_breaker.report_failure(self.host, running)
+        delay, reason = retry_policy.next_delay(error, failures)
+        if delay is None:
+            print(f"Chunk {chunk_id}: {str(error)} - giving up ({reason})")
+            self.fail_download(f"Chunk {chunk_id}: {str(error)} ({reason})")
+            return None
+        delay = max(delay, circuit_breaker.wait_time(self.host))
+        print(f"Chunk {chunk_id}: {str(error)} (attempt {failures}/{retry_policy.max_attempts}), "
+              f"retrying in {delay:.1f}s")
+        return delay
+    
+    def shed_stream(self, chunk_id):
+        """
+        Park this chunk's stream if its host's circuit breaker now allows fewer
+        streams than are running. The range waits for a free slot in run_streams.
+        """
+        cap = circuit_breaker.stream_cap(self.host)
+        if cap is None:
+            return False
+        with self.lock:
+            running = [i for i in self.stream_threads if i not in self.parking]
+            if len(running) <= cap:
+                return False
+            self.parking.add(chunk_id)
+        print(f"Chunk {chunk_id}: Shedding stream, {self.host} is capped at {cap} streams")
+        return True
+    
+    def fail_download(self, reason):
+        """Stop every stream because one chunk can't be completed."""
+        with self.lock:
+            if self.failure is None:
+                self.failure = reason
+            self.is_downloading = False
+            self.stop_event.set()
+        self.interrupt_streams()
+        self.schedule_event.set()
     
     def assemble_file(self, output_file):
         """Combine all temporary chunk files into the final file."""
@@ -231,7 +937,7 @@ class MultiStreamDownloader:
                     print(f"  Adding part {i}: {file_size / (1024*1024):.2f} MB")
                     
                     with open(temp_file, 'rb') as infile:
-                        outfile.write(infile.read())
+                        shutil.copyfileobj(infile, outfile, WRITE_BLOCK_SIZE)
                     
                     # Delete temp file after combining
                     try:
@@ -240,6 +946,9 @@ class MultiStreamDownloader:
                         pass
                 else:
                     print(f"  WARNING: Part {i} not found at {temp_file}")
+            
+            if WRITE_FSYNC != 'none':
+                sync_file(outfile)
         
         final_size = os.path.getsize(output_file)
         print(f"Final file assembled: {final_size / (1024*1024):.2f} MB")
@@ -252,27 +961,21 @@ class MultiStreamDownloader:
         if not self.start_time:
             return None
         
-        end_time = max(self.chunk_end_times.values()) if self.chunk_end_times else time.time()
-        total_time = end_time - self.start_time
+        # An upload ends after the last segment has arrived
+        end_time = max(self.segments.last_finish(), self.sink.finished_at) or time.time()
+        total_time = end_time - self.start_time - self.paused_seconds
         
         # Calculate overall throughput
         throughput_mbps = (self.file_size * 8) / (total_time * 1024 * 1024) if total_time > 0 else 0
         throughput_MBps = self.file_size / (total_time * 1024 * 1024) if total_time > 0 else 0
         
         # Calculate per-chunk metrics
-        chunk_metrics = []
-        for chunk_id in range(len(self.chunks)):
-            if chunk_id in self.chunk_start_times and chunk_id in self.chunk_end_times:
-                chunk_time = self.chunk_end_times[chunk_id] - self.chunk_start_times[chunk_id]
-                chunk_size = self.chunk_bytes.get(chunk_id, 0)
-                chunk_speed = self.chunk_speeds.get(chunk_id, 0)
-                
-                chunk_metrics.append({
-                    'chunk_id': chunk_id,
-                    'size_mb': chunk_size / (1024 * 1024),
-                    'time_seconds': chunk_time,
-                    'speed_mbps': chunk_speed
-                })
+        chunk_metrics = self.segments.snapshot()
+        
+        time_to_first_byte = self.first_byte_time - self.start_time if self.first_byte_time else None
+        # From the start of the probe, so probe and connection set-up are included
+        startup_seconds = self.first_byte_time - self.probe_start if self.first_byte_time and self.probe_start else None
+        rates = self.get_rate_metrics()
         
         # Find fastest and slowest chunks
         if chunk_metrics:
@@ -284,15 +987,59 @@ class MultiStreamDownloader:
         return {
             'total_time_seconds': total_time,
             'total_size_mb': self.file_size / (1024 * 1024),
+            'time_to_first_byte': time_to_first_byte,
+            'startup_seconds': startup_seconds,
             'throughput_mbps': throughput_mbps,
             'throughput_MBps': throughput_MBps,
             'num_streams_used': self.num_streams,
+            'stream_choice': self.stream_choice,
             'average_speed_per_stream': throughput_MBps / self.num_streams if self.num_streams > 0 else 0,
             'chunk_metrics': chunk_metrics,
             'fastest_chunk': fastest_chunk,
-            'slowest_chunk': slowest_chunk
+            'slowest_chunk': slowest_chunk,
+            'retries': self.retry_count,
+            'refetched_mb': self.refetched_bytes / (1024 * 1024),
+            'recovery_seconds': self.recovery_seconds,
+            'repair_passes': self.repair_passes,
+            'repaired_ranges': self.repaired_ranges,
+            'repaired_mb': self.repaired_bytes / (1024 * 1024),
+            'paused_seconds': self.paused_seconds,
+            'stream_limit': self.stream_limit,
+            'transport': self.transport,
+            'http_version': ', '.join(sorted(self.h2_client.versions)) if self.h2_client else 'HTTP/1.1',
+            'addresses': sorted({a for a in self.segments.addresses if a}),
+            'hedges_launched': len(self.hedges),
+            'hedges_won': sum(1 for hedge in self.hedges.values() if hedge['state'] == 'won'),
+            'duplicate_mb': self.duplicate_bytes / (1024 * 1024),
+            'duplicate_budget_mb': self.duplicate_budget / (1024 * 1024),
+            'write_back': self.write_queue.get_stats() if self.write_queue else None,
+            'sink': self.sink.get_stats(),
+            'instant_speed': rates['instant_speed'],
+            'ewma_speed': rates['ewma_speed'],
+            'eta_seconds': rates['eta_seconds'],
+            'throughput_series': rates['series'],
+            'stream_throughput': rates['streams']
         }
     
+    def get_rate_metrics(self, include_series=True, running_only=False):
+        """
+        Live speeds from the throughput rings (MB/s): instantaneous, EWMA,
+        lifetime average and ETA for the download, plus the same per stream
+        (only the running ones with `running_only`, for frequent polls).
+        """
+        remaining = max(0, self.file_size - self.downloaded_bytes) if self.file_size else None
+        rates = self.total_rate.snapshot(remaining, include_series)
+        streams = []
+        for chunk_id, ring in sorted(self.stream_rates.items()):
+            if running_only and chunk_id not in self.stream_threads:
+                continue
+            stream = ring.snapshot(include_series=include_series)
+            stream['chunk_id'] = chunk_id
+            streams.append(stream)
+        rates['streams'] = streams
+        rates.setdefault('eta_seconds', None)
+        return rates
+    
     def print_metrics_report(self):
         """Print a detailed metrics report to console."""
         metrics = self.get_detailed_metrics()
@@ -305,10 +1052,36 @@ class MultiStreamDownloader:
         print(f"Total Download Time: {metrics['total_time_seconds']:.2f} seconds")
         print(f"File Size: {metrics['total_size_mb']:.2f} MB")
         print(f"Number of Streams: {metrics['num_streams_used']}")
+        if metrics['startup_seconds'] is not None:
+            print(f"Startup (probe to first byte): {metrics['startup_seconds']:.2f} seconds")
+        if self.transport == 'http2':
+            print(f"Transport: {metrics['http_version']} "
+                  f"(multiplexed over up to {H2_MAX_CONNECTIONS} connection(s))")
         print(f"\nOverall Throughput:")
         print(f"  - {metrics['throughput_mbps']:.2f} Mbps")
         print(f"  - {metrics['throughput_MBps']:.2f} MB/s")
         print(f"  - Average per stream: {metrics['average_speed_per_stream']:.2f} MB/s")
+        if metrics['retries']:
+            print(f"\nRecovery: {metrics['retries']} retries, "
+                  f"{metrics['refetched_mb']:.2f} MB re-fetched, "
+                  f"{metrics['recovery_seconds']:.2f}s lost")
+        if metrics['repair_passes']:
+            print(f"\nRepair: {metrics['repaired_ranges']} damaged ranges, "
+                  f"{metrics['repaired_mb']:.2f} MB re-fetched in {metrics['repair_passes']} passes")
+        if len(metrics['addresses']) > 1:
+            print(f"Addresses: {', '.join(metrics['addresses'])}")
+        if metrics['write_back'] and metrics['write_back']['stall_seconds'] >= 0.1:
+            print(f"Disk: streams waited {metrics['write_back']['stall_seconds']:.2f}s on a full write queue "
+                  f"(peak {metrics['write_back']['peak_queue_mb']:.1f} MB)")
+        if metrics['sink']:
+            print(f"Upload: {metrics['sink']['parts_uploaded']} parts, {metrics['sink']['uploaded_mb']:.2f} MB "
+                  f"to {metrics['sink']['location']}"
+                  + (f", streams waited {metrics['sink']['stall_seconds']:.2f}s on a full upload queue"
+                     if metrics['sink']['stall_seconds'] >= 0.1 else ''))
+        if metrics['hedges_launched']:
+            print(f"Hedged tails: {metrics['hedges_launched']} launched, {metrics['hedges_won']} won, "
+                  f"{metrics['duplicate_mb']:.2f} MB duplicated "
+                  f"(budget {metrics['duplicate_budget_mb']:.2f} MB)")
         
         if metrics['chunk_metrics']:
             print(f"\nPer-Stream Performance:")
@@ -328,7 +1101,10 @@ class MultiStreamDownloader:
         print("="*60 + "\n")
     
     def export_metrics_to_file(self, filename="download_metrics.txt"):
-        """Export metrics to a text file for analysis."""
+        """
+        Export metrics to a text report for manual analysis.
+        Runs are recorded in the history store automatically; this is opt-in.
+        """
         metrics = self.get_detailed_metrics()
         if not metrics:
             return
@@ -369,87 +1145,199 @@ class MultiStreamDownloader:
         Returns:
             Path to downloaded file on success, None on failure
         """
+        ACTIVE_DOWNLOADS.labels(mode='multi').inc()
+        self.trace = start_trace('download', enabled=self.trace_enabled, url=self.url, mode='multi')
+        result = None
         try:
-            # Step 1: Check if download is possible
+            if self.transport == 'http2':
+                self.h2_client = HTTP2Client(self.url)
+            result = self._download(output_path)
+            return result
+        except RuntimeError as e:
+            print(f"\nDownload failed: {str(e)}")
+            return None
+        finally:
+            self.release_probe_response()
+            self.close_warm_sessions()
+            self.sink.close()
+            if self.write_queue is not None and not self.write_queue.closed:
+                try:
+                    self.write_queue.close()
+                except IOError:
+                    pass  # Already reported by the stream that hit it
+            if self.h2_client is not None:
+                self.h2_client.close()
+            ACTIVE_DOWNLOADS.labels(mode='multi').dec()
+            outcome = 'completed' if result else ('cancelled' if self.cancelled else 'failed')
+            DOWNLOADS.labels(host=self.host, mode='multi', result=outcome).inc()
+            self.trace.finish(result=outcome, num_streams=self.num_streams, file_size=self.file_size)
+            self.record_run(outcome)
+    
+    def record_run(self, outcome):
+        """Append this run's metrics to the run-history store."""
+        try:
+            metrics = self.get_detailed_metrics() or {}
+            segments = [
+                {
+                    'chunk_id': chunk['chunk_id'],
+                    'bytes': self.segments.bytes[chunk['chunk_id']],
+                    'seconds': chunk['time_seconds'],
+                    'speed_MBps': chunk['speed_mbps'],
+                    'retries': chunk['retries']
+                }
+                for chunk in metrics.get('chunk_metrics', [])
+            ]
+            completed = outcome == 'completed'
+            metrics_store.record_run({
+                'url': self.url,
+                'host': self.host,
+                'mode': 'multi',
+                'result': outcome,
+                'num_streams': self.num_streams,
+                'file_size': self.file_size,
+                'total_seconds': metrics.get('total_time_seconds'),
+                'throughput_MBps': metrics.get('throughput_MBps') if completed else None,
+                'ttfb_seconds': metrics.get('time_to_first_byte'),
+                'retries': self.retry_count,
+                'refetched_bytes': self.refetched_bytes,
+                'recovery_seconds': self.recovery_seconds,
+                'transport': self.transport,
+                'segments': segments
+            })
+            
+            # Profiles describe connection-per-stream behaviour only (and not
+            # runs the stream scheduler or an upload held back)
+            if (completed and self.supports_ranges and self.num_streams > 0 and self.transport == 'http1'
+                    and not self.limited and self.sink.local):
+                host_profiles.record(
+                    self.host,
+                    self.num_streams,
+                    self.file_size / self.num_streams,
+                    metrics.get('throughput_MBps')
+                )
+        except Exception as e:
+            print(f"Failed to record run metrics: {str(e)}")
+    
+    def _download(self, output_path):
+        """Run the probe, chunked download and assembly steps for download()."""
+        try:
+            # Step 1: Check if download is possible (other streams connect meanwhile)
             print("Checking server support...")
-            supports_ranges, file_size, filename = self.check_download_support()
+            self.probe_start = time.time()
+            self.start_warmup()
+            if PROBE_WITH_FIRST_SEGMENT:
+                supports_ranges, file_size, filename = self.probe_first_segment()
+            else:
+                supports_ranges, file_size, filename = self.check_download_support()
             self.file_size = file_size
+            self.supports_ranges = supports_ranges
+            self.filename = filename
             
             print(f"File: {filename}")
             print(f"File size: {file_size / (1024*1024):.2f} MB")
             print(f"Supports range requests: {supports_ranges}")
             
-            if file_size == 0:
-                raise Exception("File size is 0 or Content-Length header unavailable")
-            
-            if not supports_ranges:
-                print("WARNING: Server doesn't support range requests. Using single stream.")
-                self.num_streams = 1
+            if file_size == 0 and supports_ranges:
+                # Chunked response that still honors Range - find the size ourselves
+                self.release_probe_response()
+                file_size = self.probe_file_size()
+                self.file_size = file_size
+                print(f"Probed file size: {file_size / (1024*1024):.2f} MB")
             
             # Step 2: Setup output path
             if output_path is None:
                 output_path = os.path.join(DOWNLOAD_FOLDER, filename)
             
-            print(f"Output path: {output_path}")
+            if file_size == 0:
+                if not self.sink.local:
+                    self.failure = f"File size unknown; can't upload to {self.sink.location} in parts"
+                    print(f"\nDownload failed: {self.failure}")
+                    return None
+                os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+                print(f"Output path: {output_path}")
+                print("WARNING: File size unknown. Streaming on a single connection.")
+                return self.download_unsized(output_path)
+            
+            if not supports_ranges:
+                print("WARNING: Server doesn't support range requests. Using single stream.")
+                self.num_streams = 1
+            elif self.auto_streams:
+                # Start from what has worked best for this host before
+                self.num_streams, self.stream_choice = host_profiles.recommend(self.host, file_size)
+                print(f"Stream count for {self.host}: {self.num_streams} ({self.stream_choice})")
             
-            # Step 3: Calculate chunks
-            self.chunks = self.calculate_chunks(file_size)
+            # Step 3: Calculate chunks (the sink may move their boundaries, and
+            # names the parts or starts the upload they go to)
+            self.segments = SegmentTable(self.sink.begin(output_path, self.calculate_chunks(file_size)))
+            self.segments.addresses[0] = self.probe_address  # Stream 0 reads on (or re-picks if the probe fell back)
+            self.num_streams = len(self.segments)
+            print(f"Output: {self.sink.location}")
             print(f"\nStarting download with {self.num_streams} streams")
             print(f"Chunk breakdown:")
             
-            for i, (start, end) in enumerate(self.chunks):
+            for i, (start, end) in enumerate(self.segments):
                 chunk_size = end - start + 1
                 print(f"  Stream {i}: bytes {start:,}-{end:,} ({chunk_size/(1024*1024):.2f} MB)")
             
             # Step 4: Start download
-            self.is_downloading = True
+            with self.lock:
+                if self.cancelled:
+                    print("Download cancelled.")
+                    return None
+                self.is_downloading = True
+                self.streaming = True
             self.downloaded_bytes = 0
             self.start_time = time.time()
-            self.threads = []
-            self.temp_files = []
+            self.first_byte_time = None
+            self.total_rate = ThroughputRing()
+            self.stream_rates = {}
+            self.hedges = {}
+            self.hedge_threads = []
+            # Hedges write into the parts, so only with local parts
+            hedging = HEDGING_ENABLED and self.sink.local
+            self.duplicate_budget = int(file_size * HEDGE_BUDGET_FRACTION) if hedging else 0
+            self.write_queue = WriteBackQueue()
             
             print("\nDownloading...")
             
-            # Create temporary files for each chunk
-            for i, (start, end) in enumerate(self.chunks):
-                temp_file = f"{output_path}.part{i}"
-                self.temp_files.append(temp_file)
-                
-                # Create thread for this chunk
-                thread = threading.Thread(
-                    target=self.download_chunk,
-                    args=(i, start, end, temp_file),
-                    daemon=True
-                )
-                thread.start()
-                self.threads.append(thread)
-            
-            # Step 5: Wait for all threads to complete
-            for i, thread in enumerate(self.threads):
-                thread.join()
+            # Step 5: Run the streams until all chunks are done. A pause ends
+            # them early; on resume they start again for the ranges still missing.
+            while True:
+                self.run_streams()
+                for thread in list(self.hedge_threads):
+                    thread.join()
+                self.write_queue.close()  # Everything received is on disk after this
+                with self.lock:
+                    # Stopped by pause() (possibly resumed already) rather than finished
+                    self.streaming = False
+                    stopped = not self.is_downloading and not self.cancelled and self.failure is None
+                if not stopped or not self.wait_for_resume():
+                    break
+                self.prepare_resume()
             
+            if self.failure is not None:
+                print(f"\nDownload failed: {self.failure}")
+                self.cleanup()
+                return None
             print("\nAll streams completed")
             
-            # Step 6: Verify and assemble
-            if self.is_downloading:  # Only if not cancelled
-                # Check temp file sizes before assembly
-                print("\nVerifying downloaded parts:")
-                total_downloaded = 0
-                for i, temp_file in enumerate(self.temp_files):
-                    if os.path.exists(temp_file):
-                        size = os.path.getsize(temp_file)
-                        total_downloaded += size
-                        expected_size = self.chunks[i][1] - self.chunks[i][0] + 1
-                        status = "OK" if size == expected_size else f"MISMATCH (expected {expected_size})"
-                        print(f"  Part {i}: {size:,} bytes - {status}")
-                    else:
-                        print(f"  Part {i}: MISSING!")
-                
-                print(f"\nTotal downloaded: {total_downloaded / (1024*1024):.2f} MB")
-                print(f"Expected: {file_size / (1024*1024):.2f} MB")
+            # Step 6: Verify, repair and assemble (or complete the upload)
+            if not self.cancelled and not self.sink.local:
+                with self.trace.span('complete_upload', parent=self.trace.root):
+                    output_path = self.sink.finish()
+                self.print_metrics_report()
+                return output_path
+            if not self.cancelled:
+                # Check the parts (sizes, and segment hashes if given) and
+                # re-fetch only the damaged ranges before assembling
+                if not self.verify_and_repair():
+                    print("Download cancelled." if self.cancelled else f"\nDownload failed: {self.failure}")
+                    self.cleanup()
+                    return None
                 
                 # Assemble the file
-                self.assemble_file(output_path)
+                with self.trace.span('assemble', parent=self.trace.root, parts=len(self.temp_files)):
+                    self.assemble_file(output_path)
                 
                 # Verify final file
                 if os.path.exists(output_path):
@@ -461,9 +1349,8 @@ class MultiStreamDownloader:
                     else:
                         print(f"WARNING: Size mismatch! Expected {file_size}, got {final_size}")
                 
-                # Print detailed metrics report
+                # Print detailed metrics report (the run is recorded in the history store)
                 self.print_metrics_report()
-                self.export_metrics_to_file()
                 
                 return output_path
             else:
@@ -472,14 +1359,118 @@ class MultiStreamDownloader:
                 return None
                 
         except Exception as e:
+            if self.cancelled:
+                # An aborted response can surface as an error here
+                print("Download cancelled.")
+                self.cleanup()
+                return None
+            self.failure = self.failure or str(e)
             print(f"\nDownload failed: {str(e)}")
             import traceback
             traceback.print_exc()
             self.cleanup()
             return None
     
+    def download_unsized(self, output_path):
+        """
+        Stream a resource of unknown length on a single connection.
+        
+        Writes straight to output_path (no part files, no assembly copy) using
+        a larger read buffer. Used when neither headers nor range probing
+        reveal the file size.
+        
+        Returns:
+            Path to downloaded file on success, None on failure or cancel
+        """
+        self.num_streams = 1
+        self.segments = SegmentTable([(0, -1)])
+        self.temp_files = [output_path]
+        with self.lock:
+            if self.cancelled:
+                return None
+            self.is_downloading = True  # Not pausable: the stream can't be resumed mid-way
+        self.downloaded_bytes = 0
+        self.start_time = time.time()
+        self.first_byte_time = None
+        self.total_rate = ThroughputRing()
+        self.segments.started[0] = self.start_time
+        
+        print("\nDownloading (single stream, unknown size)...")
+        
+        # A 200 probe response is already streaming the whole resource
+        response, http = self.take_probe_response()
+        if response is None or response.status_code != 200:
+            if response is not None:
+                response.close()
+            if http is None:
+                http = self.http_client()
+            with self.trace.span('request', parent=self.trace.root):
+                response = http.get(
+                    self.url,
+                    stream=True,
+                    timeout=(CONNECTION_TIMEOUT, READ_TIMEOUT),
+                    allow_redirects=True
+                )
+        headers_time = time.time()
+        self.chunk_responses[0] = response  # So cancel() can cut it off
+        
+        if response.status_code != 200:
+            raise Exception(f"Server returned status code: {response.status_code}")
+        
+        bytes_metric = DOWNLOADED_BYTES.labels(host=self.host, mode='multi')
+        pending_metric_bytes = 0
+        
+        self.write_queue = WriteBackQueue()
+        with self.write_queue.open(output_path, 'wb', final=True) as f:
+            for data in response.iter_content(chunk_size=STREAM_BUFFER_SIZE):
+                if not self.is_downloading:
+                    print("Download cancelled")
+                    break
+                
+                if data:
+                    f.write(data)
+                    with self.lock:
+                        if self.first_byte_time is None:
+                            self.first_byte_time = time.time()
+                            TIME_TO_FIRST_BYTE.labels(host=self.host).observe(self.first_byte_time - self.start_time)
+                        self.downloaded_bytes += len(data)
+                        self.total_rate.add(len(data))
+                    pending_metric_bytes += len(data)
+                    if pending_metric_bytes >= METRICS_FLUSH_BYTES:
+                        bytes_metric.inc(pending_metric_bytes)
+                        pending_metric_bytes = 0
+        
+        bytes_metric.inc(pending_metric_bytes)
+        self.write_queue.close()
+        end_time = time.time()
+        response.close()
+        if http is not self.h2_client:
+            http.close()
+        if self.first_byte_time is not None:
+            self.trace.record('first_byte', headers_time, self.first_byte_time, parent=self.trace.root)
+            self.trace.record('transfer', self.first_byte_time, end_time,
+                              parent=self.trace.root, bytes=self.downloaded_bytes)
+        
+        self.chunk_responses.pop(0, None)
+        if self.cancelled:
+            self.cleanup()
+            return None
+        
+        # Size is only known now that the stream has ended
+        self.file_size = self.downloaded_bytes
+        self.segments.finish(0, self.downloaded_bytes, end_time)
+        if self.progress_callback and self.file_size > 0:
+            self.progress_callback(self.downloaded_bytes, self.file_size)
+        
+        print(f"\nFinal file size: {self.file_size / (1024*1024):.2f} MB")
+        
+        self.print_metrics_report()
+        
+        return output_path
+    
     def cleanup(self):
-        """Clean up temporary files."""
+        """Clean up temporary files (and abort an upload in progress)."""
+        self.sink.discard()
         print("Cleaning up temporary files...")
         for temp_file in self.temp_files:
             if os.path.exists(temp_file):
@@ -489,15 +1480,527 @@ class MultiStreamDownloader:
                 except Exception as e:
                     print(f"  Failed to remove {temp_file}: {e}")
     
+    # ---- Verification and repair ------------------------------------------------
+    # Once the streams have ended, the parts are checked against the chunk
+    # sizes and, when segment hashes were given, block by block. Only the
+    # damaged byte ranges are fetched again, on fresh connections, and the
+    # check repeats until the parts verify or REPAIR_MAX_PASSES / the
+    # REPAIR_MAX_FRACTION byte budget is used up.
+    
+    def verify_and_repair(self):
+        """Verify the parts and repair what's damaged. Returns False (with self.failure set) if they can't be."""
+        pending = []  # Ranges whose re-fetch failed; not always visible to the checks
+        for repair_pass in range(REPAIR_MAX_PASSES + 1):
+            damaged = merge_ranges(self.find_damaged_ranges() + pending)
+            if not damaged or self.cancelled:
+                break
+            damaged_bytes = sum(end - start + 1 for start, end in damaged)
+            print(f"Damaged: {len(damaged)} ranges, {damaged_bytes / (1024*1024):.2f} MB")
+            if repair_pass == REPAIR_MAX_PASSES:
+                self.failure = f"Still {len(damaged)} damaged ranges after {REPAIR_MAX_PASSES} repair passes"
+                return False
+            if self.repaired_bytes + damaged_bytes > self.file_size * REPAIR_MAX_FRACTION:
+                self.failure = (f"Repair budget exhausted ({damaged_bytes / (1024*1024):.2f} MB damaged, "
+                                f"{self.repaired_bytes / (1024*1024):.2f} MB already re-fetched)")
+                return False
+            self.repair_passes += 1
+            print(f"\nRepair pass {self.repair_passes}: re-fetching {len(damaged)} ranges")
+            with self.trace.span('repair', parent=self.trace.root, ranges=len(damaged), bytes=damaged_bytes):
+                pending = self.repair_ranges(damaged)
+        
+        if self.cancelled:
+            return False
+        if self.repair_passes:
+            print(f"Repaired {self.repaired_ranges} ranges ({self.repaired_bytes / (1024*1024):.2f} MB) "
+                  f"in {self.repair_passes} passes")
+        with self.lock:
+            self.downloaded_bytes = self.file_size
+            if self.progress_callback:
+                self.progress_callback(self.downloaded_bytes, self.file_size)
+        return True
+    
+    def find_damaged_ranges(self):
+        """
+        Byte ranges (start, end) of the file the parts don't hold correctly:
+        missing parts, the missing tail of short parts and, with segment
+        hashes, blocks whose hash doesn't match. Long parts are cut back.
+        """
+        print("\nVerifying downloaded parts:")
+        damaged = []
+        total_downloaded = 0
+        for i, (start, end) in enumerate(self.segments):
+            temp_file = self.temp_files[i]
+            expected_size = end - start + 1
+            if not os.path.exists(temp_file):
+                print(f"  Part {i}: MISSING!")
+                damaged.append((start, end))
+                continue
+            size = os.path.getsize(temp_file)
+            if size > expected_size:
+                os.truncate(temp_file, expected_size)
+            total_downloaded += min(size, expected_size)
+            status = "OK" if size == expected_size else f"MISMATCH (expected {expected_size})"
+            print(f"  Part {i}: {size:,} bytes - {status}")
+            if size < expected_size:
+                damaged.append((start + size, end))
+        
+        print(f"\nTotal downloaded: {total_downloaded / (1024*1024):.2f} MB")
+        print(f"Expected: {self.file_size / (1024*1024):.2f} MB")
+        if self.segment_hashes:
+            damaged += self.find_corrupt_blocks(damaged)
+        return damaged
+    
+    def find_corrupt_blocks(self, damaged):
+        """Blocks whose SHA-256 doesn't match segment_hashes (skipping ranges already known damaged)."""
+        block_size = self.segment_hashes['block_size']
+        digests = self.segment_hashes['sha256']
+        if len(digests) != -(-self.file_size // block_size):
+            print(f"WARNING: {len(digests)} segment hashes don't cover a {self.file_size:,}-byte file; "
+                  f"checking sizes only")
+            return []
+        corrupt = []
+        for n, digest in enumerate(digests):
+            start = n * block_size
+            end = min(self.file_size, start + block_size) - 1
+            if any(s <= end and start <= e for s, e in damaged):
+                continue  # Re-fetched anyway
+            if hashlib.sha256(self.read_range(start, end)).hexdigest() != digest.lower():
+                corrupt.append((start, end))
+        if corrupt:
+            print(f"Segment hashes: {len(corrupt)} of {len(digests)} blocks corrupt")
+        return corrupt
+    
+    def read_range(self, start, end):
+        """Bytes start..end of the file, read from the parts that hold them."""
+        data = bytearray()
+        for part_start, part_end, i in self.part_pieces(start, end):
+            with open(self.temp_files[i], 'rb') as f:
+                f.seek(part_start - self.segments.starts[i])
+                data += f.read(part_end - part_start + 1)
+        return bytes(data)
+    
+    def part_pieces(self, start, end):
+        """Split the file range start..end at part boundaries: [(start, end, chunk_id), ...]."""
+        segments = self.segments
+        # Segments are in file order: bisect for the first one that ends at or after `start`
+        i = bisect.bisect_left(segments.ends, start)
+        pieces = []
+        while i < len(segments) and segments.starts[i] <= end:
+            pieces.append((max(start, segments.starts[i]), min(end, segments.ends[i]), i))
+            i += 1
+        return pieces
+    
+    def repair_ranges(self, ranges):
+        """Re-fetch `ranges` into the parts. Returns the ranges that failed."""
+        pieces = [piece for start, end in ranges for piece in self.part_pieces(start, end)]
+        for _, _, i in pieces:
+            if not os.path.exists(self.temp_files[i]):
+                open(self.temp_files[i], 'wb').close()  # Pieces of a missing part write into it at their offsets
+        return [piece[:2] for piece in self.run_pieces(pieces, self.repair_piece, 'repair')]
+    
+    def repair_piece(self, key, http, start, end, chunk_id):
+        """Fetch start..end into its part. Returns True once written."""
+        offset = start - self.segments.starts[chunk_id]
+        with open(self.temp_files[chunk_id], 'r+b') as f:
+            def write(position, data):
+                if position == 0:
+                    f.seek(offset)  # Each attempt writes the range from its start
+                f.write(data)
+            if not self.fetch_piece(key, http, start, end, write, "Repair of bytes"):
+                return False
+        with self.lock:
+            self.repaired_ranges += 1
+            self.repaired_bytes += end - start + 1
+        return True
+    
+    def run_pieces(self, pieces, fetch, prefix):
+        """
+        Call fetch(key, http, *piece) for every piece, up to num_streams at a
+        time, each worker on a connection of its own (registered in
+        chunk_responses as prefix + worker number, so cancel() cuts it off).
+        Returns the pieces that failed.
+        """
+        work = queue.Queue()
+        for piece in pieces:
+            work.put(piece)
+        failed = []
+        
+        def worker(n):
+            key = f"{prefix}{n}"
+            http = http_session()
+            try:
+                while not self.cancelled:
+                    try:
+                        piece = work.get_nowait()
+                    except queue.Empty:
+                        return
+                    if not fetch(key, http, *piece):
+                        with self.lock:
+                            failed.append(piece)
+            finally:
+                self.chunk_responses.pop(key, None)
+                http.close()
+        
+        self.piece_workers = min(len(pieces), max(self.num_streams, 1))
+        threads = [threading.Thread(target=worker, args=(n,), daemon=True)
+                   for n in range(self.piece_workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return failed
+    
+    def fetch_piece(self, key, http, start, end, write, label="Bytes"):
+        """
+        GET bytes start..end, handing each block to write(position in the
+        range, data), retrying per retry_policy (an attempt starts over at
+        position 0). Returns True once the whole range was written.
+        """
+        expected = end - start + 1
+        failures = 0
+        while not self.cancelled:
+            if self.stop_event.wait(circuit_breaker.wait_time(self.host)):
+                return False  # Cancelled while waiting for the host
+            received = 0
+            try:
+                response = http.get(self.url, headers={'Range': f'bytes={start}-{end}'}, stream=True,
+                                    timeout=(CONNECTION_TIMEOUT, READ_TIMEOUT), allow_redirects=True)
+                self.chunk_responses[key] = response  # cancel() cuts it off
+                try:
+                    check_response(response, start)
+                    for data in response.iter_content(chunk_size=BUFFER_SIZE):
+                        if self.cancelled:
+                            return False
+                        if data:
+                            data = data[:expected - received]  # A 200 from byte 0 runs past the range
+                            write(received, data)
+                            received += len(data)
+                            if received >= expected:
+                                break
+                finally:
+                    response.close()
+                if received < expected:
+                    raise requests.exceptions.ChunkedEncodingError(
+                        f"Response ended after {received:,} of {expected:,} bytes")
+                return True
+            except Exception as e:
+                if self.cancelled:
+                    return False
+                failures += 1
+                if not is_fatal(e):
+                    circuit_breaker.report_failure(self.host, self.piece_workers)
+                delay, reason = retry_policy.next_delay(e, failures)
+                print(f"{label} {start}-{end}: {str(e)}" + (f" - giving up ({reason})" if delay is None else ''))
+                if delay is None or self.stop_event.wait(delay):
+                    return False
+        return False
+    
+    # ---- Partial fetches ------------------------------------------------------------
+    # fetch_ranges() downloads only some byte ranges of the URL into memory
+    # (e.g. the members of a remote zip, see remote_zip.py), on up to
+    # num_streams connections with the same retries as repairs. Ranges close
+    # together share a request; long ones are split between streams.
+    
+    def probe_ranges(self):
+        """
+        Find the file size and range support once, for partial fetches.
+        Returns False (self.failure says why) if ranges can't be fetched.
+        """
+        try:
+            if not self.file_size:
+                self.supports_ranges, self.file_size, self.filename = self.check_download_support()
+        except Exception as e:
+            self.failure = str(e)
+            return False
+        if not self.supports_ranges or not self.file_size:
+            self.failure = "Server does not support range requests (or hides the file size)"
+            return False
+        return True
+    
+    def fetch_ranges(self, ranges, gap=RANGE_MERGE_GAP, into=None):
+        """
+        Download the (start, end) byte ranges, inclusive. A negative start
+        counts from the end of the file and end None means to the end, so
+        (-n, None) is the last n bytes.
+        
+        Returns the bytes of each range, in the order given, or None if
+        cancelled or failed (self.failure says why). Raises ValueError for
+        ranges outside the file or more than RANGE_FETCH_MAX_BYTES in all.
+        With `into` (path of an existing file) the ranges, and the gaps
+        fetched between them, are written there at their own offsets
+        instead (no memory limit), and the result is True.
+        """
+        if not self.probe_ranges():
+            return None
+        
+        size = self.file_size
+        wanted = []
+        for start, end in ranges:
+            if start < 0:
+                start = max(0, size + start)
+            end = size - 1 if end is None else min(end, size - 1)
+            if start > end:
+                raise ValueError(f"Range {start}-{end} is outside the file ({size:,} bytes)")
+            wanted.append((start, end))
+        
+        spans = merge_ranges(wanted, gap)
+        total = sum(end - start + 1 for start, end in spans)
+        if into is None and total > RANGE_FETCH_MAX_BYTES:
+            raise ValueError(f"Ranges cover {total / (1024*1024):.0f} MB, more than RANGE_FETCH_MAX_BYTES; "
+                             "download the whole file instead")
+        buffers = [bytearray(end - start + 1) for start, end in spans] if into is None else []
+        pieces = [
+            (piece_start, min(piece_start + RANGE_PIECE_SIZE, end + 1) - 1, i)
+            for i, (start, end) in enumerate(spans)
+            for piece_start in range(start, end + 1, RANGE_PIECE_SIZE)
+        ]
+        
+        def fetch(key, http, start, end, i):
+            if into is not None:
+                with open(into, 'r+b') as f:
+                    def write(position, data):
+                        if position == 0:
+                            f.seek(start)
+                        f.write(data)
+                    fetched = self.fetch_piece(key, http, start, end, write)
+            else:
+                view = memoryview(buffers[i])[start - spans[i][0]:]
+                def write(position, data):
+                    view[position:position + len(data)] = data
+                fetched = self.fetch_piece(key, http, start, end, write)
+            if fetched:
+                with self.lock:
+                    self.downloaded_bytes += end - start + 1  # Progress piece by piece
+            return fetched
+        
+        failed = self.run_pieces(pieces, fetch, 'range')
+        if self.cancelled:
+            return None
+        if failed:
+            self.failure = f"{len(failed)} of {len(pieces)} range requests failed"
+            return None
+        
+        DOWNLOADED_BYTES.labels(host=self.host, mode='ranges').inc(total)
+        wanted_bytes = sum(end - start + 1 for start, end in wanted)
+        print(f"Fetched {len(wanted)} ranges ({wanted_bytes:,} bytes of {size:,}) in {len(pieces)} requests"
+              + (f", {total - wanted_bytes:,} bytes of gaps" if total > wanted_bytes else ''))
+        if into is not None:
+            return True
+        
+        span_starts = [start for start, _ in spans]
+        results = []
+        for start, end in wanted:
+            i = bisect.bisect_right(span_starts, start) - 1
+            offset = start - spans[i][0]
+            results.append(bytes(buffers[i][offset:offset + end - start + 1]))
+        return results
+    
+    # ---- Stream slots --------------------------------------------------------------
+    # Each chunk gets a stream of its own unless a stream limit is set (by the
+    # stream scheduler, see scheduler.py); then chunks take turns and streams
+    # over the limit are parked, keeping what their parts already hold.
+    
+    def run_streams(self):
+        """
+        Run the chunks' streams, at most stream_limit at a time, until every chunk
+        has ended or a pause/cancel has stopped them all. Chunks start (or
+        continue from what their part holds) as slots free up. Straggler
+        checks for hedging run from here too.
+        """
+        hedging = self.duplicate_budget > 0 and len(self.segments) > 1
+        next_hedge_check = time.time() + HEDGE_CHECK_INTERVAL
+        while True:
+            started = []
+            with self.lock:
+                waiting = self.segments.waiting(self.stream_threads)
+                self.parking.difference_update(waiting)  # Parked streams that have stopped
+                if not self.is_downloading:
+                    waiting = []  # Paused or cancelled: just wait for the streams to stop
+                if not self.stream_threads and not waiting:
+                    return
+                limit = len(self.segments) if self.stream_limit is None else self.stream_limit
+                cap = circuit_breaker.stream_cap(self.host)
+                if cap is not None:
+                    limit = min(limit, cap)
+                for i in waiting[:max(0, limit - len(self.stream_threads))]:
+                    start, end = self.segments[i]
+                    # Stream 0 carries on with the probe's response on the first run
+                    first_response, http = self.take_probe_response() if i == 0 else (None, None)
+                    thread = threading.Thread(
+                        target=self.run_stream,
+                        args=(i, start, end, first_response, http, self.segments.positions[i]),
+                        daemon=True
+                    )
+                    self.stream_threads[i] = thread
+                    started.append(thread)
+            QUEUE_DEPTH.labels(queue='segments').inc(len(started))
+            for thread in started:
+                thread.start()
+            
+            # Sleep until a stream ends or the limit changes; watch for stragglers
+            # and a growing circuit-breaker cap meanwhile
+            timeout = max(0, next_hedge_check - time.time()) if hedging else None
+            if cap is not None and waiting:
+                timeout = CIRCUIT_RECOVERY_INTERVAL if timeout is None else min(timeout, CIRCUIT_RECOVERY_INTERVAL)
+            self.schedule_event.wait(timeout)
+            self.schedule_event.clear()
+            if hedging and self.is_downloading and time.time() >= next_hedge_check:
+                try:
+                    self.maybe_hedge()
+                except Exception as e:
+                    print(f"Hedge check failed: {str(e)}")
+                next_hedge_check = time.time() + HEDGE_CHECK_INTERVAL
+    
+    def run_stream(self, chunk_id, *args):
+        """Thread body for one stream: download_chunk, then let run_streams reuse the slot."""
+        try:
+            self.download_chunk(chunk_id, *args)
+        finally:
+            with self.lock:
+                self.stream_threads.pop(chunk_id, None)
+                if not self.stopping(chunk_id):
+                    # Finished, or out of retries: either way it isn't started again
+                    self.segments.end(chunk_id, time.time())
+            self.schedule_event.set()
+    
+    def set_stream_limit(self, limit):
+        """
+        Cap how many of this download's streams run at once (None = one per
+        chunk, 0 = hold them all), e.g. from the stream scheduler. Lowering it parks the streams
+        with the most bytes left: they are cut off now and their remaining
+        ranges handed back to wait for a slot, which they get again when the
+        limit is raised. Raising it starts waiting chunks right away.
+        """
+        with self.lock:
+            self.stream_limit = None if limit is None else max(0, limit)
+            running = [i for i in self.stream_threads if i not in self.parking]
+            excess = 0 if limit is None else len(running) - self.stream_limit
+            if limit is not None and self.segments and self.stream_limit < len(self.segments):
+                self.limited = True
+            
+            park = sorted(running, key=self.segments.remaining, reverse=True)[:max(0, excess)]
+            self.parking.update(park)
+            responses = [self.chunk_responses.get(i) for i in park]
+        if park:
+            print(f"Stream limit {self.stream_limit}: parking streams {sorted(park)}")
+        for response in responses:
+            if response is not None:
+                abort_response(response)  # HTTP/2 streams stop at their next buffer instead
+        self.schedule_event.set()
+    
+    # ---- Pause / resume / cancel ------------------------------------------------
+    # Called from other threads (GUI, REST). They only flag the state and cut
+    # off open responses so blocked streams notice at once; the thread running
+    # download() then waits (pause), restarts the missing ranges (resume) or
+    # removes the parts once no stream can still write to them (cancel).
+    
+    def prepare_resume(self):
+        """After a resume: reset state so run_streams restarts the ranges still missing."""
+        segments = self.segments
+        missing = [i for i in range(len(segments)) if not segments.done[i]]
+        with self.lock:
+            for i in missing:
+                position = segments.positions[i]
+                if not self.supports_ranges and position:
+                    # The server can only send the file from the start
+                    self.downloaded_bytes -= position
+                    self.refetched_bytes += position
+                    segments.positions[i] = 0
+                segments.reopen(i)  # Failed out before the pause; try again
+            # A won hedge's tail is on disk; stopped or lost hedges may be relaunched
+            self.hedges = {i: hedge for i, hedge in self.hedges.items() if hedge['state'] == 'won'}
+            self.hedge_threads = []
+            self.parking = set()
+            self.is_downloading = True
+            self.streaming = True
+        
+        print(f"Resuming {len(missing)} of {len(segments)} ranges "
+              f"({(self.file_size - self.downloaded_bytes) / (1024*1024):.2f} MB left)")
+        if self.transport == 'http2':
+            self.h2_client = HTTP2Client(self.url)
+        self.write_queue = WriteBackQueue()
+    
+    def wait_for_resume(self):
+        """Hold the download while paused. True once resumed, False if cancelled."""
+        if self.h2_client is not None:
+            self.h2_client.close()  # Shared connections are released too
+            self.h2_client = None
+        print(f"Download paused at {self.downloaded_bytes / (1024*1024):.2f} MB")
+        self.resume_event.wait()
+        with self.lock:
+            self.paused_seconds += time.time() - self.paused_at
+            self.resume_event.clear()
+            return not self.cancelled
+    
+    def interrupt_streams(self):
+        """Cut off every open response so streams blocked on a read return now."""
+        responses = list(self.chunk_responses.values())
+        responses += [hedge.get('response') for hedge in list(self.hedges.values())]
+        responses.append(self.probe_response)
+        for response in responses:
+            if response is not None:
+                abort_response(response)
+        if self.h2_client is not None:
+            self.h2_client.abort()  # Streams share its connections; wake them all
+    
+    def pause(self):
+        """
+        Stop all streams now, keeping what the parts hold. Their connections and
+        threads are released; resume() fetches only the missing ranges.
+        Returns False if the download can't be paused at this point.
+        """
+        with self.lock:
+            if not self.streaming or self.paused or self.cancelled:
+                return False
+            print("Pausing download...")
+            self.paused = True
+            self.paused_at = time.time()
+            self.is_downloading = False
+            self.stop_event.set()
+        self.interrupt_streams()
+        self.schedule_event.set()
+        return True
+    
+    def resume(self):
+        """Resume a paused download. Returns False if it isn't paused."""
+        with self.lock:
+            if not self.paused or self.cancelled:
+                return False
+            print("Resuming download...")
+            self.paused = False
+            self.stop_event.clear()
+            self.resume_event.set()
+        return True
+    
     def cancel(self):
-        """Cancel the download."""
+        """
+        Cancel the download. Streams are cut off at once; the parts are removed
+        by the download thread after its streams have stopped writing.
+        """
         print("Cancelling download...")
-        self.is_downloading = False
-        self.cleanup()
+        with self.lock:
+            self.cancelled = True
+            self.is_downloading = False
+            self.stop_event.set()
+            if self.paused:
+                self.paused = False
+                self.resume_event.set()
+        self.interrupt_streams()
+        self.schedule_event.set()
     
     def get_speed(self):
-        """Calculate current download speed in MB/s."""
+        """Current (instantaneous) download speed in MB/s."""
         if self.start_time and self.downloaded_bytes > 0:
-            elapsed = time.time() - self.start_time
-            return (self.downloaded_bytes / (1024 * 1024)) / elapsed if elapsed > 0 else 0
-        return 0
\ No newline at end of file
+            return self.total_rate.instant_speed() / (1024 * 1024)
+        return 0
+
+
+def merge_ranges(ranges, gap=0):
+    """Sort (start, end) byte ranges and merge the ones that overlap, touch or are under `gap` bytes apart."""
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1 + gap:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
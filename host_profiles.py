@@ -0,0 +1,162 @@
+# host_profiles.py - Persistent per-host throughput profiles for choosing stream counts
+
+import math
+import os
+import random
+import sqlite3
+import threading
+import time
+
+from config import (
+    DEFAULT_NUM_STREAMS, MAX_STREAMS, METRICS_DB_PATH, MIN_STREAMS,
+    PROFILE_EWMA_ALPHA, PROFILE_EXPLORE_RATE, PROFILE_MIN_RUNS
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS host_profiles (
+    host TEXT NOT NULL,
+    num_streams INTEGER NOT NULL,
+    segment_bucket INTEGER NOT NULL,
+    runs INTEGER NOT NULL,
+    throughput_MBps REAL NOT NULL,
+    updated REAL NOT NULL,
+    PRIMARY KEY (host, num_streams, segment_bucket)
+);
+"""
+
+
+def segment_bucket(segment_size):
+    """Power-of-two size class of a segment in MB (0 = under 2 MB, 1 = 2-4 MB, ...)."""
+    megabytes = segment_size / (1024 * 1024)
+    return max(0, int(math.log2(megabytes))) if megabytes >= 1 else 0
+
+
+class HostProfiles:
+    """
+    Learned throughput per (host, stream count, segment size class).
+
+    Each completed multi-stream run folds its throughput into an EWMA for its
+    cell, so profiles follow changes in a host's behaviour. recommend() picks
+    the best-known stream count for a host and file size, and now and then
+    tries a neighbouring count so the profile doesn't go stale.
+    """
+
+    def __init__(self, path=METRICS_DB_PATH, explore_rate=PROFILE_EXPLORE_RATE, rng=None):
+        self.path = path
+        self.explore_rate = explore_rate
+        self.rng = rng or random.Random()
+        self.lock = threading.RLock()
+        self.initialized = False
+
+    def connect(self):
+        if not self.initialized:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=10)
+        conn.row_factory = sqlite3.Row
+        if not self.initialized:
+            with self.lock:
+                conn.executescript(SCHEMA)
+                self.initialized = True
+        return conn
+
+    def record(self, host, num_streams, segment_size, throughput_MBps):
+        """Fold one completed run into the host's profile."""
+        if not host or throughput_MBps is None or throughput_MBps <= 0:
+            return
+        bucket = segment_bucket(segment_size)
+        with self.lock:
+            conn = self.connect()
+            try:
+                with conn:
+                    row = conn.execute(
+                        "SELECT runs, throughput_MBps FROM host_profiles "
+                        "WHERE host = ? AND num_streams = ? AND segment_bucket = ?",
+                        (host, num_streams, bucket)
+                    ).fetchone()
+                    if row:
+                        runs = row['runs'] + 1
+                        value = PROFILE_EWMA_ALPHA * throughput_MBps + (1 - PROFILE_EWMA_ALPHA) * row['throughput_MBps']
+                    else:
+                        runs, value = 1, throughput_MBps
+                    conn.execute(
+                        "INSERT OR REPLACE INTO host_profiles "
+                        "(host, num_streams, segment_bucket, runs, throughput_MBps, updated) "
+                        "VALUES (?, ?, ?, ?, ?, ?)",
+                        (host, num_streams, bucket, runs, value, time.time())
+                    )
+            finally:
+                conn.close()
+
+    def get_profile(self, host):
+        """All profile cells for a host."""
+        conn = self.connect()
+        try:
+            return [dict(row) for row in conn.execute(
+                "SELECT * FROM host_profiles WHERE host = ? ORDER BY num_streams, segment_bucket", (host,)
+            )]
+        finally:
+            conn.close()
+
+    def estimate(self, cells, num_streams, file_size):
+        """
+        Expected throughput for a stream count: the cell matching the segment
+        size this file would get, else the run-weighted average across sizes.
+        """
+        candidates = [c for c in cells if c['num_streams'] == num_streams]
+        if not candidates:
+            return None, 0
+        bucket = segment_bucket(file_size / num_streams) if file_size else None
+        for cell in candidates:
+            if cell['segment_bucket'] == bucket:
+                return cell['throughput_MBps'], cell['runs']
+        runs = sum(c['runs'] for c in candidates)
+        return sum(c['throughput_MBps'] * c['runs'] for c in candidates) / runs, runs
+
+    def recommend(self, host, file_size=0):
+        """
+        Stream count to use for a new download from `host`.
+        Returns (num_streams, reason) where reason is 'default', 'best' or 'explore'.
+        """
+        try:
+            cells = self.get_profile(host)
+        except sqlite3.Error as e:
+            print(f"Host profile unavailable: {str(e)}")
+            cells = []
+        if not cells:
+            return DEFAULT_NUM_STREAMS, 'default'
+
+        scored = {}
+        for streams in sorted({c['num_streams'] for c in cells}):
+            throughput, runs = self.estimate(cells, streams, file_size)
+            if throughput is not None:
+                scored[streams] = (throughput, runs)
+        best = max(scored, key=lambda s: scored[s][0])
+
+        # Explore more while the best cell is poorly sampled, then occasionally
+        explore_rate = self.explore_rate if scored[best][1] >= PROFILE_MIN_RUNS else 0.5
+        if self.rng.random() < explore_rate:
+            neighbours = {max(MIN_STREAMS, best // 2), min(MAX_STREAMS, best * 2),
+                          max(MIN_STREAMS, best - 2), min(MAX_STREAMS, best + 2)} - {best}
+            untried = [n for n in neighbours if n not in scored]
+            pool = untried or sorted(neighbours)
+            if pool:
+                return self.rng.choice(pool), 'explore'
+        return best, 'best'
+
+    def warmup_streams(self, host):
+        """
+        Stream count to connect ahead of the probe, before the file size is
+        known: the host's best-known count over all sizes, without exploring
+        (DEFAULT_NUM_STREAMS for a host with no profile).
+        """
+        try:
+            cells = self.get_profile(host)
+        except sqlite3.Error:
+            cells = []
+        if not cells:
+            return DEFAULT_NUM_STREAMS
+        counts = {c['num_streams'] for c in cells}
+        return max(sorted(counts), key=lambda s: self.estimate(cells, s, 0)[0])
+
+
+host_profiles = HostProfiles()
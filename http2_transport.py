@@ -0,0 +1,110 @@
+# http2_transport.py - Optional HTTP/2 transport: segment requests multiplexed over a few connections
+
+import socket
+from urllib.parse import urlparse
+
+from config import BUFFER_SIZE, H2_MAX_CONNECTIONS
+
+httpx = None  # Imported on first use; it adds ~50 ms to every start otherwise
+
+
+def load_httpx():
+    """The httpx module if it's installed with HTTP/2 support, else None."""
+    global httpx
+    if httpx is None:
+        try:
+            import httpx as module
+            import h2  # noqa: F401 - httpx needs it for HTTP/2
+        except ImportError:
+            return None
+        httpx = module
+    return httpx
+
+
+def http2_available():
+    """True if httpx with HTTP/2 support is installed."""
+    return load_httpx() is not None
+
+
+class HTTP2Response:
+    """The part of the requests.Response API the downloaders use."""
+
+    def __init__(self, response):
+        self.response = response
+        self.status_code = response.status_code
+        self.headers = response.headers
+        self.http_version = response.http_version
+
+    def iter_content(self, chunk_size=BUFFER_SIZE):
+        return self.response.iter_bytes(chunk_size)
+
+    def abort(self):
+        """Cancel the stream from another thread (sends RST_STREAM on HTTP/2)."""
+        try:
+            self.response.close()
+        except Exception:
+            pass
+
+    def close(self):
+        self.response.close()
+
+
+class HTTP2Client:
+    """
+    One client is shared by all streams of a download, so each segment is an
+    HTTP/2 stream on one of at most `max_connections` connections instead of
+    a TCP connection (and TLS handshake) of its own.
+
+    https URLs negotiate h2 through ALPN and fall back to HTTP/1.1 if the
+    server refuses; http URLs use h2c with prior knowledge.
+    """
+
+    def __init__(self, url, max_connections=H2_MAX_CONNECTIONS):
+        if load_httpx() is None:
+            raise RuntimeError("HTTP/2 transport needs httpx with HTTP/2 support: pip install 'httpx[http2]'")
+        cleartext = urlparse(url).scheme == 'http'
+        self.client = httpx.Client(
+            http1=not cleartext,
+            http2=True,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        )
+        self.versions = set()  # Protocol versions actually negotiated
+
+    def request(self, method, url, headers=None, timeout=None, allow_redirects=True, stream=True):
+        """requests-style call; the body is always streamed."""
+        connect, read = timeout if isinstance(timeout, tuple) else (timeout, timeout)
+        # No pool timeout: with few connections, requests queue for a free stream
+        request = self.client.build_request(
+            method, url, headers=headers,
+            timeout=httpx.Timeout(read, connect=connect, pool=None)
+        )
+        response = self.client.send(request, stream=True, follow_redirects=allow_redirects)
+        self.versions.add(response.http_version)
+        return HTTP2Response(response)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def head(self, url, **kwargs):
+        response = self.request('HEAD', url, **kwargs)
+        response.close()  # No body; release the stream right away
+        return response
+
+    def abort(self):
+        """
+        Shut down the sockets of every connection from another thread. Resetting
+        one stream doesn't wake a reader blocked on the shared connection; this
+        wakes them all (pause/cancel stop every stream anyway). Close afterwards.
+        """
+        pool = getattr(self.client._transport, '_pool', None)
+        for connection in list(getattr(pool, 'connections', [])):
+            stream = getattr(getattr(connection, '_connection', None), '_network_stream', None)
+            sock = stream.get_extra_info('socket') if stream is not None else None
+            if sock is not None:
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+
+    def close(self):
+        self.client.close()
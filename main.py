@@ -82,6 +82,16 @@ class DownloaderGUI:
         )
         self.streams_spinbox.pack(side='left', padx=10)
         
+        self.auto_streams_var = tk.BooleanVar(value=False)
+        self.auto_streams_check = tk.Checkbutton(
+            streams_frame,
+            text="Auto (learned per host)",
+            variable=self.auto_streams_var,
+            font=("Arial", 10),
+            command=self.toggle_streams_control
+        )
+        self.auto_streams_check.pack(side='left', padx=10)
+        
         # Progress Frame
         progress_frame = tk.LabelFrame(self.root, text="Download Progress", font=("Arial", 10))
         progress_frame.pack(pady=15, padx=20, fill='both', expand=True)
@@ -144,6 +154,20 @@ class DownloaderGUI:
         )
         self.download_btn.pack(side='left', padx=10)
         
+        self.pause_btn = tk.Button(
+            button_frame,
+            text="Pause",
+            command=self.toggle_pause,
+            font=("Arial", 11),
+            bg="#FF9800",
+            fg="white",
+            width=15,
+            height=2,
+            state='disabled',
+            cursor="hand2"
+        )
+        self.pause_btn.pack(side='left', padx=10)
+        
         self.cancel_btn = tk.Button(
             button_frame,
             text="Cancel",
@@ -159,11 +183,13 @@ class DownloaderGUI:
         self.cancel_btn.pack(side='left', padx=10)
     
     def toggle_streams_control(self):
-        """Enable/disable streams spinbox based on selected mode."""
+        """Enable/disable streams controls based on selected mode and auto setting."""
         if self.mode_var.get() == "single":
             self.streams_spinbox.config(state='disabled')
+            self.auto_streams_check.config(state='disabled')
         else:
-            self.streams_spinbox.config(state='normal')
+            self.auto_streams_check.config(state='normal')
+            self.streams_spinbox.config(state='disabled' if self.auto_streams_var.get() else 'normal')
     
     def progress_callback(self, downloaded, total):
         """Update progress bar and labels."""
@@ -178,8 +204,43 @@ class DownloaderGUI:
         )
         
         if self.downloader:
-            speed = self.downloader.get_speed()
-            self.speed_label.config(text=f"Speed: {speed:.2f} MB/s")
+            self.speed_label.config(text=self.format_speed(self.downloader.get_rate_metrics(include_series=False)))
+    
+    def format_speed(self, rates):
+        """Speed label text: instantaneous and smoothed speed plus ETA."""
+        text = f"Speed: {rates['instant_speed']:.2f} MB/s (avg {rates['ewma_speed']:.2f} MB/s)"
+        eta = rates.get('eta_seconds')
+        if eta is not None:
+            minutes, seconds = divmod(int(eta), 60)
+            text += f"  •  ETA {minutes}:{seconds:02d}"
+        return text
+    
+    def refresh_live_metrics(self):
+        """Show per-stream live throughput in the metrics panel while downloading."""
+        if not self.downloader or not self.downloader.is_downloading or not self.downloader.start_time:
+            if self.download_thread and self.download_thread.is_alive():
+                self.root.after(LIVE_METRICS_INTERVAL_MS, self.refresh_live_metrics)
+            return
+        
+        rates = self.downloader.get_rate_metrics(include_series=False)
+        self.speed_label.config(text=self.format_speed(rates))
+        
+        report = f"Download in progress...\n\n"
+        report += f"  Instantaneous: {rates['instant_speed']:.2f} MB/s\n"
+        report += f"  Smoothed:      {rates['ewma_speed']:.2f} MB/s\n"
+        report += f"  Average:       {rates['average_speed']:.2f} MB/s\n"
+        if rates['streams']:
+            report += f"\n  {'Stream':<8} {'Now (MB/s)':<12} {'EWMA (MB/s)':<12}\n"
+            report += f"  {'-'*34}\n"
+            for stream in rates['streams']:
+                report += f"  {stream['chunk_id']:<8} {stream['instant_speed']:<12.2f} {stream['ewma_speed']:<12.2f}\n"
+        
+        self.metrics_text.config(state='normal')
+        self.metrics_text.delete(1.0, tk.END)
+        self.metrics_text.insert(1.0, report)
+        self.metrics_text.config(state='disabled')
+        
+        self.root.after(LIVE_METRICS_INTERVAL_MS, self.refresh_live_metrics)
     
     def display_metrics(self, metrics):
         """Display metrics in the text widget."""
@@ -196,11 +257,12 @@ DOWNLOAD COMPLETE - PERFORMANCE METRICS
 OVERALL PERFORMANCE:
   Total Time:        {metrics['total_time_seconds']:.2f} seconds
   File Size:         {metrics['total_size_mb']:.2f} MB
-  Streams Used:      {metrics['num_streams_used']}
+  Streams Used:      {metrics['num_streams_used']} ({metrics['stream_choice']})
 
 THROUGHPUT:
   Overall:           {metrics['throughput_mbps']:.2f} Mbps ({metrics['throughput_MBps']:.2f} MB/s)
   Per Stream Avg:    {metrics['average_speed_per_stream']:.2f} MB/s
+  Final EWMA:        {metrics['ewma_speed']:.2f} MB/s
 
 """
             
@@ -248,8 +310,9 @@ THROUGHPUT:
     def download_complete(self, result):
         """Called when download finishes."""
         self.download_btn.config(state='normal')
+        self.pause_btn.config(state='disabled', text="Pause")
         self.cancel_btn.config(state='disabled')
-        self.streams_spinbox.config(state='normal' if self.mode_var.get() == 'multi' else 'disabled')
+        self.toggle_streams_control()
         
         if result:
             # Get and display metrics
@@ -280,12 +343,14 @@ THROUGHPUT:
         
         # Get selected mode
         mode = self.mode_var.get()
-        num_streams = self.streams_var.get()
+        num_streams = None if self.auto_streams_var.get() else self.streams_var.get()
         
         # Disable controls during download
         self.download_btn.config(state='disabled')
+        self.pause_btn.config(state='normal', text="Pause")
         self.cancel_btn.config(state='normal')
         self.streams_spinbox.config(state='disabled')
+        self.auto_streams_check.config(state='disabled')
         
         # Reset progress and metrics
         self.progress_bar['value'] = 0
@@ -312,11 +377,27 @@ THROUGHPUT:
         # Start download in separate thread
         self.download_thread = threading.Thread(target=self.download_file)
         self.download_thread.start()
+        self.root.after(LIVE_METRICS_INTERVAL_MS, self.refresh_live_metrics)
+    
+    def toggle_pause(self):
+        """Pause the current download (freeing its connections), or resume it."""
+        if not self.downloader:
+            return
+        if self.downloader.paused:
+            if self.downloader.resume():
+                self.pause_btn.config(text="Pause")
+                self.status_label.config(text="Resuming...")
+        elif self.downloader.pause():
+            self.pause_btn.config(text="Resume")
+            self.status_label.config(text="Paused")
+        else:
+            self.status_label.config(text="Can't pause yet - the download is still starting")
     
     def cancel_download(self):
         """Cancel the current download."""
         if self.downloader:
             self.downloader.cancel()
+            self.pause_btn.config(state='disabled', text="Pause")
             self.status_label.config(text="Cancelling...")
 
 def main():
@@ -0,0 +1,233 @@
+# metrics.py - Lightweight Prometheus-compatible metrics (counters, gauges, histograms)
+
+import bisect
+import threading
+
+# Default histogram buckets in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+DURATION_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+def format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+class CounterChild:
+    def __init__(self):
+        self.value = 0.0
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+
+class GaugeChild:
+    def __init__(self):
+        self.value = 0.0
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        with self.lock:
+            self.value -= amount
+
+    def set(self, value):
+        with self.lock:
+            self.value = value
+
+
+class HistogramChild:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last slot is +Inf
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+
+
+class Metric:
+    """
+    A named metric family. Call labels(...) once and keep the child around
+    in hot paths; metrics without labels can be updated directly.
+    """
+
+    type_name = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.children = {}
+        self.lock = threading.Lock()
+        (registry or REGISTRY).register(self)
+
+    def new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values, **kwargs):
+        if kwargs:
+            values = tuple(kwargs[name] for name in self.labelnames)
+        key = tuple(str(v) for v in values)
+        if len(key) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}")
+        child = self.children.get(key)
+        if child is None:
+            with self.lock:
+                child = self.children.setdefault(key, self.new_child())
+        return child
+
+    def samples(self):
+        """Yield (suffix, label_values, extra_label, value) tuples for exposition."""
+        for key, child in list(self.children.items()):
+            yield '', key, None, child.value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        for suffix, key, extra, value in self.samples():
+            lines.append(f"{self.name}{suffix}{format_labels(self.labelnames, key, extra)} {format_value(value)}")
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    type_name = 'counter'
+
+    def new_child(self):
+        return CounterChild()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+
+class Gauge(Metric):
+    type_name = 'gauge'
+
+    def new_child(self):
+        return GaugeChild()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def dec(self, amount=1):
+        self.labels().dec(amount)
+
+    def set(self, value):
+        self.labels().set(value)
+
+
+class Histogram(Metric):
+    type_name = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS, registry=None):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def new_child(self):
+        return HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def samples(self):
+        for key, child in list(self.children.items()):
+            with child.lock:
+                counts = list(child.counts)
+                total = child.sum
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                yield '_bucket', key, ('le', format_value(float(bound))), cumulative
+            yield '_sum', key, None, total
+            yield '_count', key, None, cumulative
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+        self.lock = threading.Lock()
+
+    def register(self, metric):
+        with self.lock:
+            self.metrics.append(metric)
+
+    def render(self):
+        """Prometheus text exposition format (version 0.0.4)."""
+        with self.lock:
+            metrics = list(self.metrics)
+        return '\n'.join(metric.render() for metric in metrics) + '\n'
+
+
+REGISTRY = Registry()
+
+# Downloader metrics
+DOWNLOADED_BYTES = Counter(
+    'msd_downloaded_bytes_total', 'Payload bytes received from origins', ['host', 'mode'])
+DOWNLOADS = Counter(
+    'msd_downloads_total', 'Finished downloads by result', ['host', 'mode', 'result'])
+RETRIES = Counter(
+    'msd_retries_total', 'Segment attempts that were retried', ['host'])
+FAILURES = Counter(
+    'msd_request_failures_total', 'Failed segment requests by cause', ['host', 'cause'])
+HEDGES = Counter(
+    'msd_hedged_requests_total', 'Tail hedges launched for straggling segments, by outcome', ['host', 'result'])
+DUPLICATE_BYTES = Counter(
+    'msd_duplicate_bytes_total', 'Bytes fetched twice because of hedged tails', ['host'])
+CIRCUIT_TRIPS = Counter(
+    'msd_circuit_trips_total', 'Times a host\'s circuit breaker opened', ['host'])
+COALESCED_DOWNLOADS = Counter(
+    'msd_coalesced_downloads_total', 'Submissions attached to an in-flight download of the same URL', ['host'])
+UPLOADED_BYTES = Counter(
+    'msd_uploaded_bytes_total', 'Bytes uploaded to object-storage sinks')
+WRITE_STALL_SECONDS = Counter(
+    'msd_write_stall_seconds_total', 'Time streams waited on a full write-back queue')
+ACTIVE_DOWNLOADS = Gauge(
+    'msd_active_downloads', 'Downloads currently in progress', ['mode'])
+ACTIVE_STREAMS = Gauge(
+    'msd_active_streams', 'Segment streams currently open')
+QUEUE_DEPTH = Gauge(
+    'msd_queue_depth', 'Work items waiting or in progress', ['queue'])
+WRITE_BACKLOG = Gauge(
+    'msd_write_backlog_bytes', 'Bytes received but not yet written to disk')
+UPLOAD_BACKLOG = Gauge(
+    'msd_upload_backlog_bytes', 'Parts queued for upload to object-storage sinks, in bytes')
+TIME_TO_FIRST_BYTE = Histogram(
+    'msd_time_to_first_byte_seconds', 'Request start to first payload byte', ['host'])
+SEGMENT_DURATION = Histogram(
+    'msd_segment_duration_seconds', 'Time to download one segment', ['host'], buckets=DURATION_BUCKETS)
+PROBE_DURATION = Histogram(
+    'msd_probe_duration_seconds', 'Time spent probing size and range support', ['host'])
+
+
+def failure_cause(error=None, status_code=None):
+    """Bucket a failed request into a low-cardinality cause label."""
+    if status_code is not None:
+        return f"http_{status_code // 100}xx"
+    name = type(error).__name__ if error is not None else ''
+    text = str(error).lower()
+    if 'timeout' in name.lower() or 'timed out' in text:
+        return 'timeout'
+    if 'reset' in text or 'connection' in name.lower() or 'chunkedencoding' in name.lower():
+        return 'connection'
+    return 'other'
@@ -0,0 +1,218 @@
+# metrics_store.py - Append-only, queryable history of download runs (SQLite)
+
+import json
+import math
+import os
+import sqlite3
+import threading
+import time
+
+from config import METRICS_DB_PATH
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    timestamp REAL NOT NULL,
+    url TEXT NOT NULL,
+    host TEXT NOT NULL,
+    mode TEXT NOT NULL,
+    result TEXT NOT NULL,
+    num_streams INTEGER NOT NULL,
+    file_size INTEGER NOT NULL,
+    total_seconds REAL,
+    throughput_MBps REAL,
+    ttfb_seconds REAL,
+    retries INTEGER NOT NULL DEFAULT 0,
+    refetched_bytes INTEGER NOT NULL DEFAULT 0,
+    recovery_seconds REAL NOT NULL DEFAULT 0,
+    transport TEXT NOT NULL DEFAULT 'http1',
+    segments TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_runs_host_streams ON runs (host, mode, num_streams);
+CREATE INDEX IF NOT EXISTS idx_runs_timestamp ON runs (timestamp);
+"""
+
+RUN_COLUMNS = ('timestamp', 'url', 'host', 'mode', 'result', 'num_streams', 'file_size',
+               'total_seconds', 'throughput_MBps', 'ttfb_seconds', 'retries',
+               'refetched_bytes', 'recovery_seconds', 'transport', 'segments')
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers (None if empty)."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100.0 * len(ordered)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+class MetricsStore:
+    """
+    Every finished download (multi or single, completed or not) is appended
+    as one row, so concurrent and consecutive runs never overwrite each other.
+    """
+
+    def __init__(self, path=METRICS_DB_PATH):
+        self.path = path
+        self.lock = threading.RLock()
+        self.initialized = False
+
+    def connect(self):
+        if not self.initialized:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=10)
+        conn.row_factory = sqlite3.Row
+        if not self.initialized:
+            with self.lock:
+                conn.execute('PRAGMA journal_mode=WAL')
+                conn.executescript(SCHEMA)
+                # Databases created before the transport column existed
+                columns = {row['name'] for row in conn.execute('PRAGMA table_info(runs)')}
+                if 'transport' not in columns:
+                    conn.execute("ALTER TABLE runs ADD COLUMN transport TEXT NOT NULL DEFAULT 'http1'")
+                    conn.commit()
+                self.initialized = True
+        return conn
+
+    def record_run(self, run):
+        """Append one run. `run` is a dict with the RUN_COLUMNS keys."""
+        row = dict(run)
+        row.setdefault('timestamp', time.time())
+        for column in ('retries', 'refetched_bytes', 'recovery_seconds'):
+            row.setdefault(column, 0)
+        row.setdefault('transport', 'http1')
+        if not isinstance(row.get('segments'), (str, type(None))):
+            row['segments'] = json.dumps(row['segments'], separators=(',', ':'))
+        values = [row.get(column) for column in RUN_COLUMNS]
+        with self.lock:
+            conn = self.connect()
+            try:
+                with conn:
+                    conn.execute(
+                        f"INSERT INTO runs ({', '.join(RUN_COLUMNS)}) "
+                        f"VALUES ({', '.join('?' for _ in RUN_COLUMNS)})",
+                        values
+                    )
+            finally:
+                conn.close()
+
+    def query_runs(self, host=None, mode=None, num_streams=None, result='completed',
+                   since=None, limit=None, transport=None):
+        """Runs matching the filters, newest first."""
+        clauses, params = [], []
+        for column, value in (('host', host), ('mode', mode), ('num_streams', num_streams),
+                              ('result', result), ('transport', transport)):
+            if value is not None:
+                clauses.append(f"{column} = ?")
+                params.append(value)
+        if since is not None:
+            clauses.append("timestamp >= ?")
+            params.append(since)
+        sql = "SELECT * FROM runs"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY timestamp DESC"
+        if limit:
+            sql += " LIMIT ?"
+            params.append(int(limit))
+
+        conn = self.connect()
+        try:
+            rows = [dict(row) for row in conn.execute(sql, params)]
+        finally:
+            conn.close()
+        for row in rows:
+            row['segments'] = json.loads(row['segments']) if row['segments'] else []
+        return rows
+
+    def throughput_by_host_and_streams(self, host=None, since=None):
+        """p50/p95/mean throughput of completed runs grouped by host, mode, transport and stream count."""
+        clauses, params = ["result = 'completed'", "throughput_MBps IS NOT NULL"], []
+        if host is not None:
+            clauses.append("host = ?")
+            params.append(host)
+        if since is not None:
+            clauses.append("timestamp >= ?")
+            params.append(since)
+
+        conn = self.connect()
+        try:
+            rows = conn.execute(
+                "SELECT host, mode, transport, num_streams, throughput_MBps FROM runs WHERE "
+                + " AND ".join(clauses) + " ORDER BY host, mode, transport, num_streams",
+                params
+            ).fetchall()
+        finally:
+            conn.close()
+
+        groups = {}
+        for row in rows:
+            key = (row['host'], row['mode'], row['transport'], row['num_streams'])
+            groups.setdefault(key, []).append(row['throughput_MBps'])
+
+        return [
+            {
+                'host': host_name,
+                'mode': mode,
+                'transport': transport,
+                'num_streams': streams,
+                'runs': len(values),
+                'p50_MBps': percentile(values, 50),
+                'p95_MBps': percentile(values, 95),
+                'mean_MBps': sum(values) / len(values)
+            }
+            for (host_name, mode, transport, streams), values in groups.items()
+        ]
+
+    def single_vs_multi(self, host=None, since=None):
+        """
+        Per host: median single-stream throughput against the best multi-stream
+        configuration, answering "is multi-stream worth it for this host?".
+        """
+        by_host = {}
+        for group in self.throughput_by_host_and_streams(host, since):
+            by_host.setdefault(group['host'], []).append(group)
+
+        comparison = []
+        for host_name, groups in by_host.items():
+            single = [g for g in groups if g['mode'] == 'single']
+            multi = [g for g in groups if g['mode'] == 'multi' and g['transport'] == 'http1']
+            single_p50 = single[0]['p50_MBps'] if single else None
+            best = max(multi, key=lambda g: g['p50_MBps']) if multi else None
+            comparison.append({
+                'host': host_name,
+                'single_p50_MBps': single_p50,
+                'single_runs': single[0]['runs'] if single else 0,
+                'best_multi_streams': best['num_streams'] if best else None,
+                'best_multi_p50_MBps': best['p50_MBps'] if best else None,
+                'multi_runs': sum(g['runs'] for g in multi),
+                'speedup': (best['p50_MBps'] / single_p50) if best and single_p50 else None
+            })
+        return comparison
+
+    def http1_vs_http2(self, host=None, since=None):
+        """
+        Per host and stream count: median throughput of connection-per-stream
+        HTTP/1.1 against the same streams multiplexed over HTTP/2.
+        """
+        cells = {}
+        for group in self.throughput_by_host_and_streams(host, since):
+            if group['mode'] == 'multi':
+                cells.setdefault((group['host'], group['num_streams']), {})[group['transport']] = group
+
+        comparison = []
+        for (host_name, streams), by_transport in sorted(cells.items()):
+            http1, http2 = by_transport.get('http1'), by_transport.get('http2')
+            comparison.append({
+                'host': host_name,
+                'num_streams': streams,
+                'http1_p50_MBps': http1['p50_MBps'] if http1 else None,
+                'http1_runs': http1['runs'] if http1 else 0,
+                'http2_p50_MBps': http2['p50_MBps'] if http2 else None,
+                'http2_runs': http2['runs'] if http2 else 0,
+                'speedup': (http2['p50_MBps'] / http1['p50_MBps']) if http1 and http2 else None
+            })
+        return comparison
+
+
+metrics_store = MetricsStore()
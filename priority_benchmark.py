@@ -0,0 +1,136 @@
+# priority_benchmark.py - How close an urgent download gets to line rate while background jobs run
+
+import argparse
+import contextlib
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+from benchmark import get_commit, private_history, sha256_file
+from config import SCHEDULER_MIN_STREAMS
+from throttled_server import ThrottledOrigin, parse_size
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_RESULTS_FILE = os.path.join(REPO_DIR, 'priority_results.jsonl')
+
+
+def run_case(name, args):
+    """
+    Start `background` low-priority downloads, wait until they have the link,
+    then start one urgent download and time it. In the 'fair' case every job
+    is 'normal', which is how all jobs were treated before priorities.
+    """
+    from downloader import MultiStreamDownloader
+    from scheduler import StreamScheduler
+
+    origin = ThrottledOrigin(
+        bandwidth=parse_size(args.bandwidth),
+        link_bandwidth=parse_size(args.link),
+        latency=args.latency,
+        seed=args.seed
+    ).start()
+    scheduler = StreamScheduler(total_streams=args.total_streams, min_streams=args.min_streams)
+    low, high = ('normal', 'normal') if name == 'fair' else ('low', 'high')
+    try:
+        with tempfile.TemporaryDirectory(prefix='msd_priority_') as workdir, \
+                open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            background = []
+            for i in range(args.background):
+                downloader = MultiStreamDownloader(origin.url_for(args.background_size, f"background_{i}.bin"),
+                                                   num_streams=args.streams)
+                scheduler.add(downloader, low)
+                thread = threading.Thread(
+                    target=downloader.download, args=(os.path.join(workdir, f"background_{i}.bin"),), daemon=True
+                )
+                thread.start()
+                background.append((downloader, thread))
+            time.sleep(args.warmup)
+
+            urgent = MultiStreamDownloader(origin.url_for(args.size, 'urgent.bin'), num_streams=args.streams)
+            scheduler.add(urgent, high)
+            start = time.time()
+            result = urgent.download(os.path.join(workdir, 'urgent.bin'))
+            urgent_seconds = time.time() - start
+            scheduler.remove(urgent)
+            correct = bool(result) and sha256_file(result) == origin.content.sha256(args.size)
+
+            # The background jobs should be back to their full stream count
+            scheduler.rebalance()
+            restored = all(downloader.stream_limit is None for downloader, _ in background)
+            background_mb = sum(downloader.downloaded_bytes for downloader, _ in background) / (1024 * 1024)
+            for downloader, thread in background:
+                downloader.cancel()
+                scheduler.remove(downloader)
+            for downloader, thread in background:
+                thread.join()
+
+        link = parse_size(args.link)
+        throughput = args.size / urgent_seconds
+        return {
+            'commit': get_commit(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'case': name,
+            'background_jobs': args.background,
+            'streams_per_job': args.streams,
+            'total_streams': args.total_streams,
+            'min_streams': args.min_streams,
+            'urgent_size': args.size,
+            'urgent_seconds': urgent_seconds,
+            'urgent_MBps': throughput / (1024 * 1024),
+            'line_rate_fraction': throughput / link if link else None,
+            'background_mb_at_end': background_mb,
+            'background_restored': restored,
+            'correct': correct,
+            'origin': origin.settings()
+        }
+    finally:
+        origin.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Urgent download time on a link shared with background jobs")
+    parser.add_argument('--size', default='64M', help="Size of the urgent download")
+    parser.add_argument('--background', type=int, default=3, help="Background downloads")
+    parser.add_argument('--background-size', default='1G', help="Size of each background download")
+    parser.add_argument('--streams', type=int, default=8, help="Streams each download asks for")
+    parser.add_argument('--total-streams', type=int, default=32, help="Scheduler stream budget")
+    parser.add_argument('--min-streams', type=int, default=SCHEDULER_MIN_STREAMS,
+                        help="Streams a lower-priority job keeps (0 = hold it while urgent jobs run)")
+    parser.add_argument('--link', default='40M', help="Link capacity shared by all connections (bytes/s)")
+    parser.add_argument('--bandwidth', default='5M', help="Per-connection cap in bytes/s")
+    parser.add_argument('--latency', type=float, default=0.02, help="Seconds added per response")
+    parser.add_argument('--warmup', type=float, default=2.0, help="Seconds the background jobs run first")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=DEFAULT_RESULTS_FILE, help="JSON-lines results file")
+    args = parser.parse_args()
+    args.size = parse_size(args.size)
+    args.background_size = parse_size(args.background_size)
+
+    print(f"Priority benchmark: {args.size / (1024 * 1024):.0f} MB urgent download, "
+          f"{args.background} background jobs, link {args.link}B/s")
+    print(f"  {'Case':<10} {'Time (s)':<10} {'MB/s':<8} {'Line rate':<10} {'Restored':<9} {'Correct':<8}")
+    print(f"  {'-'*58}")
+
+    results = []
+    with private_history():
+        for name in ('fair', 'priority'):
+            record = run_case(name, args)
+            results.append(record)
+            fraction = record['line_rate_fraction']
+            print(f"  {name:<10} {record['urgent_seconds']:<10.2f} {record['urgent_MBps']:<8.2f} "
+                  f"{f'{fraction:.0%}' if fraction else '-':<10} {'yes' if record['background_restored'] else 'NO':<9} "
+                  f"{'yes' if record['correct'] else 'NO':<8}")
+
+    with open(args.output, 'a') as f:
+        for record in results:
+            f.write(json.dumps(record) + '\n')
+    print(f"\nResults appended to: {args.output}")
+
+    return 0 if all(r['correct'] for r in results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
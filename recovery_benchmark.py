@@ -0,0 +1,133 @@
+# recovery_benchmark.py - Measure retry/recovery cost against a fault-injecting local origin
+
+import argparse
+import contextlib
+import json
+import os
+import sys
+import tempfile
+import time
+
+from benchmark import get_commit, private_history, sha256_file
+from config import READ_TIMEOUT
+from throttled_server import FaultSchedule, ThrottledOrigin, parse_size
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_RESULTS_FILE = os.path.join(REPO_DIR, 'recovery_results.jsonl')
+
+# Fault mixes exercised by default; rates are per faultable request
+SCENARIOS = {
+    'baseline': {},
+    'resets': {'reset_rate': 0.3},
+    'stalls': {'stall_rate': 0.15, 'max_faults': 2},
+    'unavailable': {'unavailable_rate': 0.3},
+    'ignore_range': {'ignore_range_rate': 0.2, 'max_faults': 1},
+    'mixed': {'reset_rate': 0.1, 'stall_rate': 0.05, 'unavailable_rate': 0.1, 'max_faults': 4}
+}
+
+
+def run_scenario(name, fault_settings, args, workdir):
+    """Download one file through a faulty origin and report what recovery cost."""
+    from downloader import MultiStreamDownloader
+
+    faults = None
+    if fault_settings:
+        faults = FaultSchedule(
+            seed=args.seed,
+            stall_seconds=READ_TIMEOUT + 5,
+            retry_after=args.retry_after,
+            **fault_settings
+        )
+    origin = ThrottledOrigin(
+        bandwidth=parse_size(args.bandwidth),
+        latency=args.latency,
+        seed=args.seed,
+        faults=faults
+    ).start()
+
+    try:
+        url = origin.url_for(args.size)
+        output = os.path.join(workdir, f"{name}.bin")
+        downloader = MultiStreamDownloader(url, num_streams=args.streams)
+
+        wall_start = time.time()
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            result = downloader.download(output)
+        wall_seconds = time.time() - wall_start
+
+        correct = bool(result) and sha256_file(result) == origin.content.sha256(args.size)
+        return {
+            'commit': get_commit(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'scenario': name,
+            'size': args.size,
+            'streams': args.streams,
+            'correct': correct,
+            'wall_seconds': wall_seconds,
+            'retries': downloader.retry_count,
+            'refetched_bytes': downloader.refetched_bytes,
+            'recovery_seconds': downloader.recovery_seconds,
+            'hedges': len(downloader.hedges),
+            'duplicate_bytes': downloader.duplicate_bytes,
+            # Server-side view: every byte beyond the file size was sent twice
+            'origin_bytes_sent': origin.bytes_sent,
+            'overfetch_ratio': origin.bytes_sent / args.size if args.size else 0,
+            'faults_injected': dict(faults.injected) if faults else {},
+            'origin': origin.settings()
+        }
+    finally:
+        origin.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recovery cost under injected faults")
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS),
+                        help=f"Comma-separated subset of: {', '.join(SCENARIOS)}")
+    parser.add_argument('--size', default='16M')
+    parser.add_argument('--streams', type=int, default=8)
+    parser.add_argument('--bandwidth', default='8M', help="Per-connection cap in bytes/s")
+    parser.add_argument('--latency', type=float, default=0.02)
+    parser.add_argument('--retry-after', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=DEFAULT_RESULTS_FILE, help="JSON-lines results file")
+    args = parser.parse_args()
+    args.size = parse_size(args.size)
+
+    names = [n.strip() for n in args.scenarios.split(',') if n.strip()]
+    unknown = [n for n in names if n not in SCENARIOS]
+    if unknown:
+        parser.error(f"Unknown scenario(s): {', '.join(unknown)}")
+
+    print(f"Recovery benchmark: {args.size / (1024*1024):.1f} MB, {args.streams} streams, seed {args.seed}")
+    print(f"  {'Scenario':<14} {'Time (s)':<9} {'Lost (s)':<9} {'Retries':<8} "
+          f"{'Re-fetched (MB)':<16} {'Overfetch':<10} {'Correct':<8}")
+    print(f"  {'-'*78}")
+
+    results = []
+    baseline_time = None
+    with tempfile.TemporaryDirectory(prefix='msd_recovery_') as workdir, private_history():
+        for name in names:
+            record = run_scenario(name, SCENARIOS[name], args, workdir)
+            if name == 'baseline':
+                baseline_time = record['wall_seconds']
+            record['time_lost_seconds'] = (record['wall_seconds'] - baseline_time
+                                           if baseline_time is not None else None)
+            results.append(record)
+
+            lost = record['time_lost_seconds']
+            print(f"  {name:<14} {record['wall_seconds']:<9.2f} "
+                  f"{format(lost, '<9.2f') if lost is not None else 'n/a':<9} "
+                  f"{record['retries']:<8} {record['refetched_bytes'] / (1024*1024):<16.2f} "
+                  f"{record['overfetch_ratio']:<10.2f} {'yes' if record['correct'] else 'NO':<8}")
+
+    with open(args.output, 'a') as f:
+        for record in results:
+            f.write(json.dumps(record) + '\n')
+    print(f"\nResults appended to: {args.output}")
+
+    # Non-zero exit when any scenario produced a wrong file
+    return 0 if all(r['correct'] for r in results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
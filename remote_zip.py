@@ -0,0 +1,189 @@
+# remote_zip.py - List and extract members of a remote .zip using range requests only
+
+import bisect
+import io
+import os
+import shutil
+import zipfile
+
+from config import REMOTE_ZIP_TAIL
+from downloader import MultiStreamDownloader
+
+
+class RemoteZipError(Exception):
+    """The archive couldn't be read: not a zip, or its ranges couldn't be fetched."""
+
+
+class RangeFile(io.RawIOBase):
+    """
+    Read-only, seekable view of a remote file of which only some byte ranges
+    are held in memory (see add). Reads outside them fetch the missing bytes
+    with another range request, so zipfile can read the archive through it
+    without knowing it's remote.
+    """
+
+    def __init__(self, downloader, size):
+        super().__init__()
+        self.downloader = downloader
+        self.size = size
+        self.position = 0
+        self.starts = []  # Sorted start offsets of the blocks
+        self.blocks = []  # Bytes held from each of those offsets
+
+    def add(self, start, data):
+        i = bisect.bisect_left(self.starts, start)
+        self.starts.insert(i, start)
+        self.blocks.insert(i, data)
+
+    def holds(self, start, end):
+        """True if bytes start..end are all in one block."""
+        i = bisect.bisect_right(self.starts, start) - 1
+        return i >= 0 and end < self.starts[i] + len(self.blocks[i])
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += self.size
+        if offset < 0:
+            raise ValueError("Negative seek position")
+        self.position = offset
+        return self.position
+
+    def readinto(self, buffer):
+        view = memoryview(buffer).cast('B')
+        wanted = min(len(view), max(0, self.size - self.position))
+        copied = 0
+        while copied < wanted:
+            position = self.position + copied
+            i = bisect.bisect_right(self.starts, position) - 1
+            if i >= 0 and position < self.starts[i] + len(self.blocks[i]):
+                block = self.blocks[i]
+                offset = position - self.starts[i]
+                n = min(wanted - copied, len(block) - offset)
+                view[copied:copied + n] = block[offset:offset + n]
+                copied += n
+                continue
+            # Not held: fetch up to the next block (or what's left of the read)
+            end = self.position + wanted
+            if i + 1 < len(self.starts):
+                end = min(end, self.starts[i + 1])
+            data = self.downloader.fetch_ranges([(position, end - 1)])
+            if data is None:
+                raise OSError(f"Could not fetch bytes {position}-{end - 1}: {self.downloader.failure}")
+            self.add(position, data[0])
+        self.position += copied
+        return copied
+
+
+class RemoteZip:
+    """
+    A .zip on a server with range support. Reads its end record and central
+    directory from the tail of the file, then fetches only the members asked
+    for (each from its local header to where the next entry starts), on
+    several streams at once. zipfile does the parsing, decompression and CRC
+    checks on the bytes held in memory.
+    """
+
+    def __init__(self, url, num_streams=None):
+        self.url = url
+        self.downloader = MultiStreamDownloader(url, num_streams=num_streams)
+        tail = self.downloader.fetch_ranges([(-REMOTE_ZIP_TAIL, None)])
+        if tail is None:
+            raise RemoteZipError(f"Could not read {url}: {self.downloader.failure}")
+        size = self.downloader.file_size
+        self.file = RangeFile(self.downloader, size)
+        self.file.add(size - len(tail[0]), tail[0])
+        try:
+            self.zip = zipfile.ZipFile(self.file)
+        except (zipfile.BadZipFile, OSError) as e:
+            raise RemoteZipError(f"Not a readable zip archive: {str(e)}")
+
+    @property
+    def filename(self):
+        return self.downloader.filename
+
+    def members(self):
+        """Name, sizes and compression of every member, in archive order."""
+        return [
+            {
+                'name': info.filename,
+                'size': info.file_size,
+                'compressed_size': info.compress_size,
+                'compress_type': info.compress_type,
+                'crc': info.CRC,
+                'is_dir': info.is_dir()
+            }
+            for info in self.zip.infolist()
+        ]
+
+    def fetch_members(self, infos):
+        """Fetch the local header and data of each member into memory, in one fetch_ranges call."""
+        # An entry ends where the next one (or the central directory) starts
+        boundaries = sorted({info.header_offset for info in self.zip.infolist()} | {self.zip.start_dir})
+        spans = []
+        for info in infos:
+            end = boundaries[bisect.bisect_right(boundaries, info.header_offset)]
+            spans.append((info.header_offset, end - 1))
+        spans = [span for span in spans if span[1] >= span[0] and not self.file.holds(*span)]
+        if not spans:
+            return  # All in the tail read already
+        data = self.downloader.fetch_ranges(spans)
+        if data is None:
+            raise RemoteZipError(f"Could not fetch the members: {self.downloader.failure}")
+        for (start, _), block in zip(spans, data):
+            self.file.add(start, block)
+
+    def extract(self, names, output_dir, flatten=False):
+        """
+        Extract the members called `names` into output_dir. Paths inside the
+        archive are kept (made safe by zipfile) unless `flatten`, which
+        writes each file under its base name and skips directories; a name
+        already taken in output_dir gets a number (name_1.ext, ...).
+        Returns the paths written. Raises ValueError for unknown names, or
+        (with flatten) two members with the same base name or a base name
+        starting with a dot.
+        """
+        infos = []
+        for name in names:
+            try:
+                infos.append(self.zip.getinfo(name))
+            except KeyError:
+                raise ValueError(f"No member named {name!r} in the archive")
+        if flatten:
+            infos = [info for info in infos if not info.is_dir()]
+            basenames = [os.path.basename(info.filename) for info in infos]
+            if len(set(basenames)) < len(basenames):
+                raise ValueError("Members with the same file name can't be extracted into one folder")
+            for info, basename in zip(infos, basenames):
+                if basename.startswith('.'):
+                    raise ValueError(f"Member {info.filename!r} has a hidden file name")
+
+        self.fetch_members(infos)
+        os.makedirs(output_dir, exist_ok=True)
+        paths = []
+        for info in infos:
+            if not flatten:
+                paths.append(self.zip.extract(info, output_dir))
+                continue
+            path = os.path.join(output_dir, os.path.basename(info.filename))
+            base, ext = os.path.splitext(path)
+            counter = 1
+            while os.path.exists(path):
+                path = f"{base}_{counter}{ext}"
+                counter += 1
+            with self.zip.open(info) as source, open(path, 'wb') as target:
+                shutil.copyfileobj(source, target)
+            paths.append(path)
+        print(f"Extracted {len(paths)} of {len(self.zip.infolist())} members "
+              f"({self.downloader.downloaded_bytes:,} of {self.downloader.file_size:,} bytes downloaded)")
+        return paths
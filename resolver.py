@@ -0,0 +1,224 @@
+# resolver.py - Shared DNS cache and per-stream address pinning for HTTP/1.1 connections
+
+import socket
+import threading
+import time
+from contextlib import contextmanager
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import NameResolutionError
+
+from config import (
+    DNS_CACHE_TTL, DNS_MAX_FAILURES, DNS_PENALTY_SECONDS, DNS_SLOW_FRACTION
+)
+from tracing import current_span
+
+_local = threading.local()
+
+
+class DNSCache:
+    """
+    Resolved addresses per host, shared by every download in the process.
+
+    getaddrinfo doesn't expose record TTLs, so entries live for DNS_CACHE_TTL.
+    The cache also keeps a health record per address: addresses that keep
+    failing, or deliver far less than the best address of the same host, are
+    left out of pick() for DNS_PENALTY_SECONDS.
+    """
+
+    def __init__(self, ttl=DNS_CACHE_TTL):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = {}  # host -> (expires, [addresses])
+        self.host_locks = {}
+        self.health = {}  # (host, address) -> {'speed', 'failures', 'penalized_until'}
+        self.lookups = 0  # Real getaddrinfo calls, for metrics
+
+    def host_lock(self, host):
+        with self.lock:
+            return self.host_locks.setdefault(host, threading.Lock())
+
+    def resolve(self, host):
+        """All addresses of `host` (A and AAAA). Returns (addresses, from_cache)."""
+        entry = self.entries.get(host)
+        if entry and entry[0] > time.time():
+            return entry[1], True
+        # One lookup per host even when many streams start at once
+        with self.host_lock(host):
+            entry = self.entries.get(host)
+            if entry and entry[0] > time.time():
+                return entry[1], True
+            addresses = []
+            for info in socket.getaddrinfo(host, None, 0, socket.SOCK_STREAM):
+                address = info[4][0]
+                if address not in addresses:
+                    addresses.append(address)
+            self.entries[host] = (time.time() + self.ttl, addresses)
+            self.lookups += 1
+            return addresses, False
+
+    def invalidate(self, host):
+        self.entries.pop(host, None)
+
+    def healthy(self, host):
+        """Addresses not currently penalized (all of them if every one is)."""
+        addresses, _ = self.resolve(host)
+        now = time.time()
+        good = [a for a in addresses
+                if self.health.get((host, a), {}).get('penalized_until', 0) <= now]
+        return good or addresses
+
+    def pick(self, host, index, exclude=None):
+        """Address for stream `index`: round robin over the healthy addresses."""
+        candidates = self.healthy(host)
+        if exclude is not None and len(candidates) > 1:
+            candidates = [a for a in candidates if a != exclude]
+        return candidates[index % len(candidates)]
+
+    def health_record(self, host, address):
+        return self.health.setdefault((host, address), {'speed': None, 'failures': 0, 'penalized_until': 0})
+
+    def report_success(self, host, address, speed):
+        """Fold a finished stream's speed (MB/s) into the address's record."""
+        if address is None:
+            return
+        with self.lock:
+            record = self.health_record(host, address)
+            record['failures'] = 0
+            record['speed'] = speed if record['speed'] is None else 0.5 * speed + 0.5 * record['speed']
+            speeds = [r['speed'] for (h, _), r in self.health.items() if h == host and r['speed']]
+            if len(speeds) > 1 and record['speed'] < DNS_SLOW_FRACTION * max(speeds):
+                record['penalized_until'] = time.time() + DNS_PENALTY_SECONDS
+                print(f"DNS: {address} is slow for {host}, avoiding it for {DNS_PENALTY_SECONDS}s")
+
+    def report_failure(self, host, address):
+        if address is None:
+            return
+        with self.lock:
+            record = self.health_record(host, address)
+            record['failures'] += 1
+            if record['failures'] >= DNS_MAX_FAILURES:
+                record['failures'] = 0
+                record['penalized_until'] = time.time() + DNS_PENALTY_SECONDS
+                print(f"DNS: {address} keeps failing for {host}, avoiding it for {DNS_PENALTY_SECONDS}s")
+
+    def address_for(self, host):
+        """Address to connect to: the one pinned on this thread, else the first cached one."""
+        pins = getattr(_local, 'pins', None)
+        if pins and host in pins:
+            return pins[host], True
+        addresses, cached = self.resolve(host)
+        return addresses[0], cached
+
+
+dns_cache = DNSCache()
+
+
+@contextmanager
+def pinned(host, address):
+    """New connections to `host` made on this thread go to `address`."""
+    pins = getattr(_local, 'pins', None)
+    if pins is None:
+        pins = _local.pins = {}
+    previous = pins.get(host)
+    if address is not None:
+        pins[host] = address
+    try:
+        yield
+    finally:
+        if previous is None:
+            pins.pop(host, None)
+        else:
+            pins[host] = previous
+
+
+# --- Connections ---------------------------------------------------------------
+# urllib3 connects lazily inside session.get(). These subclasses connect to the
+# cached (or pinned) address while self.host stays the hostname, so the Host
+# header, SNI and certificate checks are unchanged. When a tracing span is
+# current they also record dns/connect/tls spans under it.
+
+class ResolvingConnectionMixin:
+    tcp_done = None
+
+    def resolve_address(self):
+        try:
+            self._dns_host, cached = dns_cache.address_for(self.host)
+        except socket.gaierror as e:
+            raise NameResolutionError(self.host, self, e) from e
+        return cached
+
+    def _new_conn(self):
+        span = current_span()
+        if span is None:
+            self.resolve_address()
+            return super()._new_conn()
+        with span.child('dns', host=self.host) as dns_span:
+            cached = self.resolve_address()
+            dns_span.set(address=self._dns_host, cached=cached)
+        with span.child('connect', address=self._dns_host, port=self.port):
+            sock = super()._new_conn()
+        self.tcp_done = time.time()
+        return sock
+
+
+class ResolvingHTTPConnection(ResolvingConnectionMixin, HTTPConnection):
+    pass
+
+
+class ResolvingHTTPSConnection(ResolvingConnectionMixin, HTTPSConnection):
+    def connect(self):
+        self.tcp_done = None
+        super().connect()
+        span = current_span()
+        if span is not None and self.tcp_done is not None:
+            span.trace.record('tls', self.tcp_done, time.time(), parent=span)
+
+
+class ResolvingHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = ResolvingHTTPConnection
+
+
+class ResolvingHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = ResolvingHTTPSConnection
+
+
+class ResolvingAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': ResolvingHTTPConnectionPool,
+            'https': ResolvingHTTPSConnectionPool
+        }
+
+
+def http_session(**adapter_args):
+    """
+    requests.Session whose connections use the shared DNS cache and pins.
+    `adapter_args` go to the HTTPAdapter (e.g. pool_maxsize, pool_block).
+    """
+    session = requests.Session()
+    adapter = ResolvingAdapter(**adapter_args)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def abort_response(response):
+    """
+    Cut off a streaming response from another thread. Shutting the socket down
+    wakes a reader blocked in iter_content (close() alone may not).
+    """
+    if hasattr(response, 'abort'):
+        response.abort()  # HTTP/2 stream: reset it, the connection is shared
+        return
+    try:
+        connection = getattr(response.raw, '_connection', None)
+        sock = getattr(connection, 'sock', None)
+        if sock is not None:
+            sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
@@ -0,0 +1,204 @@
+# retry_policy.py - Which failed requests to retry, how long to back off, and per-host circuit breaking
+
+import collections
+import email.utils
+import random
+import threading
+import time
+
+import requests
+
+from config import (
+    CIRCUIT_COOLDOWN, CIRCUIT_FAILURES, CIRCUIT_MAX_COOLDOWN, CIRCUIT_RECOVERY_INTERVAL, CIRCUIT_WINDOW,
+    MAX_RETRIES, MAX_STREAMS, RETRY_AFTER_MAX, RETRY_DELAY, RETRY_MAX_DELAY, RETRY_STATUS_CODES
+)
+from metrics import CIRCUIT_TRIPS
+
+
+class RequestFailed(Exception):
+    """A response the downloaders can't use: an error status, or the whole file for a range request."""
+
+    def __init__(self, message, status_code=None, retry_after=None, fatal=False):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+        self.fatal = fatal
+
+
+def parse_retry_after(value):
+    """Seconds to wait from a Retry-After header (delta-seconds or HTTP-date), None if absent or invalid."""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, when.timestamp() - time.time())
+
+
+def check_response(response, offset=None):
+    """
+    Raise RequestFailed unless `response` can be used.
+    `offset` is the first byte requested with Range (None = not a range request).
+    A 200 is only accepted from the start of the file: anywhere else the server
+    ignored Range, and its body would be written at the wrong place. That is
+    retried (the probe already saw the server honour Range, so it's a glitch
+    of one server or cache on the way).
+    """
+    code = response.status_code
+    if code == 206 and offset is not None:
+        return
+    if code == 200 and not offset:
+        return
+    if code == 200:
+        raise RequestFailed(f"Server ignored Range (200 for bytes {offset}-)", code)
+    if code == 206:
+        raise RequestFailed("Server sent 206 for a request without Range", code, fatal=True)
+    retry_after = parse_retry_after(response.headers.get('Retry-After'))
+    raise RequestFailed(f"Bad status code {code}", code, retry_after, fatal=code not in RETRY_STATUS_CODES)
+
+
+def is_fatal(error):
+    """True for failures a retry can't fix: 4xx statuses, bad URLs, local disk errors."""
+    if isinstance(error, RequestFailed):
+        return error.fatal
+    if isinstance(error, (requests.exceptions.InvalidURL, requests.exceptions.InvalidSchema,
+                          requests.exceptions.MissingSchema, requests.exceptions.TooManyRedirects)):
+        return True
+    if isinstance(error, requests.exceptions.RequestException):
+        return False  # Connection errors, timeouts, truncated bodies
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return False
+    # Any other OSError comes from the disk (full, permissions, write-back failure)
+    return isinstance(error, OSError)
+
+
+class RetryPolicy:
+    """
+    Classified retries: fatal errors fail at once, transient ones back off
+    exponentially from `base_delay` up to `max_delay`, with jitter so streams
+    that failed together don't retry together. A Retry-After from the server
+    is a lower bound on the wait; one longer than `max_retry_after` gives up.
+    """
+
+    def __init__(self, max_attempts=MAX_RETRIES, base_delay=RETRY_DELAY, max_delay=RETRY_MAX_DELAY,
+                 max_retry_after=RETRY_AFTER_MAX):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_retry_after = max_retry_after
+
+    def backoff(self, failures):
+        """Jittered delay after `failures` failures in a row: between half and all of base * 2^(n-1)."""
+        ceiling = min(self.max_delay, self.base_delay * 2 ** (failures - 1))
+        return random.uniform(ceiling / 2, ceiling)
+
+    def next_delay(self, error, failures):
+        """
+        Seconds to wait before retrying after `error`, the `failures`-th in a row.
+        Returns (delay, None), or (None, reason) when it isn't worth retrying.
+        """
+        if is_fatal(error):
+            return None, "not retryable"
+        if failures >= self.max_attempts:
+            return None, f"failed {failures} times in a row"
+        delay = self.backoff(failures)
+        retry_after = getattr(error, 'retry_after', None)
+        if retry_after is not None:
+            if retry_after > self.max_retry_after:
+                return None, f"server asked to wait {retry_after:.0f}s"
+            delay = max(delay, retry_after)
+        return delay, None
+
+
+class CircuitBreaker:
+    """
+    Failure tracking per host, shared by every download in the process.
+
+    When a host fails CIRCUIT_FAILURES transient requests within
+    CIRCUIT_WINDOW seconds, its circuit opens: requests to it wait out a
+    cooldown (doubling each time it trips again) and the host gets a stream
+    cap of half the streams that were running, which downloads apply by
+    shedding streams. Once the cooldown is over requests go through again;
+    every CIRCUIT_RECOVERY_INTERVAL without a failure raises the cap by one
+    until it is lifted.
+    """
+
+    def __init__(self, failures=CIRCUIT_FAILURES, window=CIRCUIT_WINDOW, cooldown=CIRCUIT_COOLDOWN,
+                 max_cooldown=CIRCUIT_MAX_COOLDOWN, recovery_interval=CIRCUIT_RECOVERY_INTERVAL):
+        self.failures = failures
+        self.window = window
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.recovery_interval = recovery_interval
+        self.lock = threading.Lock()
+        self.hosts = {}  # host -> {'failures', 'open_until', 'cooldown', 'cap', 'calm_since', 'trips'}
+
+    def host_record(self, host):
+        return self.hosts.setdefault(host, {
+            'failures': collections.deque(), 'open_until': 0, 'cooldown': 0,
+            'cap': None, 'calm_since': 0, 'trips': 0
+        })
+
+    def report_failure(self, host, streams):
+        """Count a transient failure; `streams` is how many the reporting download has running."""
+        with self.lock:
+            record = self.host_record(host)
+            now = time.time()
+            failures = record['failures']
+            failures.append(now)
+            while failures and failures[0] < now - self.window:
+                failures.popleft()
+            record['calm_since'] = max(now, record['open_until'])
+            if len(failures) < self.failures or now < record['open_until']:
+                return
+            # Trip: hold the host off and halve its streams
+            failures.clear()
+            record['cooldown'] = min(self.max_cooldown, record['cooldown'] * 2 or self.cooldown)
+            record['open_until'] = record['calm_since'] = now + record['cooldown']
+            record['cap'] = max(1, (record['cap'] or max(streams, 1)) // 2)
+            record['trips'] += 1
+            cooldown, cap = record['cooldown'], record['cap']
+        CIRCUIT_TRIPS.labels(host=host).inc()
+        print(f"Circuit: {host} keeps failing, holding requests for {cooldown:.0f}s "
+              f"and capping it at {cap} streams")
+
+    def wait_time(self, host):
+        """Seconds until requests to `host` may go out (0 unless its circuit is open)."""
+        record = self.hosts.get(host)
+        return max(0.0, record['open_until'] - time.time()) if record else 0.0
+
+    def stream_cap(self, host):
+        """Most streams a download may run against `host` right now (None = no cap)."""
+        with self.lock:
+            record = self.hosts.get(host)
+            if record is None or record['cap'] is None:
+                return None
+            grown = int((time.time() - record['calm_since']) // self.recovery_interval)
+            if grown > 0:
+                record['cap'] += grown
+                record['calm_since'] += grown * self.recovery_interval
+                if record['cap'] >= MAX_STREAMS:
+                    record['cap'] = None
+                    record['cooldown'] = 0
+                    print(f"Circuit: {host} has recovered, stream cap lifted")
+            return record['cap']
+
+    def get_status(self):
+        """Per-host state for hosts whose circuit has tripped."""
+        now = time.time()
+        return {
+            host: {
+                'open': record['open_until'] > now,
+                'stream_cap': record['cap'],
+                'trips': record['trips']
+            }
+            for host, record in list(self.hosts.items()) if record['trips']
+        }
+
+
+retry_policy = RetryPolicy()
+circuit_breaker = CircuitBreaker()
@@ -1,5 +1,8 @@
 # run.py - Application entry point
+import os
 from app import app
+from config import DOWNLOAD_FOLDER
 
 if __name__ == '__main__':
+    os.makedirs(DOWNLOAD_FOLDER, exist_ok=True)
     app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
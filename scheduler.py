@@ -0,0 +1,124 @@
+# scheduler.py - Shares a stream budget between running downloads by priority class
+
+import threading
+
+from config import (
+    DEFAULT_PRIORITY, PRIORITY_CLASSES, SCHEDULER_INTERVAL, SCHEDULER_MIN_STREAMS,
+    SCHEDULER_TOTAL_STREAMS
+)
+
+
+class StreamScheduler:
+    """
+    Decides how many streams each running multi-stream download may use.
+
+    Every download gets SCHEDULER_MIN_STREAMS. The highest priority class
+    with a running download shares the rest of the budget, up to the streams
+    each of its downloads wants; lower classes keep only the floor until it
+    is done. Limits are applied mid-transfer with set_stream_limit: a shrunk
+    download parks its surplus streams (handing their remaining ranges back)
+    and gets them back on the next rebalance after the urgent job finishes.
+
+    Rebalances on add/remove and every `interval` seconds while jobs are
+    registered, which also picks up stream counts chosen after the probe
+    and paused downloads (they hold no streams and get no share).
+    """
+
+    def __init__(self, total_streams=SCHEDULER_TOTAL_STREAMS, min_streams=SCHEDULER_MIN_STREAMS,
+                 interval=SCHEDULER_INTERVAL):
+        self.total_streams = total_streams
+        self.min_streams = min_streams
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.jobs = {}  # downloader -> priority
+        self.wakeup = threading.Event()
+        self.thread = None
+
+    def add(self, downloader, priority=DEFAULT_PRIORITY):
+        """Schedule a MultiStreamDownloader (before or after it has started)."""
+        if priority not in PRIORITY_CLASSES:
+            raise ValueError(f"Unknown priority: {priority} (expected one of {', '.join(PRIORITY_CLASSES)})")
+        with self.lock:
+            self.jobs[downloader] = priority
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+        self.rebalance()
+
+    def remove(self, downloader):
+        """Stop scheduling a download (finished, failed or cancelled); others may grow."""
+        with self.lock:
+            self.jobs.pop(downloader, None)
+        self.rebalance()
+
+    def run(self):
+        while True:
+            self.wakeup.wait(self.interval)
+            self.wakeup.clear()
+            with self.lock:
+                if not self.jobs:
+                    self.thread = None
+                    return
+            try:
+                self.rebalance()
+            except Exception as e:
+                print(f"Stream rebalance failed: {str(e)}")
+
+    @staticmethod
+    def wanted_streams(downloader):
+        """Streams a download would use unlimited: one per chunk once planned."""
+        return len(downloader.segments) or downloader.num_streams
+
+    def allocate(self, jobs):
+        """
+        Split the budget. `jobs` is a list of (key, priority, wanted);
+        returns {key: streams}.
+        """
+        allocation = {key: min(wanted, self.min_streams) for key, _, wanted in jobs}
+        left = self.total_streams - sum(allocation.values())
+        for priority in PRIORITY_CLASSES:
+            group = [(key, wanted) for key, job_priority, wanted in jobs if job_priority == priority]
+            if not group:
+                continue
+            # One stream at a time, round robin, so the class shares evenly
+            grew = True
+            while left > 0 and grew:
+                grew = False
+                for key, wanted in group:
+                    if left > 0 and allocation[key] < wanted:
+                        allocation[key] += 1
+                        left -= 1
+                        grew = True
+            break  # Lower classes keep the floor while this class is running
+        return allocation
+
+    def rebalance(self):
+        """Recompute every download's stream limit and apply the ones that changed."""
+        with self.lock:
+            jobs = [(downloader, priority, self.wanted_streams(downloader))
+                    for downloader, priority in self.jobs.items()
+                    if not downloader.paused and not downloader.cancelled]
+        allocation = self.allocate(jobs)
+        for downloader, streams in allocation.items():
+            # No limit at all once a download may use every stream it wants
+            limit = None if streams >= self.wanted_streams(downloader) else streams
+            if downloader.stream_limit != limit:
+                downloader.set_stream_limit(limit)
+
+    def get_status(self):
+        """Current priority, wanted streams and limit of each scheduled download."""
+        with self.lock:
+            jobs = list(self.jobs.items())
+        return [
+            {
+                'url': downloader.url,
+                'priority': priority,
+                'wanted_streams': self.wanted_streams(downloader),
+                'stream_limit': downloader.stream_limit,
+                'paused': downloader.paused
+            }
+            for downloader, priority in jobs
+        ]
+
+
+stream_scheduler = StreamScheduler()
@@ -0,0 +1,112 @@
+# segments.py - Compact per-segment state for a download: one typed array per field
+
+from array import array
+
+
+def zeros(typecode, n):
+    return array(typecode, [0]) * n
+
+
+class SegmentTable:
+    """
+    Offsets, progress, timings, retries and state of a download's segments,
+    stored column-wise in preallocated arrays indexed by segment id (like
+    ThroughputRing), instead of a dict per field. Streams update their own
+    slot in O(1) from the receive loop; readers get snapshots by slicing the
+    columns, which stays cheap with thousands of segments.
+
+    Indexing and iteration give (start, end) pairs, so the table stands in
+    for a list of byte ranges. Times are time.time() values, 0 = not yet.
+    """
+
+    __slots__ = ('starts', 'ends', 'positions', 'bytes', 'started', 'finished', 'speeds',
+                 'retries', 'failures', 'done', 'addresses')
+
+    def __init__(self, ranges=()):
+        ranges = list(ranges)
+        n = len(ranges)
+        self.starts = array('q', (start for start, _ in ranges))
+        self.ends = array('q', (end for _, end in ranges))
+        self.positions = zeros('q', n)  # Bytes of the segment in its part
+        self.bytes = zeros('q', n)  # Bytes delivered, once finished
+        self.started = zeros('d', n)  # First start (kept across resumes)
+        self.finished = zeros('d', n)  # When the segment ended (done or given up)
+        self.speeds = zeros('d', n)  # MB/s over start..finish
+        self.retries = zeros('l', n)
+        self.failures = zeros('l', n)  # In a row, without progress
+        self.done = bytearray(n)  # 1 once the part holds all of the segment
+        self.addresses = [None] * n  # Address the segment's stream connected to
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __getitem__(self, i):
+        return self.starts[i], self.ends[i]
+
+    def __iter__(self):
+        return zip(self.starts, self.ends)
+
+    def size(self, i):
+        return self.ends[i] - self.starts[i] + 1
+
+    def remaining(self, i):
+        return self.size(i) - self.positions[i]
+
+    def ended(self, i):
+        return self.finished[i] > 0
+
+    def waiting(self, running=()):
+        """Segments still to run: not ended and not in `running`."""
+        return [i for i in range(len(self)) if not self.finished[i] and i not in running]
+
+    def finish(self, i, nbytes, now):
+        """Record a segment whose part is complete. Returns its speed in MB/s."""
+        self.finished[i] = now
+        self.bytes[i] = nbytes
+        elapsed = now - self.started[i]
+        self.speeds[i] = (nbytes / (1024 * 1024)) / elapsed if elapsed > 0 else 0
+        self.done[i] = 1
+        return self.speeds[i]
+
+    def end(self, i, now):
+        """Mark a segment as ended without completing (it won't be started again)."""
+        if not self.finished[i]:
+            self.finished[i] = now
+
+    def reopen(self, i):
+        """Let an incomplete segment run again (after a resume)."""
+        if not self.done[i]:
+            self.finished[i] = 0
+
+    def last_finish(self):
+        """Latest finish time, or 0 if no segment has ended."""
+        return max(self.finished, default=0)
+
+    def snapshot(self):
+        """Per-segment metrics of the segments that have ended."""
+        return [
+            {
+                'chunk_id': i,
+                'size_mb': self.bytes[i] / (1024 * 1024),
+                'time_seconds': self.finished[i] - self.started[i],
+                'speed_mbps': self.speeds[i],
+                'retries': self.retries[i],
+                'address': self.addresses[i]
+            }
+            for i in range(len(self)) if self.started[i] and self.finished[i]
+        ]
+
+    def to_dict(self):
+        """The whole table column-wise (JSON-ready lists), for the API."""
+        return {
+            'start': self.starts.tolist(),
+            'end': self.ends.tolist(),
+            'position': self.positions.tolist(),
+            'bytes': self.bytes.tolist(),
+            'started': self.started.tolist(),
+            'finished': self.finished.tolist(),
+            'speed_MBps': self.speeds.tolist(),
+            'retries': self.retries.tolist(),
+            'done': list(self.done),
+            'address': list(self.addresses)
+        }
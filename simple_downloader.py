@@ -1,10 +1,19 @@
 # simple_downloader.py - Simple single-stream downloader (browser-style)
 
 import os
-import requests
+import threading
 from urllib.parse import urlparse, unquote
 import time
-from config import DOWNLOAD_FOLDER, CONNECTION_TIMEOUT, READ_TIMEOUT, BUFFER_SIZE
+from config import DOWNLOAD_FOLDER, CONNECTION_TIMEOUT, READ_TIMEOUT, BUFFER_SIZE, METRICS_FLUSH_BYTES
+from metrics import (
+    ACTIVE_DOWNLOADS, ACTIVE_STREAMS, DOWNLOADED_BYTES, DOWNLOADS, FAILURES,
+    PROBE_DURATION, TIME_TO_FIRST_BYTE, failure_cause
+)
+from metrics_store import metrics_store
+from throughput import ThroughputRing
+from tracing import NULL_TRACE, start_trace
+from resolver import abort_response, http_session
+from coalescing import response_validators
 
 class SimpleDownloader:
     """
@@ -12,20 +21,44 @@ class SimpleDownloader:
     No parallel streams - just like Chrome/Edge default behavior.
     """
     
-    def __init__(self, url, progress_callback=None):
+    def __init__(self, url, progress_callback=None, trace=None):
         """
         Initialize the simple downloader.
         
         Args:
             url: The URL to download from
             progress_callback: Function to call with progress updates
+            trace: Record phase-level tracing spans (None = config default)
         """
         self.url = url
+        self.host = urlparse(url).hostname or ''
         self.progress_callback = progress_callback
         self.downloaded_bytes = 0
         self.file_size = 0
+        self.filename = None
+        self.validators = {}  # ETag / Last-Modified from the probe (see coalescing.py)
         self.is_downloading = False
         self.start_time = None
+        self.end_time = None
+        self.first_byte_time = None
+        self.total_rate = ThroughputRing()
+        self.trace_enabled = trace
+        self.trace = NULL_TRACE
+        
+        # Control (see pause/resume/cancel)
+        self.lock = threading.Lock()
+        self.response = None
+        self.streaming = False
+        self.paused = False
+        self.cancelled = False
+        self.resume_event = threading.Event()
+        self.supports_ranges = False
+        self.paused_at = None
+        self.paused_seconds = 0.0
+    
+    def http_client(self):
+        """A session using the shared DNS cache (connection phases are traced when tracing is on)."""
+        return http_session()
     
     def get_filename_from_url(self):
         """Extract filename from URL."""
@@ -39,14 +72,26 @@ class SimpleDownloader:
     
     def get_file_info(self):
         """Get file size and name from server."""
+        probe_start = time.time()
+        try:
+            with self.trace.span('probe', parent=self.trace.root):
+                return self.fetch_file_info()
+        finally:
+            PROBE_DURATION.labels(host=self.host).observe(time.time() - probe_start)
+    
+    def fetch_file_info(self):
+        """HEAD (or streamed GET) request behind get_file_info."""
+        http = self.http_client()
         try:
-            response = requests.head(
+            response = http.head(
                 self.url,
                 timeout=CONNECTION_TIMEOUT,
                 allow_redirects=True
             )
             
             file_size = int(response.headers.get('Content-Length', 0))
+            self.supports_ranges = response.headers.get('Accept-Ranges', '').lower() == 'bytes'
+            self.validators = response_validators(response)
             
             # Get filename
             content_disposition = response.headers.get('Content-Disposition', '')
@@ -59,7 +104,7 @@ class SimpleDownloader:
             
         except:
             # If HEAD fails, try GET with stream
-            response = requests.get(
+            response = http.get(
                 self.url,
                 timeout=CONNECTION_TIMEOUT,
                 allow_redirects=True,
@@ -67,6 +112,8 @@ class SimpleDownloader:
             )
             
             file_size = int(response.headers.get('Content-Length', 0))
+            self.supports_ranges = response.headers.get('Accept-Ranges', '').lower() == 'bytes'
+            self.validators = response_validators(response)
             
             content_disposition = response.headers.get('Content-Disposition', '')
             if 'filename=' in content_disposition:
@@ -87,10 +134,48 @@ class SimpleDownloader:
         Returns:
             Path to downloaded file on success, None on failure
         """
+        ACTIVE_DOWNLOADS.labels(mode='single').inc()
+        self.trace = start_trace('download', enabled=self.trace_enabled, url=self.url, mode='single')
+        result = None
+        try:
+            result = self._download(output_path)
+            return result
+        finally:
+            ACTIVE_DOWNLOADS.labels(mode='single').dec()
+            outcome = 'completed' if result else ('cancelled' if self.cancelled else 'failed')
+            DOWNLOADS.labels(host=self.host, mode='single', result=outcome).inc()
+            self.trace.finish(result=outcome, num_streams=1, file_size=self.file_size)
+            self.record_run(outcome, result)
+    
+    def record_run(self, outcome, result):
+        """Append this run's metrics to the run-history store."""
+        try:
+            metrics = self.get_detailed_metrics() or {}
+            file_size = os.path.getsize(result) if result and os.path.exists(result) else self.file_size
+            total_time = (self.end_time or time.time()) - self.start_time - self.paused_seconds if self.start_time else None
+            throughput = file_size / (total_time * 1024 * 1024) if result and total_time else None
+            metrics_store.record_run({
+                'url': self.url,
+                'host': self.host,
+                'mode': 'single',
+                'result': outcome,
+                'num_streams': 1,
+                'file_size': file_size,
+                'total_seconds': total_time,
+                'throughput_MBps': throughput,
+                'ttfb_seconds': metrics.get('time_to_first_byte'),
+                'segments': []
+            })
+        except Exception as e:
+            print(f"Failed to record run metrics: {str(e)}")
+    
+    def _download(self, output_path):
+        """Probe, stream and verify steps for download()."""
         try:
             print("Checking file information...")
             file_size, filename = self.get_file_info()
             self.file_size = file_size
+            self.filename = filename
             
             print(f"File: {filename}")
             print(f"File size: {file_size / (1024*1024):.2f} MB")
@@ -101,53 +186,51 @@ class SimpleDownloader:
             # Setup output path
             if output_path is None:
                 output_path = os.path.join(DOWNLOAD_FOLDER, filename)
+            os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
             
             print(f"Output path: {output_path}")
             print("\nStarting download (single stream - browser method)...")
             
             # Start download
-            self.is_downloading = True
+            with self.lock:
+                if self.cancelled:
+                    return None
+                self.is_downloading = True
+                self.streaming = True
             self.downloaded_bytes = 0
             self.start_time = time.time()
+            self.end_time = None
+            self.first_byte_time = None
+            self.total_rate = ThroughputRing()
             
-            # Simple GET request - no range, just stream the whole file
-            response = requests.get(
-                self.url,
-                stream=True,
-                timeout=(CONNECTION_TIMEOUT, READ_TIMEOUT),
-                allow_redirects=True
-            )
-            
-            if response.status_code != 200:
-                raise Exception(f"Server returned status code: {response.status_code}")
-            
-            # Download and write to file
-            with open(output_path, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=BUFFER_SIZE):
-                    if not self.is_downloading:
-                        print("Download cancelled")
-                        break
-                    
-                    if chunk:
-                        f.write(chunk)
-                        self.downloaded_bytes += len(chunk)
-                        
-                        # Update progress
-                        if self.progress_callback and file_size > 0:
-                            self.progress_callback(self.downloaded_bytes, file_size)
+            # A pause ends the stream; on resume it continues where the file ends
+            # (or starts over if the server ignores Range)
+            headers_time = self.stream_to_file(output_path)
+            while True:
+                with self.lock:
+                    # Stopped by pause() (possibly resumed already) rather than finished
+                    self.streaming = False
+                    stopped = not self.is_downloading and not self.cancelled
+                if not stopped or not self.wait_for_resume():
+                    break
+                headers_time = self.stream_to_file(output_path)
             
             # Calculate metrics
-            total_time = time.time() - self.start_time
+            self.end_time = time.time()
+            total_time = self.end_time - self.start_time - self.paused_seconds
+            if self.first_byte_time is not None:
+                self.trace.record('first_byte', headers_time, self.first_byte_time, parent=self.trace.root)
+                self.trace.record('transfer', self.first_byte_time, self.end_time,
+                                  parent=self.trace.root, bytes=self.downloaded_bytes)
             
-            if self.is_downloading:
+            if not self.cancelled:
                 # Verify file
                 final_size = os.path.getsize(output_path)
                 print(f"\nDownload complete!")
                 print(f"Final file size: {final_size / (1024*1024):.2f} MB")
                 
-                # Print metrics
+                # Print metrics (the run is recorded in the history store)
                 self.print_metrics(total_time, final_size)
-                self.export_metrics(output_path, total_time, final_size)
                 
                 return output_path
             else:
@@ -157,9 +240,12 @@ class SimpleDownloader:
                 return None
                 
         except Exception as e:
-            print(f"\nDownload failed: {str(e)}")
-            import traceback
-            traceback.print_exc()
+            if self.cancelled:
+                print("Download cancelled")  # The aborted response surfaced as an error
+            else:
+                print(f"\nDownload failed: {str(e)}")
+                import traceback
+                traceback.print_exc()
             
             # Clean up partial file
             if output_path and os.path.exists(output_path):
@@ -170,6 +256,82 @@ class SimpleDownloader:
             
             return None
     
+    def stream_to_file(self, output_path):
+        """
+        Stream the file into output_path from where it currently ends.
+        Returns when the response ends or pause()/cancel() cuts it off.
+        """
+        offset = self.downloaded_bytes
+        headers = {'Range': f'bytes={offset}-'} if offset and self.supports_ranges else {}
+        
+        # Simple GET request - no range (unless resuming), just stream the whole file
+        with self.trace.span('request', parent=self.trace.root, resumed_at=offset):
+            response = self.http_client().get(
+                self.url,
+                headers=headers,
+                stream=True,
+                timeout=(CONNECTION_TIMEOUT, READ_TIMEOUT),
+                allow_redirects=True
+            )
+        headers_time = time.time()
+        self.response = response
+        
+        try:
+            if headers and response.status_code == 206:
+                mode = 'ab'
+            elif response.status_code == 200:
+                mode = 'wb'
+                if offset:
+                    print("Server ignored the range; restarting from the beginning")
+                    self.downloaded_bytes = 0
+            else:
+                FAILURES.labels(host=self.host, cause=failure_cause(status_code=response.status_code)).inc()
+                raise Exception(f"Server returned status code: {response.status_code}")
+            
+            # Byte counts are flushed to metrics in batches, not per buffer
+            bytes_metric = DOWNLOADED_BYTES.labels(host=self.host, mode='single')
+            pending_metric_bytes = 0
+            ACTIVE_STREAMS.inc()
+            
+            # Download and write to file
+            try:
+                with open(output_path, mode) as f:
+                    for chunk in response.iter_content(chunk_size=BUFFER_SIZE):
+                        if not self.is_downloading:
+                            break
+                        
+                        if chunk:
+                            if self.first_byte_time is None:
+                                self.first_byte_time = time.time()
+                                TIME_TO_FIRST_BYTE.labels(host=self.host).observe(self.first_byte_time - self.start_time)
+                            f.write(chunk)
+                            self.downloaded_bytes += len(chunk)
+                            self.total_rate.add(len(chunk))
+                            pending_metric_bytes += len(chunk)
+                            if pending_metric_bytes >= METRICS_FLUSH_BYTES:
+                                bytes_metric.inc(pending_metric_bytes)
+                                pending_metric_bytes = 0
+                            
+                            # Update progress
+                            if self.progress_callback and self.file_size > 0:
+                                self.progress_callback(self.downloaded_bytes, self.file_size)
+            except Exception as e:
+                if self.is_downloading:
+                    FAILURES.labels(host=self.host, cause=failure_cause(e)).inc()
+                    raise
+                # Cut off by pause() or cancel()
+            finally:
+                bytes_metric.inc(pending_metric_bytes)
+                ACTIVE_STREAMS.dec()
+        finally:
+            self.response = None
+            response.close()
+        
+        if not self.is_downloading:
+            state = 'cancelled' if self.cancelled else 'paused'
+            print(f"Download {state} at {self.downloaded_bytes / (1024*1024):.2f} MB")
+        return headers_time
+    
     def print_metrics(self, total_time, file_size):
         """Print download metrics."""
         throughput_mbps = (file_size * 8) / (total_time * 1024 * 1024) if total_time > 0 else 0
@@ -187,7 +349,10 @@ class SimpleDownloader:
         print("="*60 + "\n")
     
     def export_metrics(self, output_path, total_time, file_size):
-        """Export metrics to file."""
+        """
+        Export metrics to a text report next to the download.
+        Runs are recorded in the history store automatically; this is opt-in.
+        """
         metrics_file = output_path + "_simple_metrics.txt"
         
         throughput_mbps = (file_size * 8) / (total_time * 1024 * 1024) if total_time > 0 else 0
@@ -206,17 +371,72 @@ class SimpleDownloader:
         
         print(f"Metrics exported to: {metrics_file}")
     
+    def wait_for_resume(self):
+        """Park the download while paused. True once resumed, False if cancelled."""
+        self.resume_event.wait()
+        with self.lock:
+            self.paused_seconds += time.time() - self.paused_at
+            self.resume_event.clear()
+            if self.cancelled:
+                return False
+            self.is_downloading = True
+            self.streaming = True
+            return True
+    
+    def pause(self):
+        """
+        Stop the stream now and release its connection, keeping the bytes so far.
+        resume() continues from there with a Range request when the server allows it.
+        Returns False if the download can't be paused at this point.
+        """
+        with self.lock:
+            if not self.streaming or self.paused or self.cancelled:
+                return False
+            print("Pausing download...")
+            self.paused = True
+            self.paused_at = time.time()
+            self.is_downloading = False
+            response = self.response
+        if response is not None:
+            abort_response(response)
+        return True
+    
+    def resume(self):
+        """Resume a paused download. Returns False if it isn't paused."""
+        with self.lock:
+            if not self.paused or self.cancelled:
+                return False
+            print("Resuming download...")
+            self.paused = False
+            self.resume_event.set()
+        return True
+    
     def cancel(self):
-        """Cancel the download."""
+        """Cancel the download; the partial file is removed once the stream has stopped."""
         print("Cancelling download...")
-        self.is_downloading = False
+        with self.lock:
+            self.cancelled = True
+            self.is_downloading = False
+            response = self.response
+            if self.paused:
+                self.paused = False
+                self.resume_event.set()
+        if response is not None:
+            abort_response(response)
     
     def get_speed(self):
-        """Calculate current download speed in MB/s."""
+        """Current (instantaneous) download speed in MB/s."""
         if self.start_time and self.downloaded_bytes > 0:
-            elapsed = time.time() - self.start_time
-            return (self.downloaded_bytes / (1024 * 1024)) / elapsed if elapsed > 0 else 0
+            return self.total_rate.instant_speed() / (1024 * 1024)
         return 0
+    
+    def get_rate_metrics(self, include_series=True, running_only=False):
+        """Live speeds (MB/s) and ETA from the throughput ring."""
+        remaining = max(0, self.file_size - self.downloaded_bytes) if self.file_size else None
+        rates = self.total_rate.snapshot(remaining, include_series)
+        rates.setdefault('eta_seconds', None)
+        rates['streams'] = []
+        return rates
 
     def get_detailed_metrics(self):
         """
@@ -226,15 +446,22 @@ class SimpleDownloader:
         if not self.start_time:
             return None
         
-        total_time = time.time() - self.start_time
+        total_time = (self.end_time or time.time()) - self.start_time - self.paused_seconds
         
         # Calculate throughput
         throughput_mbps = (self.file_size * 8) / (total_time * 1024 * 1024) if total_time > 0 else 0
         throughput_MBps = self.file_size / (total_time * 1024 * 1024) if total_time > 0 else 0
         
+        rates = self.get_rate_metrics()
+        
         return {
             'total_time': total_time,
             'file_size_mb': self.file_size / (1024 * 1024),
+            'time_to_first_byte': self.first_byte_time - self.start_time if self.first_byte_time else None,
             'throughput_mbps': throughput_mbps,
-            'throughput_MBps': throughput_MBps
+            'throughput_MBps': throughput_MBps,
+            'instant_speed': rates['instant_speed'],
+            'ewma_speed': rates['ewma_speed'],
+            'eta_seconds': rates['eta_seconds'],
+            'throughput_series': rates['series']
         }
\ No newline at end of file
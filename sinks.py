@@ -0,0 +1,519 @@
+# sinks.py - Where a download's segments go: local part files, or an S3-compatible multipart upload
+
+import collections
+import hashlib
+import hmac
+import os
+import threading
+import time
+import xml.etree.ElementTree as ET
+from urllib.parse import quote, urlsplit
+
+import requests
+
+from config import (CONNECTION_TIMEOUT, READ_TIMEOUT, RETRY_DELAY, S3_ENDPOINT, S3_PART_SIZE, S3_REGION,
+                    S3_UPLOAD_QUEUE_BYTES, S3_UPLOAD_RETRIES, S3_UPLOAD_THREADS)
+from metrics import UPLOADED_BYTES, UPLOAD_BACKLOG
+from resolver import http_session
+
+S3_MIN_PART_SIZE = 5 * 1024 * 1024  # Every part but the last must be at least this big
+S3_MAX_PARTS = 10000
+EMPTY_SHA256 = hashlib.sha256(b'').hexdigest()
+
+
+def open_sink(target, downloader):
+    """
+    The sink for a download's `sink` option: None writes part files next to
+    the output path (assembled at the end), 's3://bucket/key' streams the
+    segments into a multipart upload. Raises ValueError for anything else.
+    """
+    if target is None:
+        return LocalFileSink(downloader)
+    if target.startswith('s3://'):
+        bucket, _, key = target[len('s3://'):].partition('/')
+        if not bucket or not key:
+            raise ValueError(f"S3 sink needs s3://bucket/key, got {target}")
+        return S3MultipartSink(downloader, bucket, key)
+    raise ValueError(f"Unknown sink: {target} (expected s3://bucket/key)")
+
+
+class LocalFileSink:
+    """
+    The default sink: each segment goes to its own part file next to the
+    output path, through the download's write-back queue. The parts stay on
+    disk, so they can be verified, repaired and hedged into before
+    MultiStreamDownloader assembles them into the output file.
+    """
+
+    local = True
+    location = None
+    finished_at = 0
+
+    def __init__(self, downloader):
+        self.downloader = downloader
+
+    def begin(self, output_path, ranges):
+        """Name the parts for the segments `ranges`. Returns the ranges unchanged."""
+        os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+        self.location = output_path
+        self.downloader.temp_files = [f"{output_path}.part{i}" for i in range(len(ranges))]
+        return ranges
+
+    def restart_offset(self, chunk_id, offset):
+        """Segment offset an attempt of the chunk's stream starts from: where its download_chunk call began."""
+        return offset
+
+    def open(self, chunk_id, offset):
+        """A writer (write/seek/close) on the segment's part, positioned at `offset`."""
+        downloader = self.downloader
+        temp_file = downloader.temp_files[chunk_id]
+        # A hedge may be writing the tail of this part, or the part already
+        # holds the bytes before `offset`; don't truncate it
+        keep = (offset or chunk_id in downloader.hedges) and os.path.exists(temp_file)
+        f = downloader.write_queue.open(temp_file, 'r+b' if keep else 'wb')
+        if offset:
+            f.seek(offset)
+        return f
+
+    def discard(self):
+        pass  # The parts are removed by MultiStreamDownloader.cleanup
+
+    def close(self):
+        pass
+
+    def get_stats(self):
+        return None
+
+
+# ---- S3-compatible object storage ---------------------------------------------
+# Requests are signed with AWS Signature Version 4 when credentials are set
+# (AWS_ACCESS_KEY_ID / AWS_SECRET_ACCESS_KEY, plus AWS_SESSION_TOKEN for
+# temporary ones) and sent anonymously otherwise. With an endpoint set
+# (S3_ENDPOINT or MSD_S3_ENDPOINT: MinIO, Ceph, the stand-in in
+# throttled_server.py) buckets are addressed path-style, otherwise
+# virtual-hosted on AWS.
+
+def hmac_sha256(key, text):
+    return hmac.new(key, text.encode('utf-8'), hashlib.sha256).digest()
+
+
+def sigv4_signature(secret_key, region, amz_date, method, path, query, headers, payload_hash):
+    """
+    Signature V4 of an S3 request. `path` is the URI-encoded path, `query`
+    the canonical (sorted, encoded) query string and `headers` the signed
+    headers, lower-cased. Also used by the stand-in to check requests.
+    """
+    date = amz_date[:8]
+    names = sorted(headers)
+    canonical = '\n'.join([
+        method,
+        path,
+        query,
+        ''.join(f"{name}:{' '.join(str(headers[name]).split())}\n" for name in names),
+        ';'.join(names),
+        payload_hash
+    ])
+    scope = f"{date}/{region}/s3/aws4_request"
+    string_to_sign = '\n'.join(['AWS4-HMAC-SHA256', amz_date, scope,
+                                hashlib.sha256(canonical.encode('utf-8')).hexdigest()])
+    key = hmac_sha256(('AWS4' + secret_key).encode('utf-8'), date)
+    for part in (region, 's3', 'aws4_request'):
+        key = hmac_sha256(key, part)
+    return hmac.new(key, string_to_sign.encode('utf-8'), hashlib.sha256).hexdigest()
+
+
+def canonical_query(params):
+    return '&'.join(f"{quote(str(name), safe='-_.~')}={quote(str(value), safe='-_.~')}"
+                    for name, value in sorted(params.items()))
+
+
+class S3Client:
+    """Signed requests to one S3-compatible endpoint."""
+
+    def __init__(self, endpoint=None, region=None, access_key=None, secret_key=None, session_token=None):
+        endpoint = endpoint or S3_ENDPOINT or os.environ.get('MSD_S3_ENDPOINT')
+        self.endpoint = endpoint.rstrip('/') if endpoint else None
+        self.region = region or os.environ.get('AWS_REGION') or S3_REGION
+        self.access_key = access_key or os.environ.get('AWS_ACCESS_KEY_ID')
+        self.secret_key = secret_key or os.environ.get('AWS_SECRET_ACCESS_KEY')
+        self.session_token = session_token or os.environ.get('AWS_SESSION_TOKEN')
+
+    def object_url(self, bucket, key):
+        """(base URL, URI-encoded path) of an object."""
+        if self.endpoint:
+            return self.endpoint, f"/{quote(bucket)}/{quote(key, safe='/~')}"
+        return f"https://{bucket}.s3.{self.region}.amazonaws.com", f"/{quote(key, safe='/~')}"
+
+    def request(self, http, method, bucket, key, params=None, data=b''):
+        """Send one request; returns the response (status not checked)."""
+        base, path = self.object_url(bucket, key)
+        query = canonical_query(params or {})
+        payload_hash = hashlib.sha256(data).hexdigest() if data else EMPTY_SHA256
+        headers = {'x-amz-content-sha256': payload_hash}
+        if self.access_key and self.secret_key:
+            amz_date = time.strftime('%Y%m%dT%H%M%SZ', time.gmtime())
+            headers['host'] = urlsplit(base).netloc
+            headers['x-amz-date'] = amz_date
+            if self.session_token:
+                headers['x-amz-security-token'] = self.session_token
+            signature = sigv4_signature(self.secret_key, self.region, amz_date, method, path, query,
+                                        headers, payload_hash)
+            headers['Authorization'] = (
+                f"AWS4-HMAC-SHA256 Credential={self.access_key}/{amz_date[:8]}/{self.region}/s3/aws4_request, "
+                f"SignedHeaders={';'.join(sorted(headers))}, Signature={signature}")
+            del headers['host']  # Sent by requests, from the URL
+        url = base + path + (f"?{query}" if query else '')
+        return http.request(method, url, data=data or None, headers=headers,
+                            timeout=(CONNECTION_TIMEOUT, READ_TIMEOUT))
+
+
+def s3_error(response):
+    """'Code: message' from an S3 error response, or the status line."""
+    try:
+        root = ET.fromstring(response.content)
+        code = root.findtext('Code') or root.findtext('{*}Code')
+        message = root.findtext('Message') or root.findtext('{*}Message')
+        if code:
+            return f"{code}: {message}" if message else code
+    except ET.ParseError:
+        pass
+    return f"HTTP {response.status_code}"
+
+
+def xml_text(content, name):
+    """Text of the first element called `name` (any namespace) in an XML body, or None."""
+    root = ET.fromstring(content)
+    for element in root.iter():
+        if element.tag == name or element.tag.endswith('}' + name):
+            return element.text
+    return None
+
+
+class SegmentUpload:
+    """
+    A stream's writer on its segment of an S3MultipartSink: collects the
+    bytes into parts and queues each full part for upload. The bytes of an
+    unfinished part stay with the sink, so a retried, parked or resumed
+    stream carries on from where this one stopped.
+    """
+
+    def __init__(self, sink, chunk_id):
+        self.sink = sink
+        self.chunk_id = chunk_id
+
+    def write(self, data):
+        self.sink.add(self.chunk_id, data)
+
+    def seek(self, offset):
+        if offset != self.sink.held(self.chunk_id):
+            raise ValueError(f"Segment {self.chunk_id} continues at {self.sink.held(self.chunk_id)}, not {offset}")
+
+    def flush(self):
+        pass  # Parts go out whole; see close()
+
+    def close(self):
+        """Queue the segment's last (short) part once the segment is complete."""
+        self.sink.close_segment(self.chunk_id)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            self.close()
+        except Exception:
+            if exc is None:
+                raise
+        return False
+
+
+class S3MultipartSink:
+    """
+    Streams a download into an S3 multipart upload instead of local files.
+
+    Segments are aligned to the part size, so part N always holds bytes
+    (N-1)*part_size onward of the file, whichever stream fetched them. Each
+    stream's bytes are cut into parts as they arrive and queued to
+    S3_UPLOAD_THREADS upload threads; the upload finishes shortly after the
+    last segment does, and nothing touches the local disk. Memory use is at
+    most one part per segment being collected plus S3_UPLOAD_QUEUE_BYTES of
+    queued parts; streams wait (backpressure) when the queue is full.
+
+    Parts are checked against the ETag the store returns (the part's MD5),
+    and CompleteMultipartUpload only runs once every part is in. A failed,
+    cancelled or abandoned download aborts the upload.
+    """
+
+    local = False
+
+    def __init__(self, downloader, bucket, key, client=None, part_size=S3_PART_SIZE,
+                 threads=S3_UPLOAD_THREADS, max_bytes=S3_UPLOAD_QUEUE_BYTES, retries=S3_UPLOAD_RETRIES):
+        if part_size < S3_MIN_PART_SIZE:
+            raise ValueError(f"S3 part size must be at least {S3_MIN_PART_SIZE:,} bytes")
+        self.downloader = downloader
+        self.bucket = bucket
+        self.key = key
+        self.location = f"s3://{bucket}/{key}"
+        self.client = client or S3Client()
+        self.part_size = part_size
+        self.threads = max(1, threads)
+        self.max_bytes = max(max_bytes, part_size)
+        self.retries = retries
+        self.file_size = 0
+        self.upload_id = None
+        self.ranges = []
+
+        # Per segment: offset of its unfinished part, and that part's bytes so far
+        self.cut = {}
+        self.tails = {}
+        self.etags = {}  # part number -> ETag of the uploaded part
+
+        self.cond = threading.Condition()
+        self.parts = collections.deque()  # (part number, bytes) waiting for an upload thread
+        self.queued_bytes = 0  # Waiting or being uploaded
+        self.workers = []
+        self.stopped = False
+        self.error = None
+
+        # Stats
+        self.uploaded_bytes = 0
+        self.uploads = 0
+        self.retried_parts = 0
+        self.upload_seconds = 0.0
+        self.stall_seconds = 0.0
+        self.peak_bytes = 0
+        self.finished_at = 0
+
+    # ---- Segments -------------------------------------------------------------
+
+    def begin(self, output_path, ranges):
+        """
+        Start the multipart upload for a file made of `ranges`. Returns the
+        segments to download instead: as many, but made of whole parts and
+        spread as evenly as the parts allow (fewer if the file is small).
+        """
+        self.file_size = ranges[-1][1] + 1
+        # At most S3_MAX_PARTS parts: bigger files get bigger parts (whole MBs)
+        needed = -(-self.file_size // S3_MAX_PARTS)
+        if needed > self.part_size:
+            self.part_size = -(-needed // (1024 * 1024)) * (1024 * 1024)
+        count = -(-self.file_size // self.part_size)
+        segments = min(len(ranges), count)
+        starts = [i * count // segments * self.part_size for i in range(segments)]
+        self.ranges = [(start, end - 1) for start, end in zip(starts, starts[1:] + [self.file_size])]
+
+        with http_session() as http:
+            response = self.client.request(http, 'POST', self.bucket, self.key, {'uploads': ''})
+            if response.status_code != 200:
+                raise IOError(f"Could not start the upload to {self.location}: {s3_error(response)}")
+            self.upload_id = xml_text(response.content, 'UploadId')
+        if not self.upload_id:
+            raise IOError(f"Could not start the upload to {self.location}: no UploadId in the response")
+        print(f"Uploading to {self.location} in parts of {self.part_size / (1024*1024):.0f} MB "
+              f"(upload {self.upload_id})")
+        for n in range(self.threads):
+            worker = threading.Thread(target=self.run, args=(n,), daemon=True)
+            worker.start()
+            self.workers.append(worker)
+        return self.ranges
+
+    def held(self, chunk_id):
+        """Bytes of the segment queued for upload or collected so far."""
+        with self.cond:
+            return self.cut.get(chunk_id, 0) + len(self.tails.get(chunk_id, b''))
+
+    def restart_offset(self, chunk_id, offset):
+        """
+        Segment offset an attempt of the chunk's stream starts from: right
+        after what the sink already holds (nothing is fetched twice), or 0
+        if the server can't send ranges.
+        """
+        return self.held(chunk_id) if self.downloader.supports_ranges else 0
+
+    def open(self, chunk_id, offset):
+        """A writer on the segment, continuing at `offset` (see restart_offset)."""
+        with self.cond:
+            if offset == 0:
+                # From the start (no range support): the parts are sent again
+                self.cut[chunk_id] = 0
+                self.tails[chunk_id] = bytearray()
+        writer = SegmentUpload(self, chunk_id)
+        writer.seek(offset)
+        return writer
+
+    def add(self, chunk_id, data):
+        """Collect a stream's bytes, queueing each part as it fills."""
+        full = []
+        with self.cond:
+            tail = self.tails.setdefault(chunk_id, bytearray())
+            tail += data
+            while len(tail) >= self.part_size:
+                offset = self.cut.get(chunk_id, 0)
+                full.append((self.ranges[chunk_id][0] + offset, bytes(tail[:self.part_size])))
+                del tail[:self.part_size]
+                self.cut[chunk_id] = offset + self.part_size
+        for file_offset, part in full:
+            self.submit(file_offset, part)
+
+    def close_segment(self, chunk_id):
+        """Queue what's left of a complete segment as its last part; an incomplete one keeps it."""
+        start, end = self.ranges[chunk_id]
+        with self.cond:
+            tail = self.tails.get(chunk_id)
+            offset = self.cut.get(chunk_id, 0)
+            if not tail or offset + len(tail) < end - start + 1:
+                self.raise_error()
+                return
+            part = bytes(tail)
+            self.tails[chunk_id] = bytearray()
+            self.cut[chunk_id] = offset + len(part)
+        self.submit(start + offset, part)
+
+    def raise_error(self):
+        if self.error is not None:
+            raise IOError(f"Upload to {self.location} failed: {str(self.error)}")
+
+    # ---- Upload threads ---------------------------------------------------------
+
+    def submit(self, file_offset, data):
+        """Queue the part starting at `file_offset`, waiting while the queue is full."""
+        stalled = None
+        with self.cond:
+            while (self.queued_bytes and self.queued_bytes + len(data) > self.max_bytes
+                   and self.error is None and not self.stopped):
+                if stalled is None:
+                    stalled = time.time()
+                self.cond.wait()
+            self.raise_error()
+            self.parts.append((file_offset // self.part_size + 1, data))
+            self.queued_bytes += len(data)
+            self.peak_bytes = max(self.peak_bytes, self.queued_bytes)
+            if stalled is not None:
+                self.stall_seconds += time.time() - stalled
+            self.cond.notify_all()
+        UPLOAD_BACKLOG.inc(len(data))
+
+    def run(self, n):
+        http = http_session()
+        try:
+            while True:
+                with self.cond:
+                    while not self.parts and not self.stopped:
+                        self.cond.wait()
+                    if self.stopped:
+                        return
+                    number, data = self.parts.popleft()
+                started = time.time()
+                try:
+                    if self.error is None:
+                        self.upload_part(http, number, data)
+                except Exception as e:
+                    print(f"Upload error (part {number}): {str(e)}")
+                    self.error = e
+                finally:
+                    UPLOAD_BACKLOG.dec(len(data))
+                    with self.cond:
+                        self.queued_bytes -= len(data)
+                        self.upload_seconds += time.time() - started
+                        self.cond.notify_all()
+        finally:
+            http.close()
+
+    def upload_part(self, http, number, data):
+        """PUT one part, retrying transient failures; the returned ETag must be the part's MD5."""
+        md5 = hashlib.md5(data).hexdigest()
+        params = {'partNumber': number, 'uploadId': self.upload_id}
+        for attempt in range(self.retries + 1):
+            try:
+                response = self.client.request(http, 'PUT', self.bucket, self.key, params, data)
+            except requests.exceptions.RequestException as e:
+                error = e
+            else:
+                etag = response.headers.get('ETag', '')
+                if response.status_code != 200:
+                    error = IOError(f"part {number}: {s3_error(response)}")
+                    if response.status_code < 500 and response.status_code not in (408, 429):
+                        raise error  # Refused: retrying won't help
+                elif len(etag.strip('"')) == 32 and etag.strip('"').lower() != md5:
+                    # (Stores encrypting with KMS return other ETags; only MD5-like ones are checked)
+                    error = IOError(f"part {number} arrived damaged (ETag {etag}, MD5 {md5})")
+                else:
+                    with self.cond:
+                        self.etags[number] = etag or f'"{md5}"'
+                        self.uploaded_bytes += len(data)
+                        self.uploads += 1
+                    UPLOADED_BYTES.inc(len(data))
+                    return
+            if attempt < self.retries:
+                with self.cond:
+                    self.retried_parts += 1
+                time.sleep(RETRY_DELAY * 2 ** attempt)
+        raise error
+
+    # ---- Completion -------------------------------------------------------------
+
+    def wait(self):
+        """Block until every queued part is uploaded. Raises if one failed."""
+        with self.cond:
+            while self.queued_bytes and self.error is None:
+                self.cond.wait()
+            self.raise_error()
+
+    def finish(self):
+        """Upload what's queued and complete the upload. Returns the object's s3:// location."""
+        self.wait()
+        count = -(-self.file_size // self.part_size)
+        missing = [n for n in range(1, count + 1) if n not in self.etags]
+        if missing:
+            raise IOError(f"Upload to {self.location} is missing {len(missing)} of {count} parts")
+        body = ''.join(f"<Part><PartNumber>{n}</PartNumber><ETag>{self.etags[n]}</ETag></Part>"
+                       for n in range(1, count + 1))
+        body = f"<CompleteMultipartUpload>{body}</CompleteMultipartUpload>".encode('utf-8')
+        with http_session() as http:
+            response = self.client.request(http, 'POST', self.bucket, self.key, {'uploadId': self.upload_id}, body)
+        # S3 can answer 200 and still report an error in the body
+        if response.status_code != 200 or b'<Error>' in response.content:
+            raise IOError(f"Could not complete the upload to {self.location}: {s3_error(response)}")
+        self.upload_id = None
+        self.finished_at = time.time()
+        print(f"Uploaded {self.location}: {count} parts, {self.file_size / (1024*1024):.2f} MB")
+        return self.location
+
+    def discard(self):
+        """Abort the upload, so the store drops the parts already uploaded."""
+        self.close()
+        if self.upload_id is None:
+            return
+        try:
+            with http_session() as http:
+                response = self.client.request(http, 'DELETE', self.bucket, self.key, {'uploadId': self.upload_id})
+            if response.status_code not in (200, 204, 404):
+                print(f"Could not abort upload {self.upload_id}: {s3_error(response)}")
+        except Exception as e:
+            print(f"Could not abort upload {self.upload_id}: {str(e)}")
+        self.upload_id = None
+
+    def close(self):
+        """Stop the upload threads (parts still queued are dropped)."""
+        with self.cond:
+            self.stopped = True
+            dropped = sum(len(data) for _, data in self.parts)
+            self.parts.clear()
+            self.queued_bytes -= dropped
+            self.cond.notify_all()
+        UPLOAD_BACKLOG.dec(dropped)
+        for worker in self.workers:
+            worker.join()
+        self.workers = []
+
+    def get_stats(self):
+        return {
+            'location': self.location,
+            'part_size_mb': self.part_size / (1024 * 1024),
+            'parts_uploaded': self.uploads,
+            'uploaded_mb': self.uploaded_bytes / (1024 * 1024),
+            'retried_parts': self.retried_parts,
+            'upload_seconds': self.upload_seconds,
+            'peak_queue_mb': self.peak_bytes / (1024 * 1024),
+            'stall_seconds': self.stall_seconds
+        }
@@ -0,0 +1,84 @@
+# startup_benchmark.py - Start-up cost of the headless CLI (python -m cli), for batch jobs that run it often
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmark import get_commit
+from throttled_server import ThrottledOrigin, parse_size
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_RESULTS_FILE = os.path.join(REPO_DIR, 'startup_results.jsonl')
+
+
+def time_command(command, runs, env):
+    """Wall time of `command` in ms for each of `runs` fresh processes."""
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        process = subprocess.run(command, cwd=REPO_DIR, env=env,
+                                 stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        times.append((time.perf_counter() - start) * 1000)
+        if process.returncode != 0:
+            raise RuntimeError(f"{' '.join(command)} exited with {process.returncode}")
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Start-up time of python -m cli")
+    parser.add_argument('--runs', type=int, default=20, help="Processes started per case")
+    parser.add_argument('--size', default='64K', help="File size for the end-to-end case")
+    parser.add_argument('--output', default=DEFAULT_RESULTS_FILE, help="JSON-lines results file")
+    args = parser.parse_args()
+    size = parse_size(args.size)
+
+    origin = ThrottledOrigin().start()
+    results = []
+    try:
+        with tempfile.TemporaryDirectory(prefix='msd_startup_') as workdir:
+            # Keep the run history and downloads of the end-to-end case out of ~
+            env = dict(os.environ, HOME=workdir, USERPROFILE=workdir)
+            output = os.path.join(workdir, 'file.bin')
+            cases = {
+                'interpreter': [sys.executable, '-c', 'pass'],
+                'cli --help': [sys.executable, '-m', 'cli', '--help'],
+                'import engine': [sys.executable, '-c', 'import downloader'],
+                'get (end to end)': [sys.executable, '-m', 'cli', 'get', origin.url_for(size),
+                                     '-o', output, '-q']
+            }
+
+            print(f"Start-up benchmark: {args.runs} runs per case")
+            print(f"  {'Case':<18} {'Median (ms)':<12} {'p95 (ms)':<10} {'Min (ms)':<10}")
+            print(f"  {'-'*50}")
+            for name, command in cases.items():
+                times = sorted(time_command(command, args.runs, env))
+                record = {
+                    'commit': get_commit(),
+                    'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                    'case': name,
+                    'runs': args.runs,
+                    'median_ms': statistics.median(times),
+                    'p95_ms': times[min(len(times) - 1, int(round(0.95 * len(times))) - 1)],
+                    'min_ms': times[0],
+                    'python': sys.version.split()[0]
+                }
+                results.append(record)
+                print(f"  {name:<18} {record['median_ms']:<12.1f} {record['p95_ms']:<10.1f} "
+                      f"{record['min_ms']:<10.1f}")
+    finally:
+        origin.stop()
+
+    with open(args.output, 'a') as f:
+        for record in results:
+            f.write(json.dumps(record) + '\n')
+    print(f"\nResults appended to: {args.output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -815,12 +815,15 @@ class DownloadManager {
         const mode = document.querySelector('input[name="mode"]:checked').value;
         const streamsInput = document.getElementById('numStreams');
         streamsInput.disabled = mode === 'single';
+        document.getElementById('useHttp2').disabled = mode === 'single';
     }
 
     async startDownload() {
         const url = document.getElementById('url').value;
         const mode = document.querySelector('input[name="mode"]:checked').value;
         const numStreams = document.getElementById('numStreams').value;
+        const trace = document.getElementById('traceDownload').checked;
+        const transport = document.getElementById('useHttp2').checked ? 'http2' : null;
 
         if (!url) {
             this.showAlert('Please enter a URL', 'danger');
@@ -841,7 +844,9 @@ class DownloadManager {
                 body: JSON.stringify({
                     url: url,
                     mode: mode,
-                    num_streams: parseInt(numStreams)
+                    num_streams: numStreams ? parseInt(numStreams) : null,
+                    trace: trace,
+                    transport: transport
                 })
             });
 
@@ -889,6 +894,10 @@ class DownloadManager {
         progressBar.style.width = '0%'; // Start at 0%
 
         // Add event listeners
+        clone.querySelector('.pause-download').addEventListener('click', () => {
+            this.togglePause(downloadId);
+        });
+
         clone.querySelector('.cancel-download').addEventListener('click', () => {
             this.cancelDownload(downloadId);
         });
@@ -940,12 +949,36 @@ class DownloadManager {
         }
     }
 
+    async togglePause(downloadId) {
+        const info = this.activeDownloads.get(downloadId);
+        if (!info) return;
+        const action = info.paused ? 'resume' : 'pause';
+        try {
+            const response = await fetch(`/api/downloads/${downloadId}/${action}`, {
+                method: 'POST'
+            });
+
+            if (response.ok) {
+                info.paused = !info.paused;
+                const button = info.element.querySelector('.pause-download');
+                button.title = info.paused ? 'Resume Download' : 'Pause Download';
+                button.querySelector('i').className = info.paused ? 'fas fa-play' : 'fas fa-pause';
+            } else {
+                const data = await response.json();
+                this.showAlert('Error: ' + data.error, 'warning');
+            }
+        } catch (error) {
+            this.showAlert(`Error trying to ${action} download: ` + error.message, 'danger');
+        }
+    }
+
     async viewMetrics(downloadId) {
         try {
             const response = await fetch(`/api/downloads/${downloadId}/metrics`);
             if (response.ok) {
                 const metrics = await response.json();
                 this.displayMetrics(metrics, downloadId);
+                this.viewTrace(downloadId);
             } else {
                 this.showAlert('Metrics not available yet', 'warning');
             }
@@ -968,8 +1001,15 @@ class DownloadManager {
             metricsText += `Total Time : ${metrics.total_time_seconds?.toFixed(2) || 'N/A'} seconds\n`;
             metricsText += `File Size : ${metrics.total_size_mb?.toFixed(2) || 'N/A'} MB\n`;
             metricsText += `Streams Used : ${metrics.num_streams_used || 'N/A'}\n`;
+            if (metrics.transport) {
+                metricsText += `Transport : ${metrics.http_version || metrics.transport}\n`;
+            }
             metricsText += `Overall Throughput : ${metrics.throughput_mbps?.toFixed(2) || 'N/A'} Mbps (${metrics.throughput_MBps?.toFixed(2) || 'N/A'} MB/s)\n`;
-            metricsText += `Avg Speed/Stream : ${metrics.average_speed_per_stream?.toFixed(2) || 'N/A'} MB/s\n\n`;
+            metricsText += `Avg Speed/Stream : ${metrics.average_speed_per_stream?.toFixed(2) || 'N/A'} MB/s\n`;
+            if (metrics.hedges_launched) {
+                metricsText += `Hedged Tails : ${metrics.hedges_launched} launched, ${metrics.hedges_won} won, ${metrics.duplicate_mb?.toFixed(2)} MB duplicated (budget ${metrics.duplicate_budget_mb?.toFixed(2)} MB)\n`;
+            }
+            metricsText += '\n';
 
             if (metrics.chunk_metrics && metrics.chunk_metrics.length > 0) {
                 metricsText += '<strong>STREAM BREAKDOWN</strong>\n';
@@ -1008,6 +1048,46 @@ class DownloadManager {
         metricsCard.scrollIntoView({ behavior: 'smooth', block: 'start' });
     }
 
+    async viewTrace(downloadId) {
+        const traceDisplay = document.getElementById('traceWaterfall');
+        traceDisplay.classList.add('d-none');
+        try {
+            const response = await fetch(`/api/downloads/${downloadId}/trace`);
+            if (response.ok) {
+                this.displayTrace(await response.json());
+            }
+        } catch (error) {
+            console.error('Error fetching trace:', error);
+        }
+    }
+
+    displayTrace(trace) {
+        // Text waterfall: one row per span, bar placed by start offset and duration
+        const traceDisplay = document.getElementById('traceWaterfall');
+        const width = 40;
+        const total = trace.duration || 1;
+        const depths = {};
+
+        let text = '<strong>TRACE WATERFALL</strong>\n';
+        text += '─'.repeat(80) + '\n';
+        trace.spans.forEach(span => {
+            const depth = span.parent_id ? (depths[span.parent_id] ?? 0) + 1 : 0;
+            depths[span.span_id] = depth;
+            let label = '  '.repeat(depth) + span.name;
+            if (span.attributes.chunk_id !== undefined) label += ` #${span.attributes.chunk_id}`;
+            const offset = Math.min(width - 1, Math.floor(span.start_offset / total * width));
+            const length = Math.max(1, Math.round(span.duration / total * width));
+            const bar = ' '.repeat(offset) + '█'.repeat(Math.min(length, width - offset));
+            const duration = `${(span.duration * 1000).toFixed(1)} ms`;
+            const error = String(span.attributes.error || '').replace(/</g, '&lt;');
+            const status = span.status === 'error' ? ` ✗ ${error}` : '';
+            text += `${label.slice(0, 24).padEnd(25)}${bar.padEnd(width + 1)}${duration.padStart(11)}${status}\n`;
+        });
+
+        traceDisplay.innerHTML = text;
+        traceDisplay.classList.remove('d-none');
+    }
+
     async updateDownloadStatuses() {
         if (this.activeDownloads.size === 0) return;
 
@@ -1111,13 +1191,18 @@ class DownloadManager {
         info.speedHistory.push(currentSpeed);
         if (info.speedHistory.length > 5) info.speedHistory.shift();
 
-        const avgSpeed = info.speedHistory.reduce((sum, val) => sum + val, 0) / info.speedHistory.length;
+        // Prefer the server-side EWMA (per-stream ring buffers) over client smoothing
+        const throughput = status.throughput;
+        const avgSpeed = throughput && throughput.ewma_speed !== undefined
+            ? throughput.ewma_speed
+            : info.speedHistory.reduce((sum, val) => sum + val, 0) / info.speedHistory.length;
+        const eta = throughput ? this.formatEta(throughput.eta_seconds) : '';
 
         if (status.total_size && status.downloaded_size !== undefined) {
             const downloadedMB = (status.downloaded_size / (1024 * 1024)).toFixed(2);
             const totalMB = (status.total_size / (1024 * 1024)).toFixed(2);
             speedText.textContent = status.status === 'downloading' && avgSpeed > 0
-                ? `${avgSpeed.toFixed(2)} MB/s • ${downloadedMB}/${totalMB} MB`
+                ? `${avgSpeed.toFixed(2)} MB/s • ${downloadedMB}/${totalMB} MB${eta ? ' • ETA ' + eta : ''}`
                 : `${downloadedMB} MB / ${totalMB} MB`;
         } else {
             speedText.textContent = 'Calculating...';
@@ -1127,6 +1212,15 @@ class DownloadManager {
         info.lastBytes = status.downloaded_size || 0;
     }
 
+    formatEta(seconds) {
+        if (seconds === null || seconds === undefined || !isFinite(seconds)) return '';
+        const total = Math.round(seconds);
+        const h = Math.floor(total / 3600);
+        const m = Math.floor((total % 3600) / 60);
+        const sec = String(total % 60).padStart(2, '0');
+        return h > 0 ? `${h}:${String(m).padStart(2, '0')}:${sec}` : `${m}:${sec}`;
+    }
+
     updateStatus(info, status, statusElement, statusLine, progressBar) {
         let statusClass = 'downloading';
         let statusText = 'Downloading...';
@@ -1152,6 +1246,11 @@ class DownloadManager {
                 statusText = 'Download cancelled';
                 iconHtml = '<i class="fas fa-times-circle"></i>';
                 break;
+            case 'paused':
+                statusClass = 'paused';
+                statusText = 'Paused - connections released';
+                iconHtml = '<i class="fas fa-pause-circle"></i>';
+                break;
         }
 
         statusElement.textContent = statusText;
@@ -0,0 +1,925 @@
+# throttled_server.py - Local HTTP origin with bandwidth caps, latency, jitter and fault injection (plus an S3 stand-in)
+
+import argparse
+import hashlib
+import http.server
+import random
+import re
+import select
+import socket
+import socketserver
+import struct
+import sys
+import threading
+import time
+import urllib.parse
+
+try:
+    import h2.config
+    import h2.connection
+    import h2.events
+    import h2.exceptions
+except ImportError:
+    h2 = None  # HTTP/2 origin unavailable; HTTP/1.1 works without it
+
+SLICE_SIZE = 64 * 1024  # Bytes written between throttle checks
+PATTERN_PERIOD = 1048583  # Prime period so shuffled chunks never line up by accident
+FAULT_MIN_BODY = 64 * 1024  # Only bodies this large get faults, so tiny probes stay clean
+FAULT_TYPES = ('reset', 'stall', 'unavailable', 'ignore_range', 'corrupt')
+
+
+def parse_size(value):
+    """Parse sizes like '512K', '8M', '1G' or plain byte counts."""
+    value = str(value).strip().upper()
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+    if value and value[-1] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+    return int(value)
+
+
+class PatternContent:
+    """
+    Deterministic pseudo-random file content of any size.
+    Any byte range can be generated on demand, so large files need no disk.
+    """
+
+    def __init__(self, seed=0):
+        rng = random.Random(seed)
+        self.block = rng.getrandbits(PATTERN_PERIOD * 8).to_bytes(PATTERN_PERIOD, 'little')
+        self.digests = {}
+        self.lock = threading.Lock()
+
+    def read(self, offset, length):
+        """Return `length` bytes of content starting at `offset`."""
+        out = bytearray()
+        pos = offset % PATTERN_PERIOD
+        while length > 0:
+            piece = self.block[pos:pos + length]
+            out += piece
+            length -= len(piece)
+            pos = 0
+        return bytes(out)
+
+    def sha256(self, size):
+        """SHA-256 of a file of `size` bytes (cached)."""
+        with self.lock:
+            if size not in self.digests:
+                digest = hashlib.sha256()
+                for offset in range(0, size, PATTERN_PERIOD):
+                    digest.update(self.read(offset, min(PATTERN_PERIOD, size - offset)))
+                self.digests[size] = digest.hexdigest()
+            return self.digests[size]
+
+    def block_sha256(self, size, block_size):
+        """SHA-256 of each `block_size` block of a file of `size` bytes (segment hashes)."""
+        return [hashlib.sha256(self.read(offset, min(block_size, size - offset))).hexdigest()
+                for offset in range(0, size, block_size)]
+
+
+class BytesContent:
+    """
+    Content of one given file (e.g. a zip archive built for a test), served
+    at url_for(len(data)); PatternContent's interface.
+    """
+
+    def __init__(self, data):
+        self.data = bytes(data)
+
+    def read(self, offset, length):
+        return self.data[offset:offset + length]
+
+    def sha256(self, size):
+        return hashlib.sha256(self.data[:size]).hexdigest()
+
+
+class FaultSchedule:
+    """
+    Deterministic fault plan for the origin.
+
+    Every faultable GET is numbered in arrival order and its fate is drawn from
+    an RNG seeded with (seed, request number), so a schedule replays the same
+    faults for the same request sequence.
+
+    Args:
+        seed: Seed for the schedule
+        reset_rate: Probability of a connection reset partway through the body
+        stall_rate: Probability of the body stalling partway through
+        unavailable_rate: Probability of a 503 with Retry-After
+        ignore_range_rate: Probability of answering a Range request with a full 200
+        corrupt_rate: Probability of one byte of the body being flipped (silent corruption)
+        stall_seconds: How long a stalled response sits before the socket is dropped
+        retry_after: Retry-After value (seconds) sent with 503s
+        max_faults: Stop injecting after this many faults (None = unlimited)
+        fixed: {request_number: fault_type} faults that always fire
+    """
+
+    def __init__(self, seed=0, reset_rate=0.0, stall_rate=0.0, unavailable_rate=0.0,
+                 ignore_range_rate=0.0, corrupt_rate=0.0, stall_seconds=20.0, retry_after=1,
+                 max_faults=None, fixed=None):
+        self.seed = seed
+        self.rates = {
+            'reset': reset_rate,
+            'stall': stall_rate,
+            'unavailable': unavailable_rate,
+            'ignore_range': ignore_range_rate,
+            'corrupt': corrupt_rate
+        }
+        self.stall_seconds = stall_seconds
+        self.retry_after = retry_after
+        self.max_faults = max_faults
+        self.fixed = fixed or {}
+
+        self.lock = threading.Lock()
+        self.request_number = 0
+        self.injected = {fault: 0 for fault in FAULT_TYPES}
+
+    def decide(self, has_range):
+        """
+        Pick the fault (or None) for the next faultable request.
+        Returns (fault, fraction) where fraction is how much of the body
+        is sent before a reset or stall.
+        """
+        with self.lock:
+            number = self.request_number
+            self.request_number += 1
+            if self.max_faults is not None and sum(self.injected.values()) >= self.max_faults:
+                return None, 1.0
+
+            rng = random.Random(self.seed * 1000003 + number)
+            fault = self.fixed.get(number)
+            if fault is None:
+                roll = rng.random()
+                for name in FAULT_TYPES:
+                    if roll < self.rates[name]:
+                        fault = name
+                        break
+                    roll -= self.rates[name]
+            if fault == 'ignore_range' and not has_range:
+                fault = None
+
+            if fault:
+                self.injected[fault] += 1
+            return fault, rng.uniform(0.1, 0.9)
+
+    def settings(self):
+        return dict(self.rates, seed=self.seed, stall_seconds=self.stall_seconds,
+                    retry_after=self.retry_after, max_faults=self.max_faults)
+
+
+def parse_file_path(path):
+    """Return (size, filename) for a /file/<size>[/<name>] path, or None."""
+    match = re.match(r'^/file/(\d+[KMG]?)(?:/([^/?]+))?', path, re.IGNORECASE)
+    if not match:
+        return None
+    size = parse_size(match.group(1))
+    filename = match.group(2) or f"bench_{size}.bin"
+    return size, filename
+
+
+def parse_range_header(header, size):
+    """
+    Parse a single 'bytes=' Range header.
+    Returns (start, end), 'invalid' for an unsatisfiable range, or None.
+    """
+    if not header:
+        return None
+    match = re.match(r'^bytes=(\d*)-(\d*)$', header.strip())
+    if not match or (not match.group(1) and not match.group(2)):
+        return None
+    if match.group(1):
+        start = int(match.group(1))
+        end = int(match.group(2)) if match.group(2) else size - 1
+    else:
+        start = max(0, size - int(match.group(2)))
+        end = size - 1
+    if start >= size or start > end:
+        return 'invalid'
+    return start, min(end, size - 1)
+
+
+class OriginHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Serves /file/<size> (e.g. /file/8M) with the origin's throttling applied.
+    One handler instance lives per TCP connection, so the bandwidth cap
+    is enforced per connection just like a throttling CDN edge.
+    """
+
+    protocol_version = 'HTTP/1.1'
+    # Headers and body go out in separate writes; without TCP_NODELAY the body
+    # of every request after the first on a keep-alive connection waits for
+    # the client's delayed ACK (~40 ms). Production servers set it too.
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        if self.server.origin.verbose:
+            super().log_message(format, *args)
+
+    def setup(self):
+        super().setup()
+        origin = self.server.origin
+        with origin.lock:
+            origin.connection_count += 1
+            self.rng = random.Random(origin.seed * 1000003 + origin.connection_count)
+
+    def jittered(self, value):
+        """Apply the origin's jitter fraction to a delay."""
+        jitter = self.server.origin.jitter
+        if jitter <= 0:
+            return value
+        return max(0.0, value * self.rng.uniform(1 - jitter, 1 + jitter))
+
+    def parse_request_target(self):
+        """Return (size, filename) for the requested path, or None."""
+        return parse_file_path(self.path)
+
+    def parse_range(self, size):
+        """
+        Parse a single 'bytes=' Range header.
+        Returns (start, end), 'invalid' for an unsatisfiable range, or None.
+        """
+        if not self.server.origin.supports_ranges:
+            return None
+        return parse_range_header(self.headers.get('Range'), size)
+
+    def send_headers(self, status, size, filename, byte_range=None, body_length=None):
+        origin = self.server.origin
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Disposition', f'attachment; filename="{filename}"')
+        self.send_header('ETag', origin.etag(size))
+        if origin.supports_ranges and origin.advertise_ranges:
+            self.send_header('Accept-Ranges', 'bytes')
+        total = str(size) if origin.send_length else '*'
+        if byte_range:
+            self.send_header('Content-Range', f'bytes {byte_range[0]}-{byte_range[1]}/{total}')
+        if origin.send_length or byte_range:
+            self.send_header('Content-Length', str(body_length if body_length is not None else size))
+        else:
+            self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+    def send_body(self, offset, length, chunked=False, cut_after=None, corrupt_at=None):
+        """
+        Write the body in slices, sleeping to respect the bandwidth cap.
+        Stops after `cut_after` bytes when a fault is being injected, and
+        flips the byte at body position `corrupt_at` if one is given.
+        """
+        origin = self.server.origin
+        deadline = time.monotonic()
+        sent = 0
+        limit = length if cut_after is None else cut_after
+        while sent < limit:
+            n = min(SLICE_SIZE, limit - sent)
+            data = origin.content.read(offset + sent, n)
+            if corrupt_at is not None and sent <= corrupt_at < sent + n:
+                i = corrupt_at - sent
+                data = data[:i] + bytes([data[i] ^ 0xFF]) + data[i + 1:]
+            if chunked:
+                self.wfile.write(f"{n:x}\r\n".encode() + data + b"\r\n")
+            else:
+                self.wfile.write(data)
+            sent += n
+            with origin.lock:
+                origin.bytes_sent += n
+
+            if origin.bandwidth > 0:
+                deadline += self.jittered(n / origin.bandwidth)
+                delay = deadline - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            if origin.link_bandwidth > 0:
+                time.sleep(origin.reserve_link(n))
+        if chunked and cut_after is None:
+            self.wfile.write(b"0\r\n\r\n")
+
+    def abort_connection(self):
+        """Drop the connection with a TCP reset instead of a clean close."""
+        self.close_connection = True
+        try:
+            self.connection.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+        except OSError:
+            pass
+
+    def handle_request(self, head_only):
+        origin = self.server.origin
+        with origin.lock:
+            origin.request_count += 1
+
+        target = self.parse_request_target()
+        if target is None:
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        size, filename = target
+
+        # Added latency before the response starts (server think time + RTT)
+        if origin.latency > 0:
+            time.sleep(self.jittered(origin.latency))
+
+        byte_range = self.parse_range(size)
+        if byte_range == 'invalid':
+            self.send_response(416)
+            if origin.send_length:
+                self.send_header('Content-Range', f'bytes */{size}')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        fault, fraction = None, 1.0
+        body_length = byte_range[1] - byte_range[0] + 1 if byte_range else size
+        if origin.faults and not head_only and body_length >= FAULT_MIN_BODY:
+            fault, fraction = origin.faults.decide(has_range=bool(byte_range))
+
+        if fault == 'unavailable':
+            self.send_response(503)
+            self.send_header('Retry-After', str(origin.faults.retry_after))
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if fault == 'ignore_range':
+            # Server "forgets" it supports ranges and sends the whole file
+            byte_range, body_length = None, size
+
+        cut_after = int(body_length * fraction) if fault in ('reset', 'stall') else None
+        corrupt_at = int(body_length * fraction) if fault == 'corrupt' else None
+
+        if byte_range:
+            start, end = byte_range
+            self.send_headers(206, size, filename, byte_range, body_length)
+            if not head_only:
+                self.send_body(start, body_length, cut_after=cut_after, corrupt_at=corrupt_at)
+        else:
+            self.send_headers(200, size, filename)
+            if not head_only:
+                self.send_body(0, size, chunked=not origin.send_length, cut_after=cut_after,
+                               corrupt_at=corrupt_at)
+
+        if fault == 'stall':
+            time.sleep(origin.faults.stall_seconds)
+        if fault in ('reset', 'stall'):
+            self.abort_connection()
+
+    def do_HEAD(self):
+        self.handle_request(head_only=True)
+
+    def do_GET(self):
+        try:
+            self.handle_request(head_only=False)
+        except (BrokenPipeError, ConnectionResetError):
+            # Client cancelled or hung up mid-body
+            self.close_connection = True
+
+
+class H2OriginHandler(socketserver.BaseRequestHandler):
+    """
+    Serves the same /file/<size> paths over cleartext HTTP/2 (h2c with prior
+    knowledge). Responses on a connection are interleaved frame by frame and
+    share its bandwidth cap, like a CDN edge throttling one multiplexed client.
+    Fault injection is HTTP/1.1 only.
+    """
+
+    def setup(self):
+        origin = self.server.origin
+        with origin.lock:
+            origin.connection_count += 1
+            self.rng = random.Random(origin.seed * 1000003 + origin.connection_count)
+        self.conn = h2.connection.H2Connection(
+            config=h2.config.H2Configuration(client_side=False, header_encoding='utf-8'))
+        self.waiting = []  # (ready_time, stream_id, headers) held back by latency
+        self.bodies = {}  # stream_id -> [next_offset, end_offset_exclusive]
+
+    def jittered(self, value):
+        jitter = self.server.origin.jitter
+        if jitter <= 0:
+            return value
+        return max(0.0, value * self.rng.uniform(1 - jitter, 1 + jitter))
+
+    def flush(self):
+        data = self.conn.data_to_send()
+        if data:
+            self.request.sendall(data)
+
+    def handle(self):
+        origin = self.server.origin
+        self.conn.initiate_connection()
+        self.flush()
+        deadline = time.monotonic()
+        sent = 0
+        try:
+            while True:
+                now = time.monotonic()
+                if sent:
+                    timeout = 0  # Keep sending; just poll for client frames
+                elif self.waiting:
+                    timeout = max(0.0, min(item[0] for item in self.waiting) - now)
+                else:
+                    timeout = 1.0  # Idle, or every stream is waiting for a WINDOW_UPDATE
+                readable, _, _ = select.select([self.request], [], [], timeout)
+                if readable:
+                    data = self.request.recv(65536)
+                    if not data:
+                        return
+                    for event in self.conn.receive_data(data):
+                        if isinstance(event, h2.events.ConnectionTerminated):
+                            self.flush()
+                            return
+                        self.handle_event(event)
+                    self.flush()
+
+                self.start_ready_responses()
+                sent = self.send_frames()
+                if sent and origin.bandwidth > 0:
+                    deadline = max(deadline, time.monotonic()) + self.jittered(sent / origin.bandwidth)
+                    delay = deadline - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+                if sent and origin.link_bandwidth > 0:
+                    time.sleep(origin.reserve_link(sent))
+        except (ConnectionResetError, BrokenPipeError):
+            return
+
+    def handle_event(self, event):
+        origin = self.server.origin
+        if isinstance(event, h2.events.RequestReceived):
+            with origin.lock:
+                origin.request_count += 1
+            ready = time.monotonic() + (self.jittered(origin.latency) if origin.latency > 0 else 0)
+            self.waiting.append((ready, event.stream_id, dict(event.headers)))
+        elif isinstance(event, h2.events.DataReceived):
+            self.conn.acknowledge_received_data(event.flow_controlled_length, event.stream_id)
+        elif isinstance(event, h2.events.StreamReset):
+            self.bodies.pop(event.stream_id, None)
+
+    def start_ready_responses(self):
+        now = time.monotonic()
+        ready = [item for item in self.waiting if item[0] <= now]
+        if not ready:
+            return
+        self.waiting = [item for item in self.waiting if item[0] > now]
+        for _, stream_id, headers in ready:
+            self.respond(stream_id, headers)
+        self.flush()
+
+    def respond(self, stream_id, headers):
+        origin = self.server.origin
+        target = parse_file_path(headers.get(':path', ''))
+        if target is None:
+            self.conn.send_headers(stream_id, [(':status', '404'), ('content-length', '0')], end_stream=True)
+            return
+        size, filename = target
+        byte_range = parse_range_header(headers.get('range'), size) if origin.supports_ranges else None
+        if byte_range == 'invalid':
+            response = [(':status', '416'), ('content-length', '0')]
+            if origin.send_length:
+                response.append(('content-range', f'bytes */{size}'))
+            self.conn.send_headers(stream_id, response, end_stream=True)
+            return
+
+        start, end = byte_range if byte_range else (0, size - 1)
+        response = [
+            (':status', '206' if byte_range else '200'),
+            ('content-type', 'application/octet-stream'),
+            ('content-disposition', f'attachment; filename="{filename}"'),
+            ('etag', origin.etag(size))
+        ]
+        if origin.supports_ranges and origin.advertise_ranges:
+            response.append(('accept-ranges', 'bytes'))
+        if byte_range:
+            total = str(size) if origin.send_length else '*'
+            response.append(('content-range', f'bytes {start}-{end}/{total}'))
+        if origin.send_length or byte_range:
+            response.append(('content-length', str(end - start + 1)))
+        head_only = headers.get(':method') == 'HEAD'
+        self.conn.send_headers(stream_id, response, end_stream=head_only)
+        if not head_only:
+            self.bodies[stream_id] = [start, end + 1]
+
+    def send_frames(self):
+        """Send one frame per open stream (round robin) as flow control allows."""
+        origin = self.server.origin
+        sent = 0
+        for stream_id, body in list(self.bodies.items()):
+            offset, stop = body
+            try:
+                window = self.conn.local_flow_control_window(stream_id)
+            except h2.exceptions.StreamClosedError:
+                self.bodies.pop(stream_id, None)
+                continue
+            n = min(window, self.conn.max_outbound_frame_size, stop - offset)
+            if n <= 0:
+                continue
+            body[0] += n
+            done = body[0] >= stop
+            self.conn.send_data(stream_id, origin.content.read(offset, n), end_stream=done)
+            if done:
+                del self.bodies[stream_id]
+            sent += n
+        if sent:
+            with origin.lock:
+                origin.bytes_sent += sent
+            self.flush()
+        return sent
+
+
+class ThreadingOriginServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 128  # Several downloads' streams connect at once; the default 5 resets some
+
+    def handle_error(self, request, client_address):
+        # Clients hanging up on keep-alive connections is normal here
+        if isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+            return
+        super().handle_error(request, client_address)
+
+
+class ThrottledOrigin:
+    """
+    A configurable local HTTP origin running in a background thread.
+
+    Args:
+        host: Interface to bind
+        port: Port to bind (0 picks a free port)
+        bandwidth: Per-connection cap in bytes/second (0 = unlimited)
+        link_bandwidth: Cap on all connections together in bytes/second (0 = unlimited),
+                        like a busy node's uplink; connections share it evenly
+        latency: Seconds added before every response
+        jitter: Fractional random variation applied to latency and pacing
+        supports_ranges: Whether Range requests are honored
+        advertise_ranges: Whether 'Accept-Ranges: bytes' is sent
+        send_length: Send Content-Length (False = chunked, sizes shown as '*')
+        seed: Seed for content and jitter, so runs are reproducible
+        faults: Optional FaultSchedule injecting resets, stalls, 503s and ignored ranges
+        http2: Speak cleartext HTTP/2 (h2c, prior knowledge) instead of HTTP/1.1
+        content: What the files contain (default PatternContent(seed); BytesContent
+                 serves a given file)
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, bandwidth=0, latency=0.0, jitter=0.0,
+                 supports_ranges=True, advertise_ranges=True, send_length=True,
+                 seed=0, faults=None, verbose=False, http2=False, link_bandwidth=0, content=None):
+        self.bandwidth = bandwidth
+        self.link_bandwidth = link_bandwidth
+        self.link_free_at = 0.0  # When the shared link has sent everything reserved so far
+        self.latency = latency
+        self.jitter = jitter
+        self.supports_ranges = supports_ranges
+        self.advertise_ranges = advertise_ranges
+        self.send_length = send_length
+        self.seed = seed
+        self.faults = faults
+        self.verbose = verbose
+        self.http2 = http2
+        self.content = content or PatternContent(seed)
+
+        self.lock = threading.Lock()
+        self.connection_count = 0
+        self.request_count = 0
+        self.bytes_sent = 0
+
+        if http2 and h2 is None:
+            raise RuntimeError("HTTP/2 origin needs the h2 package: pip install h2")
+        handler = H2OriginHandler if http2 else OriginHandler
+        self.server = ThreadingOriginServer((host, port), handler)
+        self.server.origin = self
+        self.thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def url_for(self, size, filename=None):
+        """URL serving a file of `size` bytes."""
+        url = f"{self.base_url}/file/{size}"
+        return f"{url}/{filename}" if filename else url
+
+    def etag(self, size):
+        """Strong validator of the file of `size` bytes (its bytes depend on seed and size only)."""
+        return f'"{self.seed:x}-{size:x}"'
+
+    def settings(self):
+        """Origin parameters, recorded alongside benchmark results."""
+        return {
+            'bandwidth': self.bandwidth,
+            'link_bandwidth': self.link_bandwidth,
+            'latency': self.latency,
+            'jitter': self.jitter,
+            'supports_ranges': self.supports_ranges,
+            'send_length': self.send_length,
+            'http2': self.http2,
+            'seed': self.seed,
+            'faults': self.faults.settings() if self.faults else None
+        }
+
+    def reserve_link(self, n):
+        """Queue `n` bytes on the shared link; returns how long to wait until they're sent."""
+        with self.lock:
+            now = time.monotonic()
+            self.link_free_at = max(self.link_free_at, now) + n / self.link_bandwidth
+            return self.link_free_at - now
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+class ObjectStoreHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Path-style S3 API subset for ObjectStore: multipart uploads (create,
+    upload part, complete, abort), PutObject, GetObject and HeadObject on
+    /<bucket>/<key>. Request bodies are read at the store's bandwidth cap,
+    per connection.
+    """
+
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        if self.server.store.verbose:
+            super().log_message(format, *args)
+
+    def parse_target(self):
+        """(bucket, key, query params) of the request."""
+        path, _, query = self.path.partition('?')
+        bucket, _, key = urllib.parse.unquote(path).lstrip('/').partition('/')
+        params = {name: values[0] for name, values in urllib.parse.parse_qs(query, keep_blank_values=True).items()}
+        return bucket, key, params
+
+    def read_body(self):
+        """Request body, read in slices so the bandwidth cap applies."""
+        store = self.server.store
+        length = int(self.headers.get('Content-Length') or 0)
+        chunks = []
+        deadline = time.monotonic()
+        received = 0
+        while received < length:
+            chunk = self.rfile.read(min(SLICE_SIZE, length - received))
+            if not chunk:
+                break
+            chunks.append(chunk)
+            received += len(chunk)
+            if store.bandwidth > 0:
+                deadline += len(chunk) / store.bandwidth
+                delay = deadline - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+        with store.lock:
+            store.bytes_received += received
+        return b''.join(chunks)
+
+    def reply(self, status, body=b'', headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if body and self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def error(self, status, code, message):
+        body = f"<Error><Code>{code}</Code><Message>{message}</Message></Error>".encode()
+        self.reply(status, body, {'Content-Type': 'application/xml'})
+
+    def authorized(self, body):
+        """True if the request is signed with the store's key (or the store takes anonymous requests)."""
+        store = self.server.store
+        if store.secret_key is None:
+            return True
+        from sinks import canonical_query, sigv4_signature
+        match = re.match(r'AWS4-HMAC-SHA256 Credential=([^/]+)/\d{8}/([^/]+)/s3/aws4_request, '
+                         r'SignedHeaders=([^,]+), Signature=([0-9a-f]+)', self.headers.get('Authorization', ''))
+        payload_hash = self.headers.get('x-amz-content-sha256', '')
+        if not match or match.group(1) != store.access_key or payload_hash != hashlib.sha256(body).hexdigest():
+            return False
+        path, _, _ = self.path.partition('?')
+        _, _, params = self.parse_target()
+        headers = {name: self.headers.get(name, '') for name in match.group(3).split(';')}
+        expected = sigv4_signature(store.secret_key, match.group(2), self.headers.get('x-amz-date', ''),
+                                   self.command, path, canonical_query(params), headers, payload_hash)
+        return expected == match.group(4)
+
+    def handle_request(self):
+        store = self.server.store
+        body = self.read_body()
+        with store.lock:
+            store.request_count += 1
+        if not self.authorized(body):
+            return self.error(403, 'SignatureDoesNotMatch', 'The request signature does not match')
+        bucket, key, params = self.parse_target()
+        if not bucket or not key:
+            return self.error(400, 'InvalidRequest', 'Path-style /bucket/key requests only')
+
+        if self.command == 'POST' and 'uploads' in params:
+            with store.lock:
+                store.upload_count += 1
+                upload_id = f"upload-{store.upload_count}"
+                store.uploads[upload_id] = {'bucket': bucket, 'key': key, 'parts': {}}
+            return self.reply(200, (f"<InitiateMultipartUploadResult><Bucket>{bucket}</Bucket><Key>{key}</Key>"
+                                    f"<UploadId>{upload_id}</UploadId></InitiateMultipartUploadResult>").encode(),
+                              {'Content-Type': 'application/xml'})
+
+        upload = store.uploads.get(params.get('uploadId'))
+        if 'uploadId' in params and (upload is None or (upload['bucket'], upload['key']) != (bucket, key)):
+            return self.error(404, 'NoSuchUpload', 'The specified upload does not exist')
+
+        if self.command == 'PUT' and upload is not None:
+            with store.lock:
+                fail = store.fail_parts > 0
+                if fail:
+                    store.fail_parts -= 1
+            if fail:
+                return self.error(500, 'InternalError', 'Injected part failure')
+            etag = f'"{hashlib.md5(body).hexdigest()}"'
+            upload['parts'][int(params['partNumber'])] = (etag, body)
+            return self.reply(200, headers={'ETag': etag})
+
+        if self.command == 'POST' and upload is not None:
+            listed = [(int(number), etag) for number, etag in
+                      re.findall(r'<PartNumber>(\d+)</PartNumber>\s*<ETag>([^<]+)</ETag>', body.decode())]
+            if not listed or [n for n, _ in listed] != sorted({n for n, _ in listed}):
+                return self.error(400, 'InvalidPartOrder', 'Parts must be listed in ascending order')
+            parts = upload['parts']
+            for i, (number, etag) in enumerate(listed):
+                if number not in parts or parts[number][0] != etag.replace('&quot;', '"'):
+                    return self.error(400, 'InvalidPart', f'Part {number} was not uploaded or has another ETag')
+                if i < len(listed) - 1 and len(parts[number][1]) < store.min_part_size:
+                    return self.error(400, 'EntityTooSmall', f'Part {number} is smaller than the minimum part size')
+            data = b''.join(parts[number][1] for number, _ in listed)
+            digest = hashlib.md5(b''.join(bytes.fromhex(parts[n][0].strip('"')) for n, _ in listed)).hexdigest()
+            etag = f'"{digest}-{len(listed)}"'
+            with store.lock:
+                store.objects[(bucket, key)] = (etag, data)
+                del store.uploads[params['uploadId']]
+            return self.reply(200, (f"<CompleteMultipartUploadResult><Bucket>{bucket}</Bucket><Key>{key}</Key>"
+                                    f"<ETag>{etag}</ETag></CompleteMultipartUploadResult>").encode(),
+                              {'Content-Type': 'application/xml'})
+
+        if self.command == 'DELETE' and upload is not None:
+            with store.lock:
+                del store.uploads[params['uploadId']]
+            return self.reply(204)
+
+        if self.command == 'PUT':
+            etag = f'"{hashlib.md5(body).hexdigest()}"'
+            with store.lock:
+                store.objects[(bucket, key)] = (etag, body)
+            return self.reply(200, headers={'ETag': etag})
+
+        if self.command in ('GET', 'HEAD'):
+            stored = store.objects.get((bucket, key))
+            if stored is None:
+                return self.error(404, 'NoSuchKey', 'The specified key does not exist')
+            return self.reply(200, stored[1], {'ETag': stored[0], 'Content-Type': 'application/octet-stream'})
+        return self.error(405, 'MethodNotAllowed', 'Not supported by this stand-in')
+
+    do_GET = do_HEAD = do_PUT = do_POST = do_DELETE = handle_request
+
+
+class ObjectStore:
+    """
+    A MinIO-style stand-in for S3-compatible object storage, for testing the
+    upload sink (sinks.py) without a real store. Objects and in-progress
+    uploads are held in memory; buckets exist as soon as they're used.
+
+    Args:
+        bandwidth: Per-connection cap on request bodies in bytes/second (0 = unlimited)
+        access_key, secret_key: Require requests signed with these (None = anonymous)
+        min_part_size: Smallest part allowed except the last (S3's 5 MB by default)
+        fail_parts: Answer this many part uploads with a 500 first, to exercise retries
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, bandwidth=0, access_key=None, secret_key=None,
+                 min_part_size=5 * 1024 * 1024, fail_parts=0, verbose=False):
+        self.bandwidth = bandwidth
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.min_part_size = min_part_size
+        self.fail_parts = fail_parts
+        self.verbose = verbose
+
+        self.lock = threading.Lock()
+        self.objects = {}  # (bucket, key) -> (ETag, bytes)
+        self.uploads = {}  # upload id -> {'bucket', 'key', 'parts': {number: (ETag, bytes)}}
+        self.upload_count = 0
+        self.request_count = 0
+        self.bytes_received = 0
+
+        self.server = ThreadingOriginServer((host, port), ObjectStoreHandler)
+        self.server.store = self
+        self.thread = None
+
+    @property
+    def endpoint(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def get(self, bucket, key):
+        """Bytes of a stored object, or None."""
+        stored = self.objects.get((bucket, key))
+        return stored[1] if stored else None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description="Throttled local HTTP origin for benchmarks")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--bandwidth', default='0', help="Per-connection cap, e.g. 2M (bytes/s)")
+    parser.add_argument('--link-bandwidth', default='0', help="Cap on all connections together (bytes/s)")
+    parser.add_argument('--latency', type=float, default=0.0, help="Seconds added per response")
+    parser.add_argument('--jitter', type=float, default=0.0, help="Fractional jitter, e.g. 0.2")
+    parser.add_argument('--no-ranges', action='store_true', help="Ignore Range headers")
+    parser.add_argument('--hide-ranges', action='store_true', help="Don't send Accept-Ranges")
+    parser.add_argument('--chunked', action='store_true', help="Omit Content-Length")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--reset-rate', type=float, default=0.0, help="Fraction of bodies reset midway")
+    parser.add_argument('--stall-rate', type=float, default=0.0, help="Fraction of bodies that stall")
+    parser.add_argument('--unavailable-rate', type=float, default=0.0, help="Fraction answered 503")
+    parser.add_argument('--ignore-range-rate', type=float, default=0.0,
+                        help="Fraction of Range requests answered with a full 200")
+    parser.add_argument('--corrupt-rate', type=float, default=0.0,
+                        help="Fraction of bodies with one byte flipped")
+    parser.add_argument('--stall-seconds', type=float, default=20.0)
+    parser.add_argument('--retry-after', type=int, default=1)
+    parser.add_argument('--http2', action='store_true', help="Serve cleartext HTTP/2 (h2c)")
+    parser.add_argument('--object-store', action='store_true',
+                        help="Serve the S3 stand-in (ObjectStore) instead; --bandwidth caps uploads")
+    parser.add_argument('--verbose', action='store_true')
+    return parser
+
+
+if __name__ == '__main__':
+    args = build_arg_parser().parse_args()
+    if args.object_store:
+        store = ObjectStore(host=args.host, port=args.port, bandwidth=parse_size(args.bandwidth),
+                            verbose=args.verbose)
+        print(f"S3 stand-in at {store.endpoint} (path-style, anonymous): MSD_S3_ENDPOINT={store.endpoint}")
+        try:
+            store.server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            store.server.server_close()
+        sys.exit(0)
+    faults = None
+    if args.reset_rate or args.stall_rate or args.unavailable_rate or args.ignore_range_rate or args.corrupt_rate:
+        faults = FaultSchedule(
+            seed=args.seed,
+            reset_rate=args.reset_rate,
+            stall_rate=args.stall_rate,
+            unavailable_rate=args.unavailable_rate,
+            ignore_range_rate=args.ignore_range_rate,
+            corrupt_rate=args.corrupt_rate,
+            stall_seconds=args.stall_seconds,
+            retry_after=args.retry_after
+        )
+    origin = ThrottledOrigin(
+        host=args.host,
+        port=args.port,
+        bandwidth=parse_size(args.bandwidth),
+        link_bandwidth=parse_size(args.link_bandwidth),
+        latency=args.latency,
+        jitter=args.jitter,
+        supports_ranges=not args.no_ranges,
+        advertise_ranges=not args.hide_ranges,
+        send_length=not args.chunked,
+        seed=args.seed,
+        faults=faults,
+        verbose=args.verbose,
+        http2=args.http2
+    )
+    print(f"Throttled origin serving at {origin.base_url}/file/<size>")
+    print(f"Settings: {origin.settings()}")
+    try:
+        origin.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        origin.server.server_close()
@@ -0,0 +1,136 @@
+# throughput.py - Fixed-size throughput sample ring for instantaneous/EWMA speed and ETA
+
+import threading
+import time
+from array import array
+
+from config import EWMA_ALPHA, INSTANT_WINDOW, THROUGHPUT_SAMPLES, THROUGHPUT_SAMPLE_INTERVAL
+
+
+class ThroughputRing:
+    """
+    Records bytes received into fixed-interval samples stored in a
+    preallocated ring (two array('d') buffers), so memory stays constant
+    however long a download runs.
+
+    add() is called from the receive loop and only does arithmetic until a
+    sample interval has elapsed; readers take the lock to get a consistent view.
+    """
+
+    def __init__(self, capacity=THROUGHPUT_SAMPLES, interval=THROUGHPUT_SAMPLE_INTERVAL, alpha=EWMA_ALPHA):
+        self.capacity = capacity
+        self.interval = interval
+        self.alpha = alpha
+        self.times = array('d', bytes(8 * capacity))  # sample end times (monotonic)
+        self.rates = array('d', bytes(8 * capacity))  # bytes/second for each sample
+        self.count = 0  # samples written so far (index = count % capacity)
+        self.lock = threading.Lock()
+
+        self.start = time.monotonic()
+        self.window_start = self.start
+        self.pending = 0  # bytes in the still-open sample
+        self.total = 0
+        self.ewma = 0.0
+        self.ewma_time = self.start
+
+    def add(self, nbytes, now=None):
+        """Count received bytes; closes the current sample once per interval."""
+        self.pending += nbytes
+        self.total += nbytes
+        if now is None:
+            now = time.monotonic()
+        if now - self.window_start >= self.interval:
+            self.close_sample(now)
+
+    def close_sample(self, now):
+        with self.lock:
+            elapsed = now - self.window_start
+            if elapsed <= 0:
+                return
+            rate = self.pending / elapsed
+            index = self.count % self.capacity
+            self.times[index] = now
+            self.rates[index] = rate
+            self.count += 1
+
+            # Intervals that passed without any sample count as zero throughput
+            idle_intervals = max(0, int(elapsed / self.interval) - 1)
+            self.ewma *= (1 - self.alpha) ** idle_intervals
+            self.ewma = self.alpha * rate + (1 - self.alpha) * self.ewma if self.count > 1 else rate
+            self.ewma_time = now
+
+            self.window_start = now
+            self.pending = 0
+
+    def instant_speed(self, now=None):
+        """Bytes/second over the last INSTANT_WINDOW seconds (drops to 0 on a stall)."""
+        if now is None:
+            now = time.monotonic()
+        window = min(INSTANT_WINDOW, now - self.start)
+        if window <= 0:
+            return 0.0
+        cutoff = now - window
+        with self.lock:
+            received = self.pending if self.window_start >= cutoff else 0
+            for i in range(1, min(self.count, self.capacity) + 1):
+                index = (self.count - i) % self.capacity
+                sample_end = self.times[index]
+                if sample_end <= cutoff:
+                    break
+                sample_start = max(sample_end - self.interval, cutoff)
+                received += self.rates[index] * (sample_end - sample_start)
+        return received / window
+
+    def ewma_speed(self, now=None):
+        """Exponentially weighted speed in bytes/second, decayed across stalls."""
+        if now is None:
+            now = time.monotonic()
+        with self.lock:
+            if self.count == 0:
+                elapsed = now - self.start
+                return self.pending / elapsed if elapsed > 0 else 0.0
+            idle_intervals = int((now - self.ewma_time) / self.interval)
+            return self.ewma * (1 - self.alpha) ** max(0, idle_intervals - 1)
+
+    def average_speed(self, now=None):
+        """Lifetime average in bytes/second."""
+        if now is None:
+            now = time.monotonic()
+        elapsed = now - self.start
+        return self.total / elapsed if elapsed > 0 else 0.0
+
+    def eta(self, remaining_bytes, now=None):
+        """Seconds until `remaining_bytes` arrive at the EWMA speed, or None if unknown."""
+        if remaining_bytes <= 0:
+            return 0.0
+        speed = self.ewma_speed(now)
+        return remaining_bytes / speed if speed > 0 else None
+
+    def series(self):
+        """
+        Stored samples, oldest first, as [seconds_since_start, MB/s] pairs.
+        Only the snapshot is allocated; recording never allocates.
+        """
+        with self.lock:
+            n = min(self.count, self.capacity)
+            first = self.count - n
+            return [
+                [round(self.times[i % self.capacity] - self.start, 3),
+                 round(self.rates[i % self.capacity] / (1024 * 1024), 3)]
+                for i in range(first, self.count)
+            ]
+
+    def snapshot(self, remaining_bytes=None, include_series=True):
+        """Speeds in MB/s (plus ETA and the sample series) for metrics and the API."""
+        now = time.monotonic()
+        mb = 1024 * 1024
+        result = {
+            'instant_speed': self.instant_speed(now) / mb,
+            'ewma_speed': self.ewma_speed(now) / mb,
+            'average_speed': self.average_speed(now) / mb
+        }
+        if remaining_bytes is not None:
+            result['eta_seconds'] = self.eta(remaining_bytes, now)
+        if include_series:
+            result['series'] = self.series()
+        return result
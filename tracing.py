@@ -0,0 +1,277 @@
+# tracing.py - Phase-level tracing spans (probe, DNS, connect, TLS, first byte, transfer, assembly)
+
+import json
+import os
+import secrets
+import threading
+import time
+
+import requests
+
+from config import OTLP_ENDPOINT, TRACE_FILE, TRACING_ENABLED, TRACING_EXPORTERS
+
+_local = threading.local()
+
+
+def current_span():
+    """Span entered most recently on this thread (None outside any span)."""
+    return getattr(_local, 'span', None)
+
+
+class Span:
+    """
+    One timed phase. Use as a context manager so nested network phases
+    (DNS/connect/TLS recorded by the connection classes in resolver.py)
+    attach to it.
+    """
+
+    __slots__ = ('trace', 'name', 'span_id', 'parent_id', 'start', 'end',
+                 'attributes', 'status', 'previous')
+
+    def __init__(self, trace, name, parent_id=None, start=None, attributes=None):
+        self.trace = trace
+        self.name = name
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.start = start if start is not None else time.time()
+        self.end = None
+        self.attributes = attributes or {}
+        self.status = 'ok'
+        self.previous = None
+
+    def child(self, name, **attributes):
+        return self.trace.span(name, parent=self, **attributes)
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def fail(self, error):
+        self.status = 'error'
+        self.attributes['error'] = str(error)[:200]
+
+    def finish(self, end=None):
+        if self.end is None:
+            self.end = end if end is not None else time.time()
+
+    def __enter__(self):
+        self.previous = current_span()
+        _local.span = self
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc is not None:
+            self.fail(exc)
+        self.finish()
+        _local.span = self.previous
+        return False
+
+    def to_dict(self, origin):
+        end = self.end if self.end is not None else time.time()
+        return {
+            'name': self.name,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'start_offset': self.start - origin,
+            'duration': end - self.start,
+            'status': self.status,
+            'attributes': self.attributes
+        }
+
+
+class Trace:
+    """All spans of one download, exported when the download finishes."""
+
+    enabled = True
+
+    def __init__(self, name, exporters=(), **attributes):
+        self.trace_id = secrets.token_hex(16)
+        self.exporters = list(exporters)
+        self.lock = threading.Lock()
+        self.spans = []
+        self.root = Span(self, name, attributes=attributes)
+        self.spans.append(self.root)
+
+    def span(self, name, parent=None, start=None, **attributes):
+        """Start a span under `parent` (default: this thread's current span, else the root)."""
+        if parent is None:
+            parent = current_span()
+            if parent is None or parent.trace is not self:
+                parent = self.root
+        span = Span(self, name, parent.span_id, start, attributes)
+        with self.lock:
+            self.spans.append(span)
+        return span
+
+    def record(self, name, start, end, parent=None, **attributes):
+        """Add an already-finished span with explicit timestamps."""
+        span = self.span(name, parent=parent, start=start, **attributes)
+        span.finish(end)
+        return span
+
+    def finish(self, **attributes):
+        """Close the root span and hand the trace to the exporters."""
+        self.root.set(**attributes)
+        self.root.finish()
+        for exporter in self.exporters:
+            try:
+                exporter.export(self)
+            except Exception as e:
+                print(f"Trace export failed ({type(exporter).__name__}): {str(e)}")
+
+    def to_dict(self):
+        """Waterfall view: spans ordered by start, times relative to the root."""
+        origin = self.root.start
+        with self.lock:
+            spans = sorted(self.spans, key=lambda s: s.start)
+        return {
+            'trace_id': self.trace_id,
+            'name': self.root.name,
+            'duration': (self.root.end or time.time()) - origin,
+            'spans': [span.to_dict(origin) for span in spans]
+        }
+
+
+class NullSpan:
+    """Shared do-nothing span used when tracing is disabled."""
+
+    trace = None
+
+    def child(self, name, **attributes):
+        return self
+
+    def set(self, **attributes):
+        pass
+
+    def fail(self, error):
+        pass
+
+    def finish(self, end=None):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+class NullTrace:
+    enabled = False
+    root = None
+
+    def span(self, name, parent=None, start=None, **attributes):
+        return NULL_SPAN
+
+    def record(self, name, start, end, parent=None, **attributes):
+        return NULL_SPAN
+
+    def finish(self, **attributes):
+        pass
+
+    def to_dict(self):
+        return None
+
+
+NULL_SPAN = NullSpan()
+NULL_TRACE = NullTrace()
+
+
+class JsonLinesExporter:
+    """Appends one JSON object per span to a file."""
+
+    def __init__(self, path=TRACE_FILE):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def export(self, trace):
+        lines = []
+        for span in trace.spans:
+            lines.append(json.dumps({
+                'trace_id': trace.trace_id,
+                'span_id': span.span_id,
+                'parent_id': span.parent_id,
+                'name': span.name,
+                'start': span.start,
+                'end': span.end,
+                'status': span.status,
+                'attributes': span.attributes
+            }, default=str))
+        with self.lock:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            with open(self.path, 'a') as f:
+                f.write('\n'.join(lines) + '\n')
+
+
+class OTLPExporter:
+    """
+    Sends traces as OTLP/HTTP JSON (e.g. to a local OpenTelemetry collector
+    on :4318). Runs in a background thread so downloads never wait on it.
+    """
+
+    def __init__(self, endpoint=OTLP_ENDPOINT, service_name='multi-stream-downloader'):
+        self.endpoint = endpoint
+        self.service_name = service_name
+
+    def attribute(self, key, value):
+        if isinstance(value, bool):
+            return {'key': key, 'value': {'boolValue': value}}
+        if isinstance(value, int):
+            return {'key': key, 'value': {'intValue': str(value)}}
+        if isinstance(value, float):
+            return {'key': key, 'value': {'doubleValue': value}}
+        return {'key': key, 'value': {'stringValue': str(value)}}
+
+    def payload(self, trace):
+        spans = []
+        for span in trace.spans:
+            item = {
+                'traceId': trace.trace_id,
+                'spanId': span.span_id,
+                'name': span.name,
+                'kind': 3 if span.name in ('request', 'attempt') else 1,  # CLIENT / INTERNAL
+                'startTimeUnixNano': str(int(span.start * 1e9)),
+                'endTimeUnixNano': str(int((span.end or span.start) * 1e9)),
+                'attributes': [self.attribute(k, v) for k, v in span.attributes.items()],
+                'status': {'code': 2 if span.status == 'error' else 1}
+            }
+            if span.parent_id:
+                item['parentSpanId'] = span.parent_id
+            spans.append(item)
+        return {
+            'resourceSpans': [{
+                'resource': {'attributes': [self.attribute('service.name', self.service_name)]},
+                'scopeSpans': [{'scope': {'name': 'msd.tracing'}, 'spans': spans}]
+            }]
+        }
+
+    def export(self, trace):
+        payload = self.payload(trace)
+
+        def send():
+            try:
+                requests.post(self.endpoint, json=payload, timeout=5)
+            except Exception as e:
+                print(f"OTLP export to {self.endpoint} failed: {str(e)}")
+
+        threading.Thread(target=send, daemon=True).start()
+
+
+def build_exporters(names=TRACING_EXPORTERS):
+    exporters = []
+    for name in names:
+        if name == 'jsonl':
+            exporters.append(JsonLinesExporter())
+        elif name == 'otlp':
+            exporters.append(OTLPExporter())
+        else:
+            print(f"Unknown trace exporter: {name}")
+    return exporters
+
+
+def start_trace(name, enabled=None, **attributes):
+    """A new Trace, or the shared no-op trace when tracing is off."""
+    if enabled is None:
+        enabled = TRACING_ENABLED or os.environ.get('MSD_TRACING') == '1'
+    if not enabled:
+        return NULL_TRACE
+    return Trace(name, build_exporters(), **attributes)
@@ -0,0 +1,216 @@
+# writer.py - Write-back stage: streams queue coalesced blocks, a writer thread does the disk I/O
+
+import collections
+import os
+import threading
+import time
+
+from config import WRITE_BLOCK_SIZE, WRITE_FSYNC, WRITE_FSYNC_INTERVAL, WRITE_QUEUE_BYTES
+from metrics import WRITE_BACKLOG, WRITE_STALL_SECONDS
+
+
+def sync_file(f):
+    """Flush a file object and fsync it to stable storage."""
+    f.flush()
+    os.fsync(f.fileno())
+
+
+class BlockWriter:
+    """
+    A stream's handle on one file. Small socket buffers are collected into
+    blocks that end on WRITE_BLOCK_SIZE boundaries of the file, and only
+    whole blocks (plus the remainder on flush) go to the writer thread.
+    Supports the write()/seek() subset the downloader uses on files.
+    """
+
+    def __init__(self, queue, f, offset=0, sync_on_close=False):
+        self.queue = queue
+        self.file = f
+        self.sync_on_close = sync_on_close
+        self.offset = offset  # File offset of the first byte in self.buffer
+        self.buffer = bytearray()
+        self.pending = 0  # Blocks queued but not yet written
+        self.unsynced = 0  # Bytes written since the last fsync
+
+    def write(self, data):
+        self.buffer += data
+        block_size = self.queue.block_size
+        if len(self.buffer) < block_size:
+            return
+        cut = (self.offset + len(self.buffer)) // block_size * block_size - self.offset
+        if cut > 0:
+            self.queue.submit(self, self.offset, bytes(self.buffer[:cut]))
+            del self.buffer[:cut]
+            self.offset += cut
+
+    def seek(self, offset):
+        self.flush()
+        self.offset = offset
+
+    def flush(self):
+        """Queue whatever is buffered, even if it's less than a block."""
+        if self.buffer:
+            self.queue.submit(self, self.offset, bytes(self.buffer))
+            self.offset += len(self.buffer)
+            self.buffer = bytearray()
+
+    def close(self):
+        """Flush, wait until this file's blocks are on disk, then close the file."""
+        try:
+            self.flush()
+            self.queue.wait_for(self)
+            if self.sync_on_close:
+                sync_file(self.file)
+        finally:
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            self.close()
+        except Exception:
+            if exc is None:
+                raise
+        return False
+
+
+class WriteBackQueue:
+    """
+    Decouples socket reads from disk writes for one download.
+
+    Streams never wait on the disk directly: they hand whole blocks to this
+    queue and a writer thread writes them out. The queue holds at most
+    `max_bytes`; a stream only blocks (backpressure) once it is full, so a
+    disk stall is absorbed by memory and the sockets keep draining until the
+    cap is reached. Sustained throughput is then bounded by the slower of
+    network and disk instead of suffering from both.
+
+    fsync policy: 'none' leaves durability to the OS, 'final' fsyncs the
+    finished file (see sync_file), 'interval' also fsyncs each file every
+    `fsync_interval` bytes as it is written.
+    """
+
+    def __init__(self, max_bytes=WRITE_QUEUE_BYTES, block_size=WRITE_BLOCK_SIZE,
+                 fsync=WRITE_FSYNC, fsync_interval=WRITE_FSYNC_INTERVAL):
+        if fsync not in ('none', 'final', 'interval'):
+            raise ValueError(f"Unknown fsync policy: {fsync}")
+        self.max_bytes = max(max_bytes, block_size)
+        self.block_size = block_size
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.cond = threading.Condition()
+        self.blocks = collections.deque()
+        self.queued_bytes = 0
+        self.closed = False
+        self.error = None
+
+        # Stats
+        self.peak_bytes = 0
+        self.written_bytes = 0
+        self.writes = 0
+        self.fsyncs = 0
+        self.write_seconds = 0.0
+        self.stall_seconds = 0.0
+
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def open(self, path, mode='wb', final=False):
+        """
+        A BlockWriter on `path`, opened here in the calling stream's thread.
+        `final` marks the finished file itself, fsynced on close unless the policy is 'none'.
+        """
+        return BlockWriter(self, open(path, mode), sync_on_close=final and self.fsync != 'none')
+
+    def submit(self, target, offset, data):
+        """Queue a block, waiting while the queue is full. Raises if the writer failed."""
+        stalled = None
+        with self.cond:
+            while (self.queued_bytes and self.queued_bytes + len(data) > self.max_bytes
+                   and self.error is None):
+                if stalled is None:
+                    stalled = time.time()
+                self.cond.wait()
+            if self.error is not None:
+                raise IOError(f"Disk write failed: {str(self.error)}")
+            self.blocks.append((target, offset, data))
+            target.pending += 1
+            self.queued_bytes += len(data)
+            self.peak_bytes = max(self.peak_bytes, self.queued_bytes)
+            self.cond.notify_all()
+        WRITE_BACKLOG.inc(len(data))
+        if stalled is not None:
+            waited = time.time() - stalled
+            WRITE_STALL_SECONDS.inc(waited)
+            with self.cond:
+                self.stall_seconds += waited
+
+    def run(self):
+        while True:
+            with self.cond:
+                while not self.blocks and not self.closed:
+                    self.cond.wait()
+                if not self.blocks:
+                    return
+                target, offset, data = self.blocks.popleft()
+
+            started = time.time()
+            try:
+                if self.error is None:
+                    self.write_block(target, offset, data)
+            except Exception as e:
+                print(f"Write-back error: {str(e)}")
+                self.error = e
+            finally:
+                elapsed = time.time() - started
+                WRITE_BACKLOG.dec(len(data))
+                with self.cond:
+                    self.queued_bytes -= len(data)
+                    target.pending -= 1
+                    self.write_seconds += elapsed
+                    self.cond.notify_all()
+
+    def write_block(self, target, offset, data):
+        f = target.file
+        if f.tell() != offset:
+            f.seek(offset)
+        f.write(data)
+        self.written_bytes += len(data)
+        self.writes += 1
+        if self.fsync == 'interval':
+            target.unsynced += len(data)
+            if target.unsynced >= self.fsync_interval:
+                sync_file(f)
+                target.unsynced = 0
+                self.fsyncs += 1
+
+    def wait_for(self, target):
+        """Block until every queued block of `target` is written."""
+        with self.cond:
+            while target.pending and self.error is None:
+                self.cond.wait()
+            if self.error is not None:
+                raise IOError(f"Disk write failed: {str(self.error)}")
+
+    def close(self):
+        """Write out what's left and stop the writer thread. Raises if any write failed."""
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+        self.thread.join()
+        if self.error is not None:
+            raise IOError(f"Disk write failed: {str(self.error)}")
+
+    def get_stats(self):
+        return {
+            'written_mb': self.written_bytes / (1024 * 1024),
+            'writes': self.writes,
+            'average_write_kb': self.written_bytes / self.writes / 1024 if self.writes else 0,
+            'peak_queue_mb': self.peak_bytes / (1024 * 1024),
+            'stall_seconds': self.stall_seconds,
+            'write_seconds': self.write_seconds,
+            'fsyncs': self.fsyncs,
+            'fsync_policy': self.fsync
+        }